@@ -0,0 +1,323 @@
+"""Times each stage of the summary tables on dummy cohorts of several sizes.
+
+For each size, a dummy cohort is generated from the study definition (see
+`dummy_data`) and kept in output/benchmark/, so later runs reuse it. Each
+stage of `summary_tables` is then run on it, recording the wall time and the
+peak memory allocated (as traced by `tracemalloc`, which sees NumPy and pandas
+buffers). The import of each study definition is timed too, in a fresh
+interpreter, as cohortextractor imports it for every action that extracts a
+cohort.
+
+Usage:
+
+    python analysis/benchmark.py --rows 10000 1000000 25000000
+    python analysis/benchmark.py --compare    # check against the baseline
+    python analysis/benchmark.py --save       # record a new baseline
+
+With `--compare`, the script exits with an error if any stage is more than
+`--tolerance` slower, or uses that much more memory, than in
+benchmarks/baseline.json. Baselines are machine-specific, so should be
+recorded and compared on the same machine, and re-recorded with `--save` by
+any change to a benchmarked stage.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import summary_tables
+from disclosure import redact_table
+from dummy_data import write_dummy_cohort
+from ons import ons_table
+from utilities import BASE_DIR, OUTPUT_DIR, count_cohort, read_columnar, read_columnar_schema
+
+ANALYSIS_DIR = Path(__file__).parent
+BENCHMARK_DIR = OUTPUT_DIR / "benchmark"
+BASELINE_FILE = BASE_DIR / "benchmarks" / "baseline.json"
+ROWS = [10_000, 1_000_000, 25_000_000]
+IMPORT_MODULES = ["study_definition", "study_definition_deaths"]
+# Imports are timed this many times, each in a fresh interpreter, keeping the
+# fastest.
+IMPORT_REPEATS = 5
+
+# Stands in for cohortextractor where it isn't installed, so that the cost of
+# building the study definitions' own variables and codelists is measured
+# everywhere. Calls to `patients` functions are recorded, not run.
+COHORTEXTRACTOR_STUB = """
+import sys, types
+
+
+class Codelist(list):
+    pass
+
+
+class Patients:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: (name, args, kwargs)
+
+
+class StudyDefinition:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+stub = types.ModuleType("cohortextractor")
+stub.StudyDefinition = StudyDefinition
+stub.patients = Patients()
+stub.codelist = lambda codes, system: Codelist(codes)
+stub.codelist_from_csv = lambda path, system, **kwargs: Codelist()
+sys.modules["cohortextractor"] = stub
+"""
+
+# Run in a fresh interpreter, with the module to import as its argument.
+# cohortextractor is imported (or stubbed) before the timer starts, so only
+# the study's own import is measured, with or without it installed.
+IMPORT_SCRIPT = """
+import json, sys, time, tracemalloc
+try:
+    import cohortextractor
+    stubbed = False
+except ImportError:
+    exec(sys.argv[2])
+    stubbed = True
+tracemalloc.start()
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+print(json.dumps({"seconds": seconds, "peak_mb": peak_mb, "stubbed": stubbed}))
+"""
+
+# Stages that take less than this (in seconds) are too noisy to compare.
+MIN_SECONDS = 0.05
+# Likewise for peak memory (in MB).
+MIN_PEAK_MB = 1
+
+
+@contextmanager
+def measure(results, stage):
+    """Records the wall time and peak traced memory of a block in `results`."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[stage] = {"seconds": round(seconds, 4), "peak_mb": round(peak / 2**20, 2)}
+
+
+def dummy_cohort(n_rows, seed=0):
+    """Gets the store of a dummy cohort with `n_rows` rows, generating it if needed."""
+    store = BENCHMARK_DIR / f"cohort_{n_rows}"
+    try:
+        if read_columnar_schema(store)["n_rows"] == n_rows:
+            return store
+    except FileNotFoundError:
+        pass
+    write_dummy_cohort(store, n_rows, seed=seed)
+    return store
+
+
+def run_stages(store):
+    """Runs each stage of the summary tables on a cohort, measuring each.
+
+    Args:
+        store: A columnar store of the cohort.
+
+    Returns:
+        A dict mapping each stage to its `seconds` and `peak_mb`.
+    """
+    results = {}
+    columns = sorted({c for by in summary_tables.SUMMARY_GROUPINGS.values() for c in by})
+
+    with measure(results, "load"):
+        cohort = read_columnar(store, columns)
+        # Touch every column, so memory-mapped columns are actually read.
+        for column in columns:
+            np.asarray(cohort[column])
+    del cohort
+
+    with measure(results, "count"):
+        counts = count_cohort(store, summary_tables.SUMMARY_GROUPINGS)
+
+    imd_ons = ons_table("imd")
+    with measure(results, "imd_grouping"):
+        summary_tables.imd_table(counts["imd_sex"], imd_ons)
+        summary_tables.imd_table(counts["imd_sex"], imd_ons, drop_unknown=True)
+
+    age_ons = ons_table("age_group")
+    with measure(results, "age_sex"):
+        age_sex_tpp = summary_tables.age_sex_tpp_table(counts["age_group_region_sex"])
+        summary_tables.age_table(age_sex_tpp, age_ons)
+        summary_tables.age_sex_table(age_sex_tpp, age_ons)
+
+    ethnicity_ons = ons_table("ethnicity")
+    with measure(results, "ethnicity"):
+        ethnicity_unrounded = summary_tables.ethnicity_unrounded_table(
+            counts["ethnicity_region"], counts["ethnicity_16_region"], ethnicity_ons
+        )
+        summary_tables.ethnicity_table(ethnicity_unrounded)
+        summary_tables.ethnicity_table(ethnicity_unrounded, drop_unknown=True)
+
+    with measure(results, "redaction"):
+        by_region = counts["ethnicity_16_region"].pivot_table(
+            index="ethnicity_16", columns="region", values="N", aggfunc="sum", fill_value=0
+        )
+        redact_table(by_region.to_numpy(), threshold=5, k=5, axis=0)
+
+    with measure(results, "ons_comparison"):
+        summary_tables.ons_comparison_table(counts["age_group_region_sex"])
+
+    nuts1_pop = ons_table("regions")
+    with measure(results, "region_coverage"):
+        summary_tables.tpp_coverage_table(counts["age_group_region_sex"], nuts1_pop)
+
+    with measure(results, "immortal_check"):
+        immortal = summary_tables.immortal_table(counts["age"])
+        summary_tables.immortal_rounded_table(immortal)
+
+    return results
+
+
+def measure_imports(modules=None, repeats=None):
+    """Measures the time and peak traced memory of importing modules.
+
+    Each module is imported from analysis/ in a fresh interpreter, so that
+    nothing it imports is already loaded, except cohortextractor, which is
+    stubbed where it isn't installed (see `COHORTEXTRACTOR_STUB`).
+
+    Args:
+        modules: The names of modules in analysis/. Defaults to
+            `IMPORT_MODULES`.
+        repeats: The number of times to import each. Defaults to
+            `IMPORT_REPEATS`.
+
+    Returns:
+        A dict mapping each module to the `seconds` and `peak_mb` of its
+        fastest import, and whether cohortextractor was `stubbed`.
+
+    Raises:
+        RuntimeError: If a module can't be imported.
+    """
+    modules = IMPORT_MODULES if modules is None else modules
+    repeats = IMPORT_REPEATS if repeats is None else repeats
+    results = {}
+    for module in modules:
+        runs = []
+        for _ in range(repeats):
+            process = subprocess.run(
+                [sys.executable, "-c", IMPORT_SCRIPT, module, COHORTEXTRACTOR_STUB],
+                cwd=ANALYSIS_DIR,
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode != 0:
+                raise RuntimeError(f"Can't import {module}:\n{process.stderr}")
+            runs.append(json.loads(process.stdout))
+        fastest = min(runs, key=lambda r: r["seconds"])
+        results[module] = {
+            "seconds": round(fastest["seconds"], 4),
+            "peak_mb": round(fastest["peak_mb"], 2),
+            "stubbed": fastest["stubbed"],
+        }
+    return results
+
+
+def run(rows=None, seed=0):
+    """Benchmarks the summary tables on dummy cohorts of each size in `rows`.
+
+    Returns:
+        A dict with the `environment` the benchmarks ran in, the results of
+        `measure_imports` as `imports`, and, for each size (as a string), the
+        results of `run_stages`.
+    """
+    rows = ROWS if rows is None else rows
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+        },
+        "imports": measure_imports(),
+    }
+    for n_rows in rows:
+        results[str(n_rows)] = run_stages(dummy_cohort(n_rows, seed=seed))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Finds stages that have regressed from a baseline.
+
+    A stage regresses if it is more than `tolerance` (as a fraction) slower,
+    or uses that much more memory, than in the baseline. Stages that are
+    faster than `MIN_SECONDS`, or smaller than `MIN_PEAK_MB`, in both are
+    ignored as noise. Sizes (and `imports`) and stages missing from either are
+    skipped, as are imports measured with cohortextractor stubbed in one but
+    not the other.
+
+    Returns:
+        A list of (rows, stage, measure, baseline value, new value) tuples.
+    """
+    regressions = []
+    for n_rows, stages in results.items():
+        if n_rows == "environment" or n_rows not in baseline:
+            continue
+        for stage, measured in stages.items():
+            expected = baseline[n_rows].get(stage)
+            # Imports with and without a stubbed cohortextractor aren't comparable.
+            if expected is None or expected.get("stubbed") != measured.get("stubbed"):
+                continue
+            for key, floor in [("seconds", MIN_SECONDS), ("peak_mb", MIN_PEAK_MB)]:
+                if max(measured[key], expected[key]) < floor:
+                    continue
+                if measured[key] > expected[key] * (1 + tolerance):
+                    regressions.append((n_rows, stage, key, expected[key], measured[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=ROWS)
+    parser.add_argument("--output", type=Path, default=BENCHMARK_DIR / "results.json")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--save", action="store_true", help="Record the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.rows)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for n_rows, stages in results.items():
+        if n_rows != "environment":
+            for stage, measured in stages.items():
+                print(f"{n_rows:>10} {stage:<16} {measured['seconds']:>9.3f}s {measured['peak_mb']:>9.1f}MB")
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for n_rows, stage, key, expected, measured in regressions:
+            print(f"Regression at {n_rows} rows: {stage} {key} {expected} -> {measured}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
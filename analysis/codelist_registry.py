@@ -0,0 +1,165 @@
+"""Parses each codelist CSV once and indexes it by code.
+
+A codelist CSV is parsed at most once per process, and the parsed table is
+kept in a binary cache next to the codelists, so that later processes don't
+parse it at all. Cached tables are invalidated when the hash of their CSV in
+codelists/codelists.json changes (i.e. when the codelist is updated with
+`opensafely codelists update`).
+"""
+import csv
+import hashlib
+import json
+import pickle
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parents[1]
+CODELISTS_DIR = BASE_DIR / "codelists"
+CACHE_PATH = CODELISTS_DIR / ".codelists.pickle"
+
+# Parsed tables, by file name, and indexes into them, for this process.
+_tables = {}
+_indexes = {}
+
+
+def codelist_hash(filename):
+    """Gets the hash of a codelist CSV, as recorded in codelists.json.
+
+    Codelists that aren't recorded there are hashed from their contents.
+    """
+    with open(CODELISTS_DIR / "codelists.json") as f:
+        recorded = json.load(f)["files"]
+    if filename in recorded:
+        return recorded[filename]["sha"]
+    return hashlib.sha1((CODELISTS_DIR / filename).read_bytes()).hexdigest()
+
+
+def _parse(path):
+    """Parses a codelist CSV into its column names and rows."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        columns = [c.strip() for c in next(reader)]
+        rows = [tuple(value.strip() for value in row) for row in reader if row]
+    return {"columns": columns, "rows": rows}
+
+
+def _read_cache():
+    try:
+        with open(CACHE_PATH, "rb") as f:
+            return pickle.load(f)
+    # As for the ONS cache, a cache written by another version may fail to
+    # unpickle with almost any error, and any failure is a cache miss.
+    except Exception:
+        return {}
+
+
+def _write_cache(cache):
+    # The codelists directory may be read-only, e.g. in the job runner; the
+    # cache is then only kept for the life of the process.
+    try:
+        with open(CACHE_PATH, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+
+def codelist_table(path):
+    """Gets a parsed codelist CSV.
+
+    Args:
+        path: Path to the CSV, relative to the repository root, as would be
+            passed to `codelist_from_csv`.
+
+    Returns:
+        A dict with the CSV's `sha`, its `columns` and its `rows` (as tuples
+        of stripped strings).
+    """
+    filename = Path(path).name
+    sha = codelist_hash(filename)
+    table = _tables.get(filename)
+    if table is not None and table["sha"] == sha:
+        return table
+
+    cache = _read_cache()
+    table = cache.get(filename)
+    if table is None or table["sha"] != sha:
+        table = {"sha": sha, **_parse(BASE_DIR / path)}
+        cache[filename] = table
+        _write_cache(cache)
+
+    _tables[filename] = table
+    return table
+
+
+def codelist_rows(path, column, category_column=None):
+    """Gets the codes of a codelist CSV, as `codelist_from_csv` reads them.
+
+    Args:
+        path: Path to the CSV, relative to the repository root.
+        column: The column of codes.
+        category_column: The column of categories, if any.
+
+    Returns:
+        A list of codes, or of (code, category) tuples if `category_column`
+        is given.
+    """
+    table = codelist_table(path)
+    i = table["columns"].index(column)
+    if category_column is None:
+        return [row[i] for row in table["rows"]]
+    j = table["columns"].index(category_column)
+    return [(row[i], row[j]) for row in table["rows"]]
+
+
+def code_index(path, column):
+    """Gets a hash index of a codelist CSV by code.
+
+    Args:
+        path: Path to the CSV, relative to the repository root.
+        column: The column of codes.
+
+    Returns:
+        A dict mapping each code to its row, as a dict of column name to
+        value, e.g. {"Y9930": {"Code": "Y9930", "Grouping_6": "1", ...}}.
+    """
+    table = codelist_table(path)
+    key = (Path(path).name, table["sha"], column)
+    if key not in _indexes:
+        i = table["columns"].index(column)
+        index = {}
+        for row in table["rows"]:
+            index.setdefault(row[i], dict(zip(table["columns"], row)))
+        _indexes[key] = index
+    return _indexes[key]
+
+
+def map_codes(path, codes, column, category_column):
+    """Maps an array of codes to their categories in a codelist.
+
+    Every code is looked up in a hash index, in one vectorised operation.
+
+    Args:
+        path: Path to the CSV, relative to the repository root.
+        codes: An array-like of codes.
+        column: The column of codes.
+        category_column: The column of categories to map to.
+
+    Returns:
+        An object array of categories, with None for codes not in the
+        codelist.
+    """
+    import numpy as np
+    import pandas as pd
+
+    table = codelist_table(path)
+    key = (Path(path).name, table["sha"], column, category_column)
+    if key not in _indexes:
+        index = code_index(path, column)
+        _indexes[key] = (
+            pd.Index(list(index)),
+            np.array([row[category_column] for row in index.values()] + [None], dtype=object),
+        )
+    lookup, values = _indexes[key]
+
+    # get_indexer returns -1 for codes not in the codelist, which picks the
+    # trailing None.
+    return values[lookup.get_indexer(pd.Index(codes))]
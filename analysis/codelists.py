@@ -1,28 +1,59 @@
-from cohortextractor import (
-    codelist,
-    codelist_from_csv,
-)
+from codelist_registry import codelist_rows
+from lazy import lazy_attributes
+
+
+def codelist_from_registry(filename, system, column="code", category_column=None):
+    """Like `codelist_from_csv`, but each CSV is parsed once (see codelist_registry)."""
+    from cohortextractor import codelist
+
+    codes = codelist(codelist_rows(filename, column, category_column), system)
+    codes.has_categories = bool(category_column)
+    return codes
+
+
+# Each codelist is built on first access (see lazy.py), e.g. by
+# `from codelists import ethnicity_codes`.
 
 # measurement codes
 
-ethnicity_codes = codelist_from_csv(
+def _ethnicity_codes():
+    return codelist_from_registry(
         "codelists/opensafely-ethnicity.csv",
         system="ctv3",
         column="Code",
         category_column="Grouping_6",
-)
+    )
 
-covid_codelist = codelist(["U071", "U072"], system="icd10")
 
-cancer_death_codelist = codelist_from_csv(
-    "codelists/user-anna-schultze-cancer.csv",
-    system="icd10",
-    column="code",
-)
+def _covid_codelist():
+    from cohortextractor import codelist
+
+    return codelist(["U071", "U072"], system="icd10")
+
+
+def _cancer_death_codelist():
+    return codelist_from_registry(
+        "codelists/user-anna-schultze-cancer.csv",
+        system="icd10",
+        column="code",
+    )
+
+
+def _ethnicity_codes_16():
+    return codelist_from_registry(
+        "codelists/opensafely-ethnicity.csv",
+        system="ctv3",
+        column="Code",
+        category_column="Grouping_16",
+    )
+
 
-ethnicity_codes_16 = codelist_from_csv(
-    "codelists/opensafely-ethnicity.csv",
-    system="ctv3",
-    column="Code",
-    category_column="Grouping_16",
+__getattr__ = lazy_attributes(
+    __name__,
+    {
+        "ethnicity_codes": _ethnicity_codes,
+        "covid_codelist": _covid_codelist,
+        "cancer_death_codelist": _cancer_death_codelist,
+        "ethnicity_codes_16": _ethnicity_codes_16,
+    },
 )
@@ -0,0 +1,136 @@
+"""Integer codes for the categorical variables of the cohort.
+
+The levels of each categorical variable are fixed by the study definition:
+the category keys of `categorised_as` variables, and the categories in the
+`return_expectations` of the others (read with
+`definitions.variable_expectations`, so cohortextractor isn't needed).
+Ethnicity, which is resolved after extraction (see analysis/ethnicity.py),
+takes the levels of its primary care source, after group 0 for unknown.
+
+A variable's code is the position of its value in its levels, as an int8,
+and -1 where the value is missing, as in `pd.Categorical`. Because the levels
+are the same for every chunk, and every cohort, codes can be counted and
+stored without the strings they stand for, and decoded only for publishing.
+
+STP and MSOA codes aren't all declared in the study definition (its
+categories are only examples for dummy data), so they are left out here;
+the columnar store gives them categories from the data instead.
+"""
+import functools
+
+import numpy as np
+import pandas as pd
+
+import definitions
+from ethnicity import SOURCE_COLUMNS
+
+CODE_DTYPE = "int8"
+
+# Categorical variables whose levels aren't all declared in the study definition.
+OPEN_VARIABLES = ["stp", "msoa"]
+
+
+def _level(key):
+    """Converts a category key to the value in the cohort, e.g. "5" to 5."""
+    return int(key) if key.isdigit() else key
+
+
+@functools.lru_cache(maxsize=None)
+def cohort_dtypes(module="study_definition"):
+    """Gets the categorical dtype of each categorical variable of a cohort.
+
+    Args:
+        module: The study definition the cohort was extracted with.
+
+    Returns:
+        A dict mapping each variable name to a `pd.CategoricalDtype`, in
+        declaration order. The levels of `categorised_as` variables are in
+        the order of their rules, and ordered; the rest are unordered.
+    """
+    dtypes = {}
+    for name, spec in definitions.variable_expectations(module).items():
+        expectations = spec["return_expectations"]
+        if name in OPEN_VARIABLES:
+            continue
+        if "categories" in spec:
+            dtypes[name] = pd.CategoricalDtype(
+                [_level(k) for k in spec["categories"]], ordered=True
+            )
+        elif "category" in expectations:
+            ratios = expectations["category"]["ratios"]
+            dtypes[name] = pd.CategoricalDtype([_level(k) for k in ratios])
+
+    for column, (primary_care, sus) in SOURCE_COLUMNS.items():
+        if primary_care in dtypes:
+            dtypes[column] = pd.CategoricalDtype([0, *dtypes[primary_care].categories])
+        # The source columns are numbers, with NaN for no value; only the
+        # resolved column is categorical.
+        dtypes.pop(primary_care, None)
+        dtypes.pop(sus, None)
+    return dtypes
+
+
+def _has_dtype(values, dtype):
+    """Checks that values are categorical with exactly `dtype`'s levels, in order.
+
+    (Unordered categorical dtypes compare equal whatever the order of their
+    categories, but their codes don't.)
+    """
+    return (
+        isinstance(values.dtype, pd.CategoricalDtype)
+        and values.dtype.ordered == dtype.ordered
+        and values.dtype.categories.equals(dtype.categories)
+    )
+
+
+def encode(values, name):
+    """Converts values of a categorical variable to its codes.
+
+    Args:
+        values: An array-like of values, or a categorical of them. Missing
+            values are coded as -1.
+        name: The name of the variable.
+
+    Returns:
+        An int8 array of codes.
+
+    Raises:
+        ValueError: If any value isn't one of the variable's levels.
+    """
+    dtype = cohort_dtypes()[name]
+    values = pd.Series(values, copy=False)
+    if _has_dtype(values, dtype):
+        return values.cat.codes.to_numpy()
+
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        # Hashes each value once; the rest works on the (few) categories.
+        values = values.astype("category")
+    categories = values.cat.categories
+    if categories.dtype == object and dtype.categories.dtype != object:
+        values = values.cat.rename_categories(categories.astype(dtype.categories.dtype))
+
+    unknown = values.cat.categories.difference(dtype.categories)
+    if len(unknown):
+        raise ValueError(f"Unexpected values of {name}: {unknown.tolist()}")
+    codes = values.cat.set_categories(dtype.categories).cat.codes
+    return codes.to_numpy().astype(CODE_DTYPE, copy=False)
+
+
+def decode(codes, name):
+    """Converts codes of a categorical variable to a `pd.Categorical` of its values."""
+    return pd.Categorical.from_codes(np.asarray(codes), dtype=cohort_dtypes()[name])
+
+
+def categorize(chunk):
+    """Converts the categorical variables in a chunk of the cohort to categoricals.
+
+    Columns that aren't categorical variables, or that already have their
+    dtype, are left as they are.
+    """
+    dtypes = cohort_dtypes()
+    converted = {
+        column: decode(encode(chunk[column], column), column)
+        for column in chunk.columns
+        if column in dtypes and not _has_dtype(chunk[column], dtypes[column])
+    }
+    return chunk.assign(**converted) if converted else chunk
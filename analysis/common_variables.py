@@ -1,137 +1,205 @@
 from cohortextractor import patients
-from codelists import *
-from config import index_date
+from config import end_date, index_date, index_date_death
+from lazy import lazy_attributes
 
-demographic_variables = dict(
-    age=patients.age_as_of(
-        index_date,
-        return_expectations={
-            "rate" : "universal",
-            "int" : {"distribution" : "population_ages"}
-        }
-    ),
+# Each dict of variables is built on first access (see lazy.py), e.g. by
+# `from common_variables import death_variables`.
 
-    age_group=patients.categorised_as(
-        {
-            "0-4": "age < 5",
-            "5-9": "age >= 5 AND age < 10",
-            "10-14": "age >= 10 AND age < 15",
-            "15-19": "age >= 15 AND age < 20",
-            "20-24": "age >= 20 AND age < 25",
-            "25-29": "age >= 25 AND age < 30",
-            "30-34": "age >= 30 AND age < 35",
-            "35-39": "age >= 35 AND age < 40",
-            "40-44": "age >= 40 AND age < 45",
-            "45-49": "age >= 45 AND age < 50",
-            "50-54": "age >= 50 AND age < 55",
-            "55-59": "age >= 55 AND age < 60",
-            "60-64": "age >= 60 AND age < 65",
-            "65-69": "age >= 65 AND age < 70",           
-            "70-74": "age >= 70 AND age < 75",
-            "75-79": "age >= 75 AND age < 80",
-            "80-84": "age >= 80 AND age < 85",
-            "85-89": "age >= 85 AND age < 90",
-            "90+": "age >= 90",
-            "missing": "DEFAULT",
-        },
-        return_expectations={
-            "rate": "universal",
-            "category": {
-                "ratios": {
-                    "0-4": 0.05,
-                    "5-9": 0.05,
-                    "10-14": 0.05,
-                    "15-19": 0.05,
-                    "20-24": 0.05,
-                    "25-29": 0.05,
-                    "30-34": 0.05,
-                    "35-39": 0.05,
-                    "40-44": 0.1,
-                    "45-49": 0.05,
-                    "50-54": 0.05,
-                    "55-59": 0.05,
-                    "60-64": 0.05,
-                    "65-69": 0.05,           
-                    "70-74": 0.05,
-                    "75-79": 0.05,
-                    "80-84": 0.05,
-                    "85-89": 0.05,
-                    "90+": 0.05,
-                }
+# Where patients are registered at the index date.
+def _registration_variables():
+    return dict(
+        stp=patients.registered_practice_as_of(
+            "index_date",
+            returning="stp_code",
+            return_expectations={
+                "rate": "universal",
+                "category": {
+                    "ratios": {
+                        "E54000005": 0.04,
+                        "E54000006": 0.04,
+                        "E54000007": 0.04,
+                        "E54000008": 0.04,
+                        "E54000009": 0.04,
+                        "E54000010": 0.04,
+                        "E54000012": 0.04,
+                        "E54000013": 0.03,
+                        "E54000014": 0.03,
+                        "E54000015": 0.03,
+                        "E54000016": 0.03,
+                        "E54000017": 0.03,
+                        "E54000020": 0.03,
+                        "E54000021": 0.03,
+                        "E54000022": 0.03,
+                        "E54000023": 0.03,
+                        "E54000024": 0.03,
+                        "E54000025": 0.03,
+                        "E54000026": 0.03,
+                        "E54000027": 0.03,
+                        "E54000029": 0.03,
+                        "E54000033": 0.03,
+                        "E54000035": 0.03,
+                        "E54000036": 0.03,
+                        "E54000037": 0.03,
+                        "E54000040": 0.03,
+                        "E54000041": 0.03,
+                        "E54000042": 0.03,
+                        "E54000044": 0.03,
+                        "E54000043": 0.03,
+                        "E54000049": 0.03,
+                    }
+                },
+            },
+        ),
+        msoa=patients.address_as_of(
+            index_date,
+            returning="msoa",
+            return_expectations={
+                "rate": "universal",
+                "category": {"ratios": {"E02000001": 0.0625, "E02000002": 0.0625, "E02000003": 0.0625, "E02000004": 0.0625,
+                                        "E02000005": 0.0625, "E02000007": 0.0625, "E02000008": 0.0625, "E02000009": 0.0625, 
+                                        "E02000010": 0.0625, "E02000011": 0.0625, "E02000012": 0.0625, "E02000013": 0.0625, 
+                                        "E02000014": 0.0625, "E02000015": 0.0625, "E02000016": 0.0625, "E02000017": 0.0625}},
             },
-        },
-    ),
+        ),   
 
-    sex=patients.sex(
-        return_expectations={
-            "rate": "universal",
-            "category": {"ratios": {"M": 0.48, "F": 0.50,"U":0.01,"I":0.01}},
-        }
-    ),
-    region=patients.registered_practice_as_of(
-        index_date,
-        returning="nuts1_region_name",
-        return_expectations={
-            "rate": "universal",
-            "category": {
-                "ratios": {
-                    "North East": 0.1,
-                    "North West": 0.1,
-                    "Yorkshire and The Humber": 0.1,
-                    "East Midlands": 0.1,
-                    "West Midlands": 0.1,
-                    "East": 0.1,
-                    "London": 0.2,
-                    "South East": 0.1,
-                    "South West": 0.1,
-                },
+        practice_id=patients.registered_practice_as_of(
+            "index_date",
+            returning="pseudo_id",
+            return_expectations={
+                "int": {"distribution": "normal", "mean": 1000, "stddev": 100},
+                "incidence": 1,
             },
-        },
-    ),
+        ),
+    )
+
 
- imd=patients.categorised_as(
-        {
-            "0": "DEFAULT",
-            "1": """index_of_multiple_deprivation >=1 AND index_of_multiple_deprivation < 32844*1/5""",
-            "2": """index_of_multiple_deprivation >= 32844*1/5 AND index_of_multiple_deprivation < 32844*2/5""",
-            "3": """index_of_multiple_deprivation >= 32844*2/5 AND index_of_multiple_deprivation < 32844*3/5""",
-            "4": """index_of_multiple_deprivation >= 32844*3/5 AND index_of_multiple_deprivation < 32844*4/5""",
-            "5": """index_of_multiple_deprivation >= 32844*4/5 AND index_of_multiple_deprivation < 32844""",
-        },
-        index_of_multiple_deprivation=patients.address_as_of(
+def _demographic_variables():
+    from codelists import ethnicity_codes, ethnicity_codes_16
+
+    return dict(
+        age=patients.age_as_of(
             index_date,
-            returning="index_of_multiple_deprivation",
-            round_to_nearest=100,
+            return_expectations={
+                "rate" : "universal",
+                "int" : {"distribution" : "population_ages"}
+            }
+        ),
+
+        age_group=patients.categorised_as(
+            {
+                "0-4": "age < 5",
+                "5-9": "age >= 5 AND age < 10",
+                "10-14": "age >= 10 AND age < 15",
+                "15-19": "age >= 15 AND age < 20",
+                "20-24": "age >= 20 AND age < 25",
+                "25-29": "age >= 25 AND age < 30",
+                "30-34": "age >= 30 AND age < 35",
+                "35-39": "age >= 35 AND age < 40",
+                "40-44": "age >= 40 AND age < 45",
+                "45-49": "age >= 45 AND age < 50",
+                "50-54": "age >= 50 AND age < 55",
+                "55-59": "age >= 55 AND age < 60",
+                "60-64": "age >= 60 AND age < 65",
+                "65-69": "age >= 65 AND age < 70",           
+                "70-74": "age >= 70 AND age < 75",
+                "75-79": "age >= 75 AND age < 80",
+                "80-84": "age >= 80 AND age < 85",
+                "85-89": "age >= 85 AND age < 90",
+                "90+": "age >= 90",
+                "missing": "DEFAULT",
+            },
+            return_expectations={
+                "rate": "universal",
+                "category": {
+                    "ratios": {
+                        "0-4": 0.05,
+                        "5-9": 0.05,
+                        "10-14": 0.05,
+                        "15-19": 0.05,
+                        "20-24": 0.05,
+                        "25-29": 0.05,
+                        "30-34": 0.05,
+                        "35-39": 0.05,
+                        "40-44": 0.1,
+                        "45-49": 0.05,
+                        "50-54": 0.05,
+                        "55-59": 0.05,
+                        "60-64": 0.05,
+                        "65-69": 0.05,           
+                        "70-74": 0.05,
+                        "75-79": 0.05,
+                        "80-84": 0.05,
+                        "85-89": 0.05,
+                        "90+": 0.05,
+                    }
+                },
+            },
+        ),
+
+        sex=patients.sex(
+            return_expectations={
+                "rate": "universal",
+                "category": {"ratios": {"M": 0.48, "F": 0.50,"U":0.01,"I":0.01}},
+            }
         ),
-        return_expectations={
-            "rate": "universal",
-            "category": {
-                "ratios": {
-                    "0": 0.05,
-                    "1": 0.19,
-                    "2": 0.19,
-                    "3": 0.19,
-                    "4": 0.19,
-                    "5": 0.19,
-                }
+        region=patients.registered_practice_as_of(
+            index_date,
+            returning="nuts1_region_name",
+            return_expectations={
+                "rate": "universal",
+                "category": {
+                    "ratios": {
+                        "North East": 0.1,
+                        "North West": 0.1,
+                        "Yorkshire and The Humber": 0.1,
+                        "East Midlands": 0.1,
+                        "West Midlands": 0.1,
+                        "East": 0.1,
+                        "London": 0.2,
+                        "South East": 0.1,
+                        "South West": 0.1,
+                    },
+                },
             },
-        },
-    ),
+        ),
 
-    ethnicity = patients.categorised_as(
-            {"0": "DEFAULT",
-            "1": "eth='1' OR (NOT eth AND ethnicity_sus='1')", 
-            "2": "eth='2' OR (NOT eth AND ethnicity_sus='2')", 
-            "3": "eth='3' OR (NOT eth AND ethnicity_sus='3')", 
-            "4": "eth='4' OR (NOT eth AND ethnicity_sus='4')",  
-            "5": "eth='5' OR (NOT eth AND ethnicity_sus='5')",
-            }, 
+     imd=patients.categorised_as(
+            {
+                "0": "DEFAULT",
+                "1": """index_of_multiple_deprivation >=1 AND index_of_multiple_deprivation < 32844*1/5""",
+                "2": """index_of_multiple_deprivation >= 32844*1/5 AND index_of_multiple_deprivation < 32844*2/5""",
+                "3": """index_of_multiple_deprivation >= 32844*2/5 AND index_of_multiple_deprivation < 32844*3/5""",
+                "4": """index_of_multiple_deprivation >= 32844*3/5 AND index_of_multiple_deprivation < 32844*4/5""",
+                "5": """index_of_multiple_deprivation >= 32844*4/5 AND index_of_multiple_deprivation < 32844""",
+            },
+            index_of_multiple_deprivation=patients.address_as_of(
+                index_date,
+                returning="index_of_multiple_deprivation",
+                round_to_nearest=100,
+            ),
             return_expectations={
-            "category": {"ratios": {"1": 0.2, "2": 0.2, "3": 0.2, "4": 0.2, "5": 0.2}},
-            "incidence": 0.4,
+                "rate": "universal",
+                "category": {
+                    "ratios": {
+                        "0": 0.05,
+                        "1": 0.19,
+                        "2": 0.19,
+                        "3": 0.19,
+                        "4": 0.19,
+                        "5": 0.19,
+                    }
+                },
             },
-        
-        eth=patients.with_these_clinical_events(    
+        ),
+
+        # Ethnicity from primary care, falling back to SUS where none is recorded.
+        # The two are combined after extraction, for both groupings at once (see
+        # analysis/ethnicity.py), into `ethnicity` and `ethnicity_16`.
+        # Neither date of match is extracted: they were only ever hidden
+        # variables of `categorised_as`, which never reached the output, and now
+        # that the codes are output themselves a date would be a column that
+        # nothing reads.
+        eth=patients.with_these_clinical_events(
             ethnicity_codes,
             returning="category",
             find_last_match_in_period=True,
@@ -141,114 +209,112 @@ demographic_variables = dict(
                 "incidence": 0.75,
             },
         ),
-
-    # fill missing ethnicity from SUS
         ethnicity_sus=patients.with_ethnicity_from_sus(
-            returning="group_6",  
+            returning="group_6",
             use_most_frequent_code=True,
             return_expectations={
                 "category": {"ratios": {"1": 0.2, "2": 0.2, "3": 0.2, "4": 0.2, "5": 0.2}},
                 "incidence": 0.4,
             },
         ),
-    ),
-    ethnicity_16=patients.categorised_as(
-            {"0": "DEFAULT",
-            "1": "eth16='1' OR (NOT eth16 AND ethnicity_sus16='1')", 
-            "2": "eth16='2' OR (NOT eth16 AND ethnicity_sus16='2')", 
-            "3": "eth16='3' OR (NOT eth16 AND ethnicity_sus16='3')", 
-            "4": "eth16='4' OR (NOT eth16 AND ethnicity_sus16='4')",  
-            "5": "eth16='5' OR (NOT eth16 AND ethnicity_sus16='5')",
-            "6": "eth16='6' OR (NOT eth16 AND ethnicity_sus16='6')",
-            "7": "eth16='7' OR (NOT eth16 AND ethnicity_sus16='7')",
-            "8": "eth16='8' OR (NOT eth16 AND ethnicity_sus16='8')",
-            "9": "eth16='9' OR (NOT eth16 AND ethnicity_sus16='9')",
-            "10": "eth16='10' OR (NOT eth16 AND ethnicity_sus16='10')",
-            "11": "eth16='11' OR (NOT eth16 AND ethnicity_sus16='11')",
-            "12": "eth16='12' OR (NOT eth16 AND ethnicity_sus16='12')",
-            "13": "eth16='13' OR (NOT eth16 AND ethnicity_sus16='13')",
-            "14": "eth16='14' OR (NOT eth16 AND ethnicity_sus16='14')",
-            "15": "eth16='15' OR (NOT eth16 AND ethnicity_sus16='15')",
-            "16": "eth16='16' OR (NOT eth16 AND ethnicity_sus16='16')",
-            }, 
-                return_expectations={
-                        "category": {
-                            "ratios": {
-                                "1": 0.0625,
-                                "2": 0.0625,
-                                "3": 0.0625,
-                                "4": 0.0625,
-                                "5": 0.0625,
-                                "6": 0.0625,
-                                "7": 0.0625,
-                                "8": 0.0625,
-                                "9": 0.0625,
-                                "10": 0.0625,
-                                "11": 0.0625,
-                                "12": 0.0625,
-                                "13": 0.0625,
-                                "14": 0.0625,
-                                "15": 0.0625,
-                                "16": 0.0625,
-                            }
-                        },
-                        "incidence": 0.75,
-                    },
-            eth16=patients.with_these_clinical_events(
-                ethnicity_codes_16,
-                returning="category",
-                find_last_match_in_period=True,
-                include_date_of_match=True,
-                return_expectations={
-                    "category": {
-                        "ratios": {
-                            "1": 0.0625,
-                            "2": 0.0625,
-                            "3": 0.0625,
-                            "4": 0.0625,
-                            "5": 0.0625,
-                            "6": 0.0625,
-                            "7": 0.0625,
-                            "8": 0.0625,
-                            "9": 0.0625,
-                            "10": 0.0625,
-                            "11": 0.0625,
-                            "12": 0.0625,
-                            "13": 0.0625,
-                            "14": 0.0625,
-                            "15": 0.0625,
-                            "16": 0.0625,
-                        }
-                    },
-                    "incidence": 0.75,
+        eth16=patients.with_these_clinical_events(
+            ethnicity_codes_16,
+            returning="category",
+            find_last_match_in_period=True,
+            include_date_of_match=False,
+            return_expectations={
+                "category": {
+                    "ratios": {
+                        "1": 0.0625,
+                        "2": 0.0625,
+                        "3": 0.0625,
+                        "4": 0.0625,
+                        "5": 0.0625,
+                        "6": 0.0625,
+                        "7": 0.0625,
+                        "8": 0.0625,
+                        "9": 0.0625,
+                        "10": 0.0625,
+                        "11": 0.0625,
+                        "12": 0.0625,
+                        "13": 0.0625,
+                        "14": 0.0625,
+                        "15": 0.0625,
+                        "16": 0.0625,
+                    }
                 },
-            ),
-            ethnicity_sus16=patients.with_ethnicity_from_sus(
-                returning="group_16",  
-                use_most_frequent_code=True,
-                return_expectations={
-                    "category": {
-                        "ratios": {
-                            "1": 0.0625,
-                            "2": 0.0625,
-                            "3": 0.0625,
-                            "4": 0.0625,
-                            "5": 0.0625,
-                            "6": 0.0625,
-                            "7": 0.0625,
-                            "8": 0.0625,
-                            "9": 0.0625,
-                            "10": 0.0625,
-                            "11": 0.0625,
-                            "12": 0.0625,
-                            "13": 0.0625,
-                            "14": 0.0625,
-                            "15": 0.0625,
-                            "16": 0.0625,
-                        }
-                    },
-                    "incidence": 0.75,
+                "incidence": 0.75,
+            },
+        ),
+        ethnicity_sus16=patients.with_ethnicity_from_sus(
+            returning="group_16",
+            use_most_frequent_code=True,
+            return_expectations={
+                "category": {
+                    "ratios": {
+                        "1": 0.0625,
+                        "2": 0.0625,
+                        "3": 0.0625,
+                        "4": 0.0625,
+                        "5": 0.0625,
+                        "6": 0.0625,
+                        "7": 0.0625,
+                        "8": 0.0625,
+                        "9": 0.0625,
+                        "10": 0.0625,
+                        "11": 0.0625,
+                        "12": 0.0625,
+                        "13": 0.0625,
+                        "14": 0.0625,
+                        "15": 0.0625,
+                        "16": 0.0625,
+                    }
                 },
-            ),
-    ),
-)
\ No newline at end of file
+                "incidence": 0.75,
+            },
+        ),
+    )
+
+
+# How patients who died in the deaths study period died. The date and the
+# underlying cause are all that is extracted; everything else is derived from
+# them by analysis/deaths.py.
+def _death_variables():
+    return dict(
+        died_date=patients.died_from_any_cause(
+            between=[index_date_death, end_date],
+            returning="date_of_death",
+            date_format="YYYY-MM-DD",
+            return_expectations={
+                "date": {"earliest": end_date},
+            },
+        ),
+        died_cause_ons=patients.died_from_any_cause(
+            between=[index_date_death, end_date],
+            returning="underlying_cause_of_death",
+            return_expectations={
+                "category": {
+                    "ratios": {
+                        "U071": 0.2,
+                        "C33": 0.2,
+                        "I60": 0.1,
+                        "F01": 0.1,
+                        "F02": 0.05,
+                        "I22": 0.05,
+                        "C34": 0.05,
+                        "I23": 0.25,
+                    }
+                },
+            },
+        ),
+    )
+
+
+__getattr__ = lazy_attributes(
+    __name__,
+    {
+        "registration_variables": _registration_variables,
+        "demographic_variables": _demographic_variables,
+        "death_variables": _death_variables,
+    },
+)
@@ -0,0 +1,20 @@
+"""Writes a typed, columnar copy of input.csv.gz for the downstream actions.
+
+The cohort text is parsed once, here. Later actions memory-map only the columns
+they need from output/4_2023/cohorts/input_columnar/ (see
+`utilities.load_columns`) instead of re-parsing the whole CSV.
+"""
+from instrumentation import action, stage
+from utilities import convert_cohort
+
+
+@action("convert_cohort")
+def main():
+    with stage("convert_cohort") as record:
+        schema = convert_cohort()
+        record["rows_out"] = schema["n_rows"]
+        record["columns"] = list(schema["columns"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Maps TPP coverage per NUTS1 region, and registered patients per STP.
+
+Reads the tables written by analysis/summary_tables.py, and the cohort's
+counts by MSOA, STP and region from the count cache, and writes:
+
+    output/plots/tpp_coverage_map.svg
+    output/plots/tpp_coverage_stp.svg
+
+The regions are drawn as the (cached, simplified) STP boundaries that nest
+in them (see `geometry.area_index`), so no NUTS1 boundaries are needed.
+"""
+import numpy as np
+import pandas as pd
+
+from geometry import area_index, centroids, render_svg, stp_geometry, totals_by
+from instrumentation import action, stage
+from summary_tables import SUMMARY_GROUPINGS
+from utilities import NUTS1_CODES, OUTPUT_DIR, TABLES_DIR, cached_count_cohort
+
+PLOTS_DIR = OUTPUT_DIR / "plots"
+
+
+def region_coverage_map(geometry, index, tpp_cov, path):
+    """Draws the TPP coverage of each NUTS1 region, labelled with its TPP population."""
+    regions = list(NUTS1_CODES)
+    tpp_cov = tpp_cov.set_index("region").reindex(regions)
+    coverage = np.append(tpp_cov["tpp_cov_all"].to_numpy(dtype=float), np.nan)
+    # Position -1 (an STP in no known region) picks the trailing NaN.
+    values = coverage[index["stp_region"]]
+
+    centres = centroids(geometry, index["stp_region"], len(regions))
+    labels = [
+        (x, y, f"{population / 1e6:.1f}M")
+        for (x, y), population in zip(centres, tpp_cov["tpp_pop_all"].to_numpy(dtype=float))
+        if not np.isnan(x) and not np.isnan(population)
+    ]
+    render_svg(
+        geometry,
+        values,
+        path,
+        "TPP population coverage (%) per NUTS 1 Region",
+        labels=labels,
+        vmax=100,
+    )
+
+
+def stp_registered_map(geometry, tpp_stp, path):
+    """Draws the number of TPP-registered patients in each STP."""
+    registered = totals_by(tpp_stp["stp"], tpp_stp["registered"].fillna(0), geometry["codes"])
+    registered[~np.isin(geometry["codes"], tpp_stp["stp"])] = np.nan
+    render_svg(geometry, registered, path, "TPP-registered patients per STP")
+
+
+@action("calculate_tpp_coverage")
+def main():
+    with stage("count_cohort") as record:
+        counts = cached_count_cohort(
+            groupings={"msoa_stp_region": SUMMARY_GROUPINGS["msoa_stp_region"]}
+        )
+        record["rows_out"] = len(counts["msoa_stp_region"])
+    with stage("stp_geometry"):
+        geometry = stp_geometry()
+    index = area_index(counts["msoa_stp_region"], geometry["codes"], list(NUTS1_CODES))
+
+    with stage("region_coverage_map"):
+        region_coverage_map(
+            geometry,
+            index,
+            pd.read_csv(TABLES_DIR / "tpp_pop_all.csv"),
+            PLOTS_DIR / "tpp_coverage_map.svg",
+        )
+    with stage("stp_registered_map"):
+        stp_registered_map(
+            geometry,
+            pd.read_csv(TABLES_DIR / "tpp_pop_stp.csv"),
+            PLOTS_DIR / "tpp_coverage_stp.svg",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Joint counts of the cohort's categorical variables, with one `np.bincount`.
+
+Most count tables (by age group, sex, region, IMD and ethnicity) are
+marginals of one joint distribution of the cohort's categorical variables.
+With the fixed levels of `cohort_schema`, that distribution is a small dense
+tensor with one cell per combination of levels, plus one cell per variable
+for missing values. Each patient's codes are combined into a single
+mixed-radix index into the tensor, so a chunk of the cohort is counted into
+every cell with one `np.bincount`. Each table is then a sum over the
+tensor's other axes, and percentages within groups are ratios of those sums
+(see `shares`).
+
+The tensor of every variable at once would have about a million cells, most
+of them for combinations of the 6 and 16 ethnic groups that no table uses,
+so tensors are kept to `MAX_CELLS`, and groupings that don't fit are counted
+into another tensor (see `utilities.joint_groupings`).
+"""
+import numpy as np
+import pandas as pd
+
+import cohort_schema
+import disclosure
+
+# The most cells a joint tensor may have (1MB of counts).
+MAX_CELLS = 1 << 17
+
+
+def joint_shape(variables):
+    """Gets the shape of the joint tensor of categorical variables.
+
+    Each axis has a cell for each level of its variable, and a last cell for
+    missing values.
+    """
+    dtypes = cohort_schema.cohort_dtypes()
+    return tuple(len(dtypes[v].categories) + 1 for v in variables)
+
+
+def joint_index(codes, shape):
+    """Combines codes of several variables into a flat index into their joint tensor.
+
+    Args:
+        codes: A list of code arrays, one per axis, with -1 for missing.
+        shape: The shape of the joint tensor, as returned by `joint_shape`.
+
+    Returns:
+        An int64 array of positions in the flattened tensor.
+    """
+    index = np.zeros(len(codes[0]) if codes else 0, dtype="int64")
+    for values, size in zip(codes, shape):
+        # -1 (missing) is the last cell of the axis.
+        index *= size
+        index += np.where(values < 0, size - 1, values)
+    return index
+
+
+def count_joint(chunk, variables):
+    """Counts a chunk of the cohort into the joint tensor of `variables`.
+
+    Args:
+        chunk: A data frame with a column for each variable.
+        variables: The categorical variables, one per axis.
+
+    Returns:
+        An int64 array with shape `joint_shape(variables)`.
+    """
+    shape = joint_shape(variables)
+    codes = [cohort_schema.encode(chunk[v], v) for v in variables]
+    counts = np.bincount(joint_index(codes, shape), minlength=int(np.prod(shape)))
+    return counts.reshape(shape)
+
+
+def marginal(tensor, variables, by):
+    """Sums a joint tensor over every variable not in `by`.
+
+    Returns:
+        A tensor with one axis per variable of `by`, in that order.
+    """
+    keep = [variables.index(v) for v in by]
+    others = tuple(i for i in range(len(variables)) if i not in keep)
+    summed = tensor.sum(axis=others)
+    return np.transpose(summed, np.argsort(np.argsort(keep)))
+
+
+def tensor_counts(tensor, by):
+    """Converts a tensor of counts to a series of the groups with any patients.
+
+    Args:
+        tensor: A tensor of counts with one axis per variable of `by`, e.g.
+            from `marginal`.
+        by: The variables of the tensor's axes.
+
+    Returns:
+        A series of counts indexed by group (as categoricals of each
+        variable's levels), like those returned by `utilities.count_chunk`.
+    """
+    cells = np.nonzero(tensor)
+    levels = [
+        # The last cell of each axis (missing) is code -1.
+        cohort_schema.decode(np.where(cell == size - 1, -1, cell), variable)
+        for cell, size, variable in zip(cells, tensor.shape, by)
+    ]
+    index = pd.MultiIndex.from_arrays(levels, names=list(by))
+    return pd.Series(tensor[cells], index=index)
+
+
+def table_tensor(table, by, value="N"):
+    """Converts a count table to a tensor of counts, the inverse of `tensor_counts`.
+
+    Args:
+        table: A data frame with a column for each variable of `by`, and the
+            counts in `value`.
+        by: The categorical variables, one per axis.
+        value: The column of counts.
+
+    Returns:
+        An int64 array with shape `joint_shape(by)`.
+    """
+    shape = joint_shape(by)
+    codes = [cohort_schema.encode(table[v], v) for v in by]
+    counts = np.bincount(
+        joint_index(codes, shape), weights=table[value], minlength=int(np.prod(shape))
+    )
+    return counts.astype("int64").reshape(shape)
+
+
+def shares(tensor, within, totals=None):
+    """Calculates each cell of a tensor as a percentage of the total of its group.
+
+    Args:
+        tensor: A tensor of counts.
+        within: The axes of the groups, e.g. (0, 1) for percentages of each
+            region and sex in a tensor of region by sex by age group.
+        totals: The total of each group, with the other axes kept (as length
+            one). Defaults to the sums of `tensor` over the other axes.
+
+    Returns:
+        A float tensor of percentages, with NaN where the total is redacted
+        (NaN) or zero.
+    """
+    others = tuple(i for i in range(tensor.ndim) if i not in within)
+    totals = tensor.sum(axis=others, keepdims=True) if totals is None else totals
+    return disclosure.percentages(tensor, totals)
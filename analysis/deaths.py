@@ -0,0 +1,219 @@
+"""Counts deaths by cause, from a single read of input_deaths.csv.gz.
+
+The deaths cohort has each patient's date of death and underlying cause
+(an ICD-10 code). Everything else is derived from those in one pass: whether
+the patient died in the study period, the cause of death groups of the
+published table, and whether the cause is in `cancer_death_codelist`. Causes are classified once per distinct code, not per
+patient, with range lookups (`np.searchsorted`) and a prefix index of the
+codelist's codes. Writes:
+
+    output/tables/death_count.csv
+    output/tables/death_cancer_count.csv
+"""
+import numpy as np
+import pandas as pd
+
+from codelist_registry import codelist_rows
+from disclosure import redact_table, round_to_nearest
+from instrumentation import action, instrumented, stage
+from ons import ons_table
+from utilities import COHORT_DIR, CHUNKSIZE, TABLES_DIR, stream_counts
+
+DEATHS_FILE = COHORT_DIR / "input_deaths.csv.gz"
+CANCER_CODELIST = "codelists/user-anna-schultze-cancer.csv"
+
+# The causes of death compared with ONS, as ranges of three-character codes.
+CAUSES_OF_DEATH = [
+    ("C33", "C34", "Malignant neoplasm of trachea, bronchus and lung"),
+    ("F01", "F03", "Dementia and Alzheimer disease"),
+    ("G30", "G30", "Dementia and Alzheimer disease"),
+    ("I20", "I25", "Ischaemic heart diseases"),
+    ("I60", "I69", "Cerebrovascular diseases"),
+    ("U07", "U07", "COVID-19"),
+]
+
+DEATH_GROUPINGS = {"deaths": ["region", "Cause_of_Death", "died_cancer", "died_any"]}
+
+
+def expand_icd10(code):
+    """Expands a range of ICD-10 codes, e.g. "C00-C14", into its three-character codes."""
+    if "-" not in code:
+        return [code]
+    first, last = code.split("-")
+    return [f"{first[0]}{n:02d}" for n in range(int(first[1:3]), int(last[1:3]) + 1)]
+
+
+def prefix_index(codes):
+    """Indexes ICD-10 codes by length, for prefix matching with `match_prefixes`.
+
+    Returns:
+        A dict mapping each code length to a sorted array of the codes of
+        that length.
+    """
+    expanded = pd.Series([c for code in codes for c in expand_icd10(code)]).str.strip()
+    return {
+        length: np.sort(group.unique())
+        for length, group in expanded.groupby(expanded.str.len())
+    }
+
+
+def match_prefixes(codes, index):
+    """Finds the codes that start with any code in a prefix index.
+
+    Args:
+        codes: An array-like of ICD-10 codes; missing values never match.
+        index: A prefix index, as returned by `prefix_index`.
+
+    Returns:
+        A boolean array.
+    """
+    codes = pd.Series(codes, dtype=object).str.replace(".", "", regex=False)
+    matched = np.zeros(len(codes), dtype=bool)
+    for length, prefixes in index.items():
+        matched |= codes.str.slice(0, length).isin(prefixes).to_numpy()
+    return matched
+
+
+def _lookup_ranges(codes, starts, ends, labels):
+    """Finds the range each code's first three characters fall in."""
+    three = pd.Series(codes, dtype=object).str.slice(0, 3)
+    known = three.notna().to_numpy()
+    position = np.searchsorted(starts, three.fillna("").to_numpy(dtype=str), side="right") - 1
+    found = known & (position >= 0)
+    found[found] = three.to_numpy()[found] <= np.asarray(ends)[position[found]]
+    return np.where(found, np.asarray(labels, dtype=object)[position.clip(0)], None)
+
+
+def cause_of_death(codes):
+    """Groups underlying causes of death into the causes compared with ONS."""
+    starts, ends, labels = zip(*CAUSES_OF_DEATH)
+    return _lookup_ranges(codes, np.array(starts), np.array(ends), labels)
+
+
+def classify_deaths(chunk, cancer_index=None):
+    """Adds what is known about each patient's death to a chunk of the deaths cohort.
+
+    The causes are classified once for each distinct code in the chunk.
+
+    Args:
+        chunk: A data frame with `died_date` and `died_cause_ons`.
+        cancer_index: A prefix index of cancer codes. Defaults to that of
+            `cancer_death_codelist`.
+
+    Returns:
+        The chunk, with `died_any` (1 if there is a date of death),
+        `Cause_of_Death` and `died_cancer` (1 if the cause is in the cancer
+        codelist).
+    """
+    if cancer_index is None:
+        cancer_index = prefix_index(codelist_rows(CANCER_CODELIST, "code"))
+
+    codes, causes = pd.factorize(chunk["died_cause_ons"])
+    # Position -1 (no cause recorded) picks the trailing missing value.
+    grouped = np.append(cause_of_death(causes), None)
+    cancer = np.append(match_prefixes(causes, cancer_index), False)
+
+    return chunk.assign(
+        died_any=chunk["died_date"].notna().astype("int64"),
+        Cause_of_Death=grouped[codes],
+        died_cancer=cancer[codes].astype("int64"),
+    )
+
+
+def iter_death_chunks(path=None, chunksize=CHUNKSIZE):
+    """Reads and classifies the deaths cohort in chunks (see `classify_deaths`)."""
+    path = DEATHS_FILE if path is None else path
+    cancer_index = prefix_index(codelist_rows(CANCER_CODELIST, "code"))
+    for chunk in pd.read_csv(
+        path,
+        usecols=["died_date", "died_cause_ons", "region"],
+        dtype={"died_date": "object", "died_cause_ons": "object", "region": "object"},
+        chunksize=chunksize,
+    ):
+        yield classify_deaths(chunk, cancer_index)
+
+
+def _round(values, k=5):
+    return round_to_nearest(values, k).astype("Int64")
+
+
+@instrumented()
+def death_count_table(deaths, death_ons):
+    """Counts deaths by cause in each region and England, alongside ONS.
+
+    Args:
+        deaths: Counts of the deaths cohort by `DEATH_GROUPINGS["deaths"]`.
+        death_ons: ONS counts by cause of death and region.
+    """
+    died = deaths[deaths["died_any"] == 1]
+    totals = died.groupby("region", dropna=False)["N"].sum().rename("Total")
+    tpp = (
+        deaths.groupby(["region", "Cause_of_Death"], dropna=False)["N"]
+        .sum()
+        .reset_index()
+        .join(totals, on="region")
+    )
+
+    england = tpp.groupby("Cause_of_Death", dropna=False)[["N", "Total"]].sum().reset_index()
+    england["region"] = "England"
+
+    tpp = pd.concat([england, tpp], ignore_index=True).assign(cohort="TPP")
+    tpp = tpp.dropna(subset=["Cause_of_Death"])
+
+    deaths = pd.concat(
+        [tpp, death_ons.rename(columns={"Region": "region"}).assign(cohort="ONS")],
+        ignore_index=True,
+    )
+    deaths["N"] = _round(deaths["N"])
+    deaths["Total"] = _round(deaths["Total"])
+    deaths["percentage"] = deaths["N"] / deaths["Total"] * 100
+    return deaths[["Cause_of_Death", "N", "Total", "region", "cohort", "percentage"]]
+
+
+@instrumented()
+def death_cancer_table(deaths):
+    """Counts deaths from a cause in `cancer_death_codelist`, in each region and England.
+
+    The cancer and other deaths of each region are redacted together (see
+    `disclosure.redact_table`), so that neither can be recovered from the
+    total deaths.
+
+    Args:
+        deaths: Counts of the deaths cohort by `DEATH_GROUPINGS["deaths"]`.
+    """
+    died = deaths[deaths["died_any"] == 1]
+    by_region = (
+        died.groupby(["died_cancer", "region"], dropna=False)["N"]
+        .sum()
+        .unstack(fill_value=0)
+        .reindex([1, 0], fill_value=0)
+    )
+    by_region.insert(0, "England", by_region.sum(axis=1))
+    cells, totals, percentage = redact_table(by_region.to_numpy(), threshold=5, k=5, axis=0)
+    return pd.DataFrame(
+        {
+            "region": by_region.columns,
+            "N": pd.Series(cells[0]).astype("Int64"),
+            "Total": pd.Series(totals[0]).astype("Int64"),
+            "percentage": percentage[0],
+        }
+    )
+
+
+@action("counts_deaths")
+def main():
+    TABLES_DIR.mkdir(parents=True, exist_ok=True)
+
+    with stage("count_deaths") as record:
+        deaths = stream_counts(iter_death_chunks(), DEATH_GROUPINGS)["deaths"]
+        record["rows_in"] = int(deaths["N"].sum())
+        record["rows_out"] = len(deaths)
+
+    death_count_table(deaths, ons_table("deaths")).to_csv(
+        TABLES_DIR / "death_count.csv", index=False
+    )
+    death_cancer_table(deaths).to_csv(TABLES_DIR / "death_cancer_count.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
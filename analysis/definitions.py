@@ -0,0 +1,223 @@
+"""Reads variable definitions from the study definitions without running them.
+
+The study definitions can only be imported where cohortextractor is installed.
+This module parses their source instead, so that the analysis code can tell
+which variables (and codelists) a table depends on, and what they are
+expected to look like, in any environment.
+"""
+import ast
+import re
+from pathlib import Path
+
+from codelist_registry import codelist_hash
+
+ANALYSIS_DIR = Path(__file__).parent
+CODELIST_READERS = {"codelist_from_csv", "codelist_from_registry"}
+
+
+def _parse_module(name):
+    path = ANALYSIS_DIR / f"{name}.py"
+    source = path.read_text()
+    return ast.parse(source), source
+
+
+def _imported_names(tree):
+    """Maps names imported with `from <module> import <name>` to the module."""
+    modules = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module:
+            for alias in node.names:
+                modules[alias.asname or alias.name] = node.module
+    return modules
+
+
+def _keywords(call, tree, source):
+    """Flattens a call's keywords, resolving `**name` from imported modules."""
+    variables = {}
+    for keyword in call.keywords:
+        if keyword.arg is not None:
+            variables[keyword.arg] = keyword.value
+            continue
+        if not isinstance(keyword.value, ast.Name):
+            continue
+        name = keyword.value.id
+        module = _imported_names(tree).get(name)
+        if module is not None:
+            variables.update(variable_nodes(module, name))
+        else:
+            variables.update(_module_dict(tree, source, name))
+    return variables
+
+
+def _module_values(tree):
+    """Finds the values of a module's top-level names.
+
+    These are `name = <value>` assignments, and `_name()` functions that
+    return `<value>`, for names built on first access (see lazy.py).
+    """
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    yield target.id, node.value
+        elif (
+            isinstance(node, ast.FunctionDef)
+            and node.name.startswith("_")
+            and isinstance(node.body[-1], ast.Return)
+            and node.body[-1].value is not None
+        ):
+            yield node.name[1:], node.body[-1].value
+
+
+def _module_dict(tree, source, name):
+    """Finds the keywords of a module-level `dict(...)` of variables `name`."""
+    for value_name, value in _module_values(tree):
+        if value_name == name and isinstance(value, ast.Call):
+            return _keywords(value, tree, source)
+    raise KeyError(name)
+
+
+def variable_nodes(module, name=None):
+    """Finds the variables declared in a study definition module.
+
+    Args:
+        module: The name of a module in analysis/, e.g. "study_definition".
+        name: The name of a module-level `dict(...)` of variables to read, e.g.
+            "demographic_variables". Defaults to the module's
+            `StudyDefinition(...)` call.
+
+    Returns:
+        A dict mapping each variable name to its AST node, in declaration
+        order. Arguments to `StudyDefinition` that aren't variables (e.g.
+        `index_date`) are included too.
+    """
+    tree, source = _parse_module(module)
+    if name is not None:
+        return _module_dict(tree, source, name)
+
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "StudyDefinition"
+        ):
+            return _keywords(node, tree, source)
+    raise ValueError(f"No StudyDefinition in {module}")
+
+
+def variable_sources(module, name=None):
+    """Like `variable_nodes`, but returns each variable's normalised source."""
+    return {
+        variable: ast.dump(node, annotate_fields=False)
+        for variable, node in variable_nodes(module, name).items()
+    }
+
+
+def codelist_files():
+    """Maps each codelist defined in codelists.py to the CSV it is read from."""
+    tree, _ = _parse_module("codelists")
+    files = {}
+    for name, call in _module_values(tree):
+        if not isinstance(call, ast.Call):
+            continue
+        if getattr(call.func, "id", None) not in CODELIST_READERS or not call.args:
+            continue
+        files[name] = Path(ast.literal_eval(call.args[0])).name
+    return files
+
+
+def dependencies(variables, variable):
+    """Finds the variables and codelists that a variable's definition uses.
+
+    A variable uses another if it names it in an expression string (e.g.
+    `"age >= 5 AND age < 10"`), and a codelist if it names its Python variable.
+
+    Args:
+        variables: A dict of AST nodes, as returned by `variable_nodes`.
+        variable: The name of the variable.
+
+    Returns:
+        A tuple of two sorted lists: variable names and codelist names.
+    """
+    codelists = codelist_files()
+    used_variables = set()
+    used_codelists = set()
+    seen = set()
+    pending = [variable]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for node in ast.walk(variables[name]):
+            if isinstance(node, ast.Name) and node.id in codelists:
+                used_codelists.add(node.id)
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                for word in re.findall(r"[A-Za-z_]\w*", node.value):
+                    if word in variables and word != name:
+                        used_variables.add(word)
+                        pending.append(word)
+    return sorted(used_variables), sorted(used_codelists)
+
+
+class _ConfigNames(ast.NodeTransformer):
+    """Replaces names defined in config.py (e.g. `index_date`) with their values."""
+
+    def visit_Name(self, node):
+        import config
+
+        if hasattr(config, node.id):
+            return ast.copy_location(ast.Constant(getattr(config, node.id)), node)
+        return node
+
+
+def evaluate(node):
+    """Evaluates a literal expression, such as a `return_expectations` dict."""
+    return ast.literal_eval(_ConfigNames().visit(node))
+
+
+def variable_expectations(module="study_definition"):
+    """Reads what each variable in a study definition is expected to look like.
+
+    Args:
+        module: The name of a study definition module in analysis/.
+
+    Returns:
+        A dict mapping each variable name (other than `population`) to a
+        dict with:
+            function: The name of the `patients` function, e.g. "sex".
+            returning: The `returning` argument, if any.
+            return_expectations: The variable's `return_expectations`,
+                over the study's `default_expectations`.
+            categories: For `categorised_as`, the category keys.
+            default: For `categorised_as`, the category key for "DEFAULT".
+    """
+    variables = variable_nodes(module)
+    defaults = {}
+    if "default_expectations" in variables:
+        defaults = evaluate(variables["default_expectations"])
+
+    expectations = {}
+    for name, node in variables.items():
+        if not (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and getattr(node.func.value, "id", None) == "patients"
+        ) or name == "population":
+            continue
+
+        kwargs = {k.arg: k.value for k in node.keywords if k.arg is not None}
+        spec = {
+            "function": node.func.attr,
+            "returning": evaluate(kwargs["returning"]) if "returning" in kwargs else None,
+            "return_expectations": {
+                **defaults,
+                **(evaluate(kwargs["return_expectations"]) if "return_expectations" in kwargs else {}),
+            },
+        }
+        if node.func.attr == "categorised_as" and node.args:
+            rules = evaluate(node.args[0])
+            spec["categories"] = list(rules)
+            spec["default"] = next((k for k, v in rules.items() if v == "DEFAULT"), None)
+        expectations[name] = spec
+    return expectations
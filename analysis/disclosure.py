@@ -0,0 +1,127 @@
+"""Vectorised disclosure control for count tables.
+
+Every function works on whole NumPy arrays. Two-dimensional tables are
+redacted one line at a time along `axis`, so a table with thousands of MSOA
+columns is handled by the same few array operations as a single column.
+"""
+import numpy as np
+
+
+def round_to_nearest(values, k):
+    """Rounds values to the nearest multiple of `k`.
+
+    Halves are rounded to even, as with R's `round(x / k) * k`.
+    """
+    return np.round(values / k) * k
+
+
+def suppress_small_numbers(values, threshold):
+    """Replaces values of `threshold` or fewer with NaN.
+
+    Args:
+        values: An array of counts.
+        threshold: The largest count to suppress.
+
+    Returns:
+        A float array of the counts, with small counts replaced by NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    return np.where(values > threshold, values, np.nan)
+
+
+def secondary_suppression_mask(values, mask, threshold, axis=0):
+    """Extends a suppression mask so suppressed cells can't be recovered.
+
+    Along each line of `axis` where the suppressed cells sum to more than zero
+    but no more than `threshold`, the smallest unsuppressed cells are also
+    suppressed until they sum to more than `threshold`.
+
+    Args:
+        values: An array of counts.
+        mask: A boolean array, the same shape as `values`, of suppressed cells.
+        threshold: The largest suppressed total to protect.
+        axis: The axis along which suppressed cells are totalled.
+
+    Returns:
+        A boolean array of the cells to suppress.
+    """
+    values = np.asarray(values, dtype=float)
+    mask = np.asarray(mask, dtype=bool)
+
+    suppressed = np.where(mask, values, 0).sum(axis=axis, keepdims=True)
+    needs_more = (suppressed > 0) & (suppressed <= threshold)
+
+    # Rank the unsuppressed cells of each line from smallest to largest; each
+    # is suppressed while the running suppressed total is still <= threshold.
+    candidates = np.where(mask, np.inf, values)
+    order = np.argsort(candidates, axis=axis, kind="stable")
+    ordered = np.take_along_axis(candidates, order, axis=axis)
+    finite = np.isfinite(ordered)
+    running = suppressed + np.cumsum(np.where(finite, ordered, 0), axis=axis) - np.where(
+        finite, ordered, 0
+    )
+    extra_ordered = needs_more & finite & (running <= threshold)
+
+    extra = np.zeros_like(mask)
+    np.put_along_axis(extra, order, extra_ordered, axis=axis)
+    return mask | extra
+
+
+def redact_small_numbers(values, threshold, axis=0):
+    """Suppresses small counts, and enough others that they can't be recovered.
+
+    Counts of `threshold` or fewer are suppressed, unless they are all zero.
+    Then, along each line of `axis`, the smallest remaining counts are also
+    suppressed until the suppressed counts sum to more than `threshold`.
+
+    Args:
+        values: An array of counts.
+        threshold: The largest count to suppress.
+        axis: The axis along which suppressed counts are totalled.
+
+    Returns:
+        A float array of the counts, with redacted counts replaced by NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    small = values <= threshold
+    # Lines whose small counts are all zero reveal nothing, so are left as is.
+    small &= np.where(small, values, 0).sum(axis=axis, keepdims=True) > 0
+    mask = secondary_suppression_mask(values, small, threshold, axis=axis)
+    return np.where(mask, np.nan, values)
+
+
+def percentages(numerators, denominators):
+    """Calculates percentages, propagating redacted (NaN) values."""
+    numerators = np.asarray(numerators, dtype=float)
+    denominators = np.asarray(denominators, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominators > 0, numerators / denominators * 100, np.nan)
+
+
+def redact_table(counts, threshold=5, k=5, axis=0):
+    """Redacts, rounds and totals a table of counts.
+
+    Cells are redacted as by `redact_small_numbers`, then rounded to the
+    nearest `k`. Totals along `axis` are taken over the unrounded counts and
+    rounded in the same way; totals of `threshold` or fewer are suppressed.
+    Percentages are recalculated from the rounded values, so they are
+    suppressed wherever either the cell or its total is.
+
+    Args:
+        counts: An array of counts.
+        threshold: The largest count to suppress.
+        k: The multiple to round to.
+        axis: The axis along which to total and to apply secondary
+            suppression, e.g. 0 for a table of categories (rows) by areas
+            (columns).
+
+    Returns:
+        A tuple of arrays: redacted counts, redacted totals (with `axis`
+        kept, as length one) and percentages.
+    """
+    counts = np.asarray(counts, dtype=float)
+    cells = round_to_nearest(redact_small_numbers(counts, threshold, axis=axis), k)
+    totals = round_to_nearest(
+        suppress_small_numbers(counts.sum(axis=axis, keepdims=True), threshold), k
+    )
+    return cells, totals, percentages(cells, totals)
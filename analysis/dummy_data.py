@@ -0,0 +1,226 @@
+"""Generates large dummy cohorts from the study definition's return_expectations.
+
+cohortextractor's dummy data is generated row by row, which is too slow for
+cohorts the size of England. This generates each column of a chunk of rows
+with a single NumPy call, from the `return_expectations` declared in the
+study definition (read with `definitions.variable_expectations`, so
+cohortextractor isn't needed), and streams the chunks to disk.
+
+Usage:
+
+    python analysis/dummy_data.py --rows 25000000 --output output/dummy/input.csv.gz
+    python analysis/dummy_data.py --rows 25000000 --output output/dummy/input_columnar
+
+An output path without a .csv or .csv.gz suffix is written as a columnar
+store (see `utilities.write_columnar`), which is much faster than CSV.
+"""
+import argparse
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import definitions
+from config import end_date
+from ons import ons_table
+from utilities import CHUNKSIZE, write_columnar
+
+# The number of rows generated from each random stream. Every block has its
+# own stream, so a cohort is the same whatever size of chunks it's written in.
+BLOCK_ROWS = 1 << 18
+
+# The date that dates expected up to "today" are generated up to. The end of
+# the study is used, rather than the date of the run, so that a cohort is the
+# same whenever it's generated.
+TODAY = end_date
+
+
+def population_age_distribution():
+    """Gets the distribution of single years of age in England (ONS, mid-2020).
+
+    The ONS counts stop at 90+, which is spread evenly over ages 90-104.
+    """
+    ons = ons_table("age_sex")
+    ons = ons[(ons["Region"] == "England") & (ons["sex"] == "Total")]
+    counts = ons.groupby("Age")["N"].sum().astype(float)
+    over_90 = counts.pop(90)
+    counts = pd.concat([counts, pd.Series(over_90 / 15, index=range(90, 105))])
+    return counts.index.to_numpy(), (counts / counts.sum()).to_numpy()
+
+
+def _incidence(expectations):
+    if expectations.get("rate") == "universal":
+        return 1
+    return expectations.get("incidence", 1)
+
+
+def _categorical(spec, n, rng):
+    expectations = spec["return_expectations"]
+    ratios = expectations["category"]["ratios"]
+    categories = list(ratios)
+    p = np.array(list(ratios.values()), dtype=float)
+    codes = rng.choice(len(categories), size=n, p=p / p.sum())
+
+    # Patients without a value get the DEFAULT category of categorised_as
+    # variables, and are missing otherwise.
+    missing = rng.random(n) >= _incidence(expectations)
+    default = spec.get("default")
+    if default is not None and default not in categories:
+        categories.append(default)
+    codes[missing] = -1 if default is None else categories.index(default)
+
+    # Numeric categories are written to CSV as numbers, and read back as such,
+    # as long as no values are missing.
+    never_missing = default is not None or _incidence(expectations) == 1
+    if never_missing and all(c.isdigit() for c in categories):
+        return np.array([int(c) for c in categories])[codes]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _integer(spec, n, rng, ages):
+    expectations = spec["return_expectations"]
+    distribution = expectations["int"]
+    if distribution["distribution"] == "population_ages":
+        values = rng.choice(ages[0], size=n, p=ages[1])
+    elif distribution["distribution"] == "normal":
+        values = np.rint(rng.normal(distribution["mean"], distribution["stddev"], size=n))
+    else:
+        raise ValueError(f"Unknown distribution: {distribution['distribution']}")
+    values = values.astype("int64")
+    values[rng.random(n) >= _incidence(expectations)] = 0
+    return values
+
+
+def _date(spec, n, rng):
+    expectations = spec["return_expectations"]
+    earliest = np.datetime64(expectations["date"]["earliest"])
+    latest = expectations["date"].get("latest", "today")
+    latest = np.datetime64(TODAY if latest == "today" else latest)
+    days = rng.integers(0, max((latest - earliest).astype(int), 0) + 1, size=n)
+    dates = pd.Series((earliest + days).astype("datetime64[ns]"))
+    dates[rng.random(n) >= _incidence(expectations)] = pd.NaT
+    return dates.dt.strftime("%Y-%m-%d").to_numpy(dtype=object)
+
+
+def generate_column(spec, n, rng, ages=None):
+    """Generates `n` values of a variable from its expectations.
+
+    Args:
+        spec: The variable's entry in `definitions.variable_expectations`.
+        n: The number of values.
+        rng: A NumPy random generator.
+        ages: The distribution of ages, as returned by
+            `population_age_distribution`, for "population_ages".
+
+    Returns:
+        An array, or a `pd.Categorical`, of values.
+    """
+    expectations = spec["return_expectations"]
+    if "category" in expectations:
+        return _categorical(spec, n, rng)
+    if "int" in expectations:
+        return _integer(spec, n, rng, ages)
+    # Variables that don't say what they return, e.g. `registered_as_of`,
+    # return a binary flag.
+    if spec["returning"] in {None, "binary_flag"}:
+        return (rng.random(n) < _incidence(expectations)).astype("int64")
+    if "date" in expectations:
+        return _date(spec, n, rng)
+    raise ValueError(f"Can't generate dummy values for {spec}")
+
+
+def _generate_blocks(n_rows, expectations, ages, seed):
+    """Generates a dummy cohort in blocks of `BLOCK_ROWS` rows.
+
+    Each block is generated from its own stream, spawned from `seed`.
+    """
+    starts = range(0, n_rows, BLOCK_ROWS)
+    streams = np.random.SeedSequence(seed).spawn(len(starts))
+    for start, stream in zip(starts, streams):
+        rng = np.random.default_rng(stream)
+        n = min(BLOCK_ROWS, n_rows - start)
+        block = {"patient_id": np.arange(start + 1, start + n + 1)}
+        for name, spec in expectations.items():
+            block[name] = generate_column(spec, n, rng, ages)
+        yield pd.DataFrame(block, index=pd.RangeIndex(start, start + n))
+
+
+def generate_chunks(n_rows, module="study_definition", chunksize=CHUNKSIZE, seed=None):
+    """Generates a dummy cohort in chunks.
+
+    The rows are generated in blocks (see `BLOCK_ROWS`), which are then cut
+    into chunks, so for a given seed the cohort doesn't depend on `chunksize`.
+
+    Args:
+        n_rows: The number of patients.
+        module: The study definition to follow.
+        chunksize: The maximum number of rows per chunk.
+        seed: Seed for the random generator, for reproducible cohorts.
+
+    Yields:
+        A data frame for each chunk, with the columns of the extracted cohort.
+    """
+    expectations = definitions.variable_expectations(module)
+    ages = population_age_distribution()
+
+    pending, n_pending = [], 0
+    for block in _generate_blocks(n_rows, expectations, ages, seed):
+        pending.append(block)
+        n_pending += len(block)
+        if n_pending < chunksize:
+            continue
+        rows = pd.concat(pending)
+        n_full = len(rows) // chunksize * chunksize
+        for start in range(0, n_full, chunksize):
+            yield rows.iloc[start : start + chunksize]
+        pending = [rows.iloc[n_full:]] if n_full < len(rows) else []
+        n_pending = len(rows) - n_full
+    if pending:
+        yield pd.concat(pending)
+
+
+def write_dummy_cohort(path, n_rows, module="study_definition", chunksize=CHUNKSIZE, seed=None):
+    """Writes a dummy cohort to a CSV file, or to a columnar store.
+
+    Args:
+        path: Where to write the cohort. Paths ending .csv or .csv.gz are
+            written as (compressed) CSV; anything else as a columnar store.
+        n_rows: The number of patients.
+        module: The study definition to follow.
+        chunksize: The maximum number of rows per chunk.
+        seed: Seed for the random generator, for reproducible cohorts.
+    """
+    path = Path(path)
+    chunks = generate_chunks(n_rows, module, chunksize=chunksize, seed=seed)
+    if path.suffix not in {".csv", ".gz"}:
+        write_columnar(chunks, path, chunksize=chunksize)
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=i == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--study-definition", default="study_definition")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    write_dummy_cohort(
+        args.output,
+        args.rows,
+        module=args.study_definition,
+        chunksize=args.chunksize,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Resolves ethnicity from primary care, falling back to SUS.
+
+The study definition extracts each patient's ethnicity as recorded in
+primary care (`eth`, `eth16`) and in hospital records (`ethnicity_sus`,
+`ethnicity_sus16`), in 5 and 16 groups. Each patient's ethnicity is the
+primary care value if there is one, and the SUS value otherwise. Both
+groupings are resolved together, with one coalesce over a two-column array,
+which also records where each value came from.
+"""
+import numpy as np
+import pandas as pd
+
+# The cohort columns resolved from each pair of (primary care, SUS) columns,
+# and the number of groups in each.
+SOURCE_COLUMNS = {
+    "ethnicity": ("eth", "ethnicity_sus"),
+    "ethnicity_16": ("eth16", "ethnicity_sus16"),
+}
+N_GROUPS = {"ethnicity": 5, "ethnicity_16": 16}
+
+# Where each resolved value came from.
+MISSING = 0
+PRIMARY_CARE = 1
+SUS = 2
+SOURCE_LABELS = {MISSING: "Missing", PRIMARY_CARE: "Primary care", SUS: "SUS"}
+
+# Every column derived here, mapped to the extracted columns it is derived from.
+DERIVED_COLUMNS = {
+    **SOURCE_COLUMNS,
+    **{f"{column}_source": sources for column, sources in SOURCE_COLUMNS.items()},
+}
+
+
+def _groups(values, n_groups):
+    """Converts extracted categories to groups 1 to `n_groups`, and NaN if missing."""
+    values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float)
+    # Values outside the grouping never match a rule of the study definition.
+    return np.where(np.isnan(values) | ((values >= 1) & (values <= n_groups)), values, 0)
+
+
+def resolve_ethnicity(primary_care, sus):
+    """Takes ethnicity from primary care where recorded, and from SUS otherwise.
+
+    As in the study definition, a primary care value is used even if SUS
+    records a different one, and patients with neither are in group 0.
+
+    Args:
+        primary_care: An array of groups from primary care, NaN where none is
+            recorded. May be two-dimensional, to resolve several groupings at
+            once.
+        sus: An array of groups from SUS, the same shape as `primary_care`.
+
+    Returns:
+        A tuple of two uint8 arrays, the same shape as the inputs: the
+        resolved groups, and their sources (`MISSING`, `PRIMARY_CARE` or
+        `SUS`).
+    """
+    primary_care = np.asarray(primary_care, dtype=float)
+    sus = np.asarray(sus, dtype=float)
+    in_primary_care = ~np.isnan(primary_care)
+    in_sus = ~in_primary_care & (np.nan_to_num(sus) > 0)
+
+    groups = np.where(in_primary_care, primary_care, np.where(in_sus, sus, 0))
+    source = np.where(in_primary_care, PRIMARY_CARE, np.where(in_sus, SUS, MISSING))
+    return groups.astype("uint8"), source.astype("uint8")
+
+
+def add_ethnicity(chunk):
+    """Resolves ethnicity in a chunk of the cohort, if it has the source columns.
+
+    Every grouping whose source columns are all in the chunk is resolved (in
+    one pass), into columns `ethnicity`/`ethnicity_16` and
+    `ethnicity_source`/`ethnicity_16_source`; the source columns are dropped.
+    Chunks without source columns (e.g. that already have ethnicity) are
+    returned as they are.
+    """
+    columns = [c for c, sources in SOURCE_COLUMNS.items() if set(sources) <= set(chunk.columns)]
+    if not columns:
+        return chunk
+
+    primary_care = np.column_stack(
+        [_groups(chunk[SOURCE_COLUMNS[c][0]], N_GROUPS[c]) for c in columns]
+    )
+    sus = np.column_stack([_groups(chunk[SOURCE_COLUMNS[c][1]], N_GROUPS[c]) for c in columns])
+    groups, source = resolve_ethnicity(primary_care, sus)
+
+    chunk = chunk.drop(columns=[s for c in columns for s in SOURCE_COLUMNS[c]])
+    for i, column in enumerate(columns):
+        chunk[column] = groups[:, i]
+        chunk[f"{column}_source"] = source[:, i]
+    return chunk
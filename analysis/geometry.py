@@ -0,0 +1,306 @@
+"""Simplified STP boundaries, and the MSOA -> STP -> NUTS1 index, for coverage maps.
+
+The STP boundaries in lib/STPshapefile.json are parsed and simplified once,
+and kept as flat coordinate arrays in a binary cache next to them, which is
+invalidated when the GeoJSON changes. Each patient's MSOA, STP and NUTS1
+region come from their address, so rather than joining areas spatially, the
+MSOA -> STP -> NUTS1 nesting is read off the cohort's counts into integer
+index arrays. Coverage per area is then a matter of array lookups, and a map
+is drawn by writing the cached coordinates out as SVG paths.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).parents[1]
+STP_GEOJSON = BASE_DIR / "lib" / "STPshapefile.json"
+GEOMETRY_CACHE = BASE_DIR / "lib" / ".stp_geometry.npz"
+
+# The simplification tolerance, in degrees (about 200m).
+TOLERANCE = 0.002
+
+# Simplified geometries, by (sha, tolerance), for this process.
+_geometries = {}
+
+
+def simplify_ring(points, tolerance=TOLERANCE):
+    """Simplifies a ring of points with the Ramer-Douglas-Peucker algorithm.
+
+    Args:
+        points: An (n, 2) array of coordinates.
+        tolerance: The largest distance a dropped point may be from the
+            simplified ring.
+
+    Returns:
+        The points that are kept, in order.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    pending = [(0, len(points) - 1)]
+    while pending:
+        start, end = pending.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        between = points[start + 1 : end]
+        dx, dy = b - a
+        length = np.hypot(dx, dy)
+        if length == 0:
+            # The ends of a closed ring coincide; measure from the start.
+            distance = np.hypot(*(between - a).T)
+        else:
+            distance = np.abs(dx * (between[:, 1] - a[1]) - dy * (between[:, 0] - a[0])) / length
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            pending.extend([(start, i), (i, end)])
+    return points[keep]
+
+
+def _rings(geometry):
+    polygons = geometry["coordinates"]
+    if geometry["type"] == "Polygon":
+        polygons = [polygons]
+    for polygon in polygons:
+        yield from polygon
+
+
+def _parse(path, tolerance):
+    """Parses and simplifies a GeoJSON file into flat arrays."""
+    with open(path) as f:
+        features = json.load(f)["features"]
+
+    rings, ring_feature = [], []
+    for i, feature in enumerate(features):
+        for ring in _rings(feature["geometry"]):
+            simplified = simplify_ring(np.asarray(ring, dtype=float), tolerance)
+            # Rings that simplify to a line or a point (small islands) are dropped.
+            if len(simplified) >= 4:
+                rings.append(simplified)
+                ring_feature.append(i)
+
+    return {
+        "codes": np.array([f["properties"]["ons_code"] for f in features]),
+        "names": np.array([f["properties"]["name"] for f in features]),
+        "coords": np.concatenate(rings).astype("float32"),
+        "ring_offsets": np.cumsum([0] + [len(r) for r in rings]),
+        "ring_feature": np.array(ring_feature, dtype="int32"),
+    }
+
+
+def stp_geometry(path=None, tolerance=TOLERANCE, cache_path=None):
+    """Gets the simplified STP boundaries.
+
+    Args:
+        path: The GeoJSON file of STP boundaries. Defaults to `STP_GEOJSON`.
+        tolerance: The simplification tolerance, in degrees.
+        cache_path: Where to cache the simplified boundaries. Defaults to
+            `GEOMETRY_CACHE`.
+
+    Returns:
+        A dict of arrays:
+            codes, names: The ONS code and name of each STP.
+            coords: The (longitude, latitude) of every point, ring by ring.
+            ring_offsets: Where each ring starts in `coords`, and where the
+                last one ends.
+            ring_feature: The index of the STP each ring belongs to.
+    """
+    path = STP_GEOJSON if path is None else path
+    cache_path = GEOMETRY_CACHE if cache_path is None else cache_path
+    sha = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+    if (sha, tolerance) in _geometries:
+        return _geometries[sha, tolerance]
+
+    try:
+        with np.load(cache_path) as cached:
+            geometry = dict(cached)
+        if geometry.pop("sha") != sha or geometry.pop("tolerance") != tolerance:
+            geometry = None
+    except (OSError, KeyError, ValueError):
+        geometry = None
+
+    if geometry is None:
+        geometry = _parse(path, tolerance)
+        # As for the codelist cache, lib/ may be read-only in the job runner.
+        try:
+            np.savez(cache_path, sha=sha, tolerance=tolerance, **geometry)
+        except OSError:
+            pass
+
+    _geometries[sha, tolerance] = geometry
+    return geometry
+
+
+def _modal(counts, area, parent):
+    """Finds the `parent` that most of each `area`'s patients are in."""
+    counts = counts.dropna(subset=[area, parent])
+    counts = counts.groupby([area, parent], observed=True)["N"].sum().reset_index()
+    counts = counts.sort_values(["N", area, parent], ascending=[False, True, True], kind="stable")
+    return counts.drop_duplicates(area).set_index(area)[parent].sort_index()
+
+
+def area_index(msoa_stp_region, stp_codes, regions):
+    """Indexes how MSOAs nest into STPs and STPs into NUTS1 regions.
+
+    Each MSOA is assigned to the STP that most of its patients are registered
+    in, and each STP to the region that most of its patients live in.
+
+    Args:
+        msoa_stp_region: Cohort counts by `msoa`, `stp` and `region`.
+        stp_codes: The STP codes to index into, e.g. `stp_geometry()["codes"]`.
+        regions: The region names to index into.
+
+    Returns:
+        A dict with:
+            msoa: A `pd.Index` of MSOA codes.
+            msoa_stp: For each MSOA, the position of its STP in `stp_codes`.
+            stp_region: For each STP in `stp_codes`, the position of its
+                region in `regions`.
+        Positions are -1 where the STP or region is unknown.
+    """
+    msoa_stp = _modal(msoa_stp_region, "msoa", "stp")
+    stp_region = _modal(msoa_stp_region, "stp", "region")
+    stp_codes = pd.Index(stp_codes)
+    region_position = pd.Index(regions).get_indexer(stp_region.to_numpy())
+    return {
+        "msoa": pd.Index(msoa_stp.index),
+        "msoa_stp": stp_codes.get_indexer(msoa_stp.to_numpy()),
+        "stp_region": np.where(
+            stp_codes.isin(stp_region.index),
+            region_position[stp_region.index.get_indexer(stp_codes).clip(0)],
+            -1,
+        ),
+    }
+
+
+def totals_by(codes, counts, categories):
+    """Totals counts by category, with one array lookup.
+
+    Args:
+        codes: The category of each count.
+        counts: The counts.
+        categories: The categories to total by.
+
+    Returns:
+        An array of totals, aligned with `categories`. Counts in other
+        categories are ignored.
+    """
+    position = pd.Index(categories).get_indexer(codes)
+    known = position >= 0
+    return np.bincount(
+        position[known], weights=np.asarray(counts, dtype=float)[known], minlength=len(categories)
+    )
+
+
+def _colour(values, vmax, low=(255, 255, 240), high=(0, 0, 128)):
+    """Interpolates hex colours between `low` and `high`; white for NaN."""
+    fraction = np.clip(np.asarray(values, dtype=float) / vmax, 0, 1)
+    rgb = np.asarray(low) + np.outer(fraction, np.subtract(high, low))
+    rgb = np.rint(np.nan_to_num(rgb)).astype(int)
+    colours = np.array([f"#{r:02x}{g:02x}{b:02x}" for r, g, b in rgb])
+    return np.where(np.isnan(fraction), "#ffffff", colours)
+
+
+def render_svg(geometry, values, path, title, labels=None, vmax=None, width=600):
+    """Draws a choropleth map of the STPs as an SVG file.
+
+    Args:
+        geometry: STP boundaries, as returned by `stp_geometry`.
+        values: The value to colour each STP by, aligned with
+            `geometry["codes"]`; NaN for no value.
+        path: The SVG file to write.
+        title: The title of the map.
+        labels: A list of (longitude, latitude, text) labels to draw.
+        vmax: The value at the top of the colour scale. Defaults to the
+            largest value.
+        width: The width of the map, in pixels.
+    """
+    values = np.asarray(values, dtype=float)
+    vmax = np.nanmax(values) if vmax is None else vmax
+    coords = geometry["coords"].astype(float)
+
+    # An equirectangular projection, scaled to the map's mid latitude.
+    lon, lat = coords[:, 0], coords[:, 1]
+    aspect = np.cos(np.radians((lat.min() + lat.max()) / 2))
+    scale = (width - 20) / ((lon.max() - lon.min()) * aspect)
+    height = int(np.ceil((lat.max() - lat.min()) * scale)) + 60
+
+    def project(x, y):
+        return 10 + (x - lon.min()) * aspect * scale, 50 + (lat.max() - y) * scale
+
+    xs, ys = project(lon, lat)
+    offsets = geometry["ring_offsets"]
+    paths = [[] for _ in geometry["codes"]]
+    for i, feature in enumerate(geometry["ring_feature"]):
+        ring = slice(offsets[i], offsets[i + 1])
+        points = " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(xs[ring], ys[ring]))
+        paths[feature].append(f"M{points}Z")
+
+    colours = _colour(values, vmax)
+    lines = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="sans-serif">',
+        f'<text x="10" y="25" font-size="16">{title}</text>',
+    ]
+    for code, d, colour, value in zip(geometry["codes"], paths, colours, values):
+        lines.append(
+            f'<path d="{" ".join(d)}" fill="{colour}" fill-rule="evenodd" '
+            f'stroke="black" stroke-width="0.5"><title>{code}: {value:g}</title></path>'
+        )
+    for x, y, text in labels or []:
+        x, y = project(x, y)
+        lines.append(
+            f'<text x="{x:.1f}" y="{y:.1f}" font-size="11" text-anchor="middle" '
+            f'stroke="white" stroke-width="3" paint-order="stroke">{text}</text>'
+        )
+    lines.append("</svg>")
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text("\n".join(lines))
+
+
+def centroids(geometry, groups=None, n_groups=None):
+    """Finds the centre of each STP, or of groups of them, weighted by area.
+
+    Args:
+        geometry: STP boundaries, as returned by `stp_geometry`.
+        groups: The group of each STP, e.g. `area_index(...)["stp_region"]`.
+            Defaults to each STP on its own.
+        n_groups: The number of groups.
+
+    Returns:
+        An (n_groups, 2) array of (longitude, latitude); NaN for empty groups.
+    """
+    coords = geometry["coords"].astype(float)
+    offsets = geometry["ring_offsets"]
+    x, y = coords[:, 0], coords[:, 1]
+    # Shoelace terms for each edge; the edge from the last point of a ring to
+    # the first of the next is dropped.
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    cross[offsets[1:-1] - 1] = 0
+    cross = np.append(cross, 0)
+    cx = (x + np.append(x[1:], 0)) * cross
+    cy = (y + np.append(y[1:], 0)) * cross
+
+    starts = offsets[:-1]
+    area = np.add.reduceat(cross, starts) / 2
+    ring_cx = np.add.reduceat(cx, starts) / 6
+    ring_cy = np.add.reduceat(cy, starts) / 6
+
+    group = geometry["ring_feature"]
+    if groups is not None:
+        group = np.asarray(groups)[group]
+        n = n_groups
+    else:
+        n = len(geometry["codes"])
+    known = group >= 0
+    total_area = np.bincount(group[known], weights=area[known], minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.column_stack([
+            np.bincount(group[known], weights=ring_cx[known], minlength=n) / total_area,
+            np.bincount(group[known], weights=ring_cy[known], minlength=n) / total_area,
+        ])
@@ -0,0 +1,43 @@
+"""Labels Index of Multiple Deprivation (IMD) groups.
+
+The study definition puts each patient's IMD rank into a quintile (see `imd`
+in common_variables.py), so the cohort, like data/imd_ons.csv.gz, only carries
+quintiles, from 1 (most deprived) to 5, with 0 for unknown. Here they are
+labelled as ordered categoricals, the same way for the cohort and for ONS.
+"""
+import numpy as np
+import pandas as pd
+
+
+def imd_labels(n_groups=5):
+    """Gets the labels of IMD groups, from most to least deprived."""
+    labels = [str(k) for k in range(1, n_groups + 1)]
+    labels[0] = "1: Most deprived"
+    labels[-1] = f"{n_groups}: Least deprived"
+    return labels
+
+
+def imd_categorical(groups, n_groups=5, labels=None, unknown=None):
+    """Labels IMD groups as an ordered categorical, from most to least deprived.
+
+    Args:
+        groups: An array-like of IMD groups, 1 to `n_groups`, as in the `imd`
+            column of the cohort or of data/imd_ons.csv.gz.
+        n_groups: The number of groups.
+        labels: The labels of the groups. Defaults to `imd_labels(n_groups)`.
+        unknown: The label of unknown groups (0, or out of range), placed
+            before the others. Defaults to leaving them missing.
+
+    Returns:
+        A `pd.Categorical`.
+    """
+    labels = imd_labels(n_groups) if labels is None else list(labels)
+    groups = np.asarray(groups, dtype=float)
+    known = (groups >= 1) & (groups <= n_groups)
+    if unknown is None:
+        codes = np.where(known, groups - 1, -1)
+    else:
+        labels = [unknown, *labels]
+        codes = np.where(known, groups, 0)
+    return pd.Categorical.from_codes(codes.astype("int8"), categories=labels, ordered=True)
+
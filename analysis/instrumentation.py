@@ -0,0 +1,256 @@
+"""Records the time, memory and rows of each stage of an action.
+
+Each action's `main` is decorated with `action`, and its stages run inside
+`stage` (or are functions decorated with `instrumented`). For every stage, the wall time,
+CPU time, peak resident memory of the process, and the rows it read and
+wrote are recorded, and when the action finishes they are written to
+output/logs/<action>.json, so that runs on different snapshots can be
+compared. For example:
+
+    @action("counts")
+    def main():
+        with stage("count_cohort") as record:
+            counts = cached_count_cohort()
+            record["rows_out"] = len(counts)
+        imd_table(counts["imd_sex"], ...)  # decorated with @instrumented()
+
+Setting the environment variable `PROFILE` to "cprofile" also profiles the
+action, writing output/logs/<action>.prof (for `pstats`); setting it to
+"tracemalloc" also records each stage's peak traced memory (which, unlike
+peak RSS, is per stage), and the lines holding the most memory at the end of
+the action. Both slow the action down, so are off by default.
+
+The logs are released, so the rows of each stage, which may be counts of
+patients, are redacted and rounded as for the published tables (see
+`redact_rows`).
+"""
+import cProfile
+import datetime
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from disclosure import round_to_nearest, suppress_small_numbers
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = Path(__file__).parents[1]
+LOGS_DIR = BASE_DIR / "output" / "logs"
+
+PROFILE_MODES = ["cprofile", "tracemalloc"]
+# The number of allocation sites recorded in tracemalloc mode.
+TOP_ALLOCATIONS = 10
+# Row counts of this many or fewer are suppressed, and the rest are rounded to
+# the nearest multiple of ROWS_ROUND_TO, as for the published tables.
+ROWS_THRESHOLD = 5
+ROWS_ROUND_TO = 5
+
+# The records of this process's stages, in the order they finished, and the
+# names and traced peak memory of the stages that are running.
+_records = []
+_running = []
+_peaks = []
+# Whether an action is tracing memory allocations. (Stages outside one leave
+# tracemalloc alone, e.g. when benchmark.py is tracing.)
+_tracing = False
+
+
+def profile_mode():
+    """Gets the profiling mode from the `PROFILE` environment variable, if any."""
+    mode = os.environ.get("PROFILE", "").lower() or None
+    if mode is not None and mode not in PROFILE_MODES:
+        raise ValueError(f"PROFILE must be one of {PROFILE_MODES}, not {mode!r}")
+    return mode
+
+
+def peak_rss_mb():
+    """Gets the peak resident memory of this process so far, in MB, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in KB elsewhere.
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _is_table(value):
+    return isinstance(value, (pd.DataFrame, pd.Series))
+
+
+def _count_rows(value):
+    """Counts the rows of a table, or of a dict or list of tables."""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)) and value and all(_is_table(v) for v in value):
+        return sum(len(v) for v in value)
+    if _is_table(value):
+        return len(value)
+    return None
+
+
+@contextmanager
+def stage(name, rows_in=None, rows_out=None):
+    """Records the time, memory and rows of a block.
+
+    Args:
+        name: The name of the stage.
+        rows_in: The number of rows the stage reads, if known up front.
+        rows_out: The number of rows the stage writes, if known up front.
+
+    Yields:
+        The stage's record, a dict whose `rows_in` and `rows_out` can be set
+        within the block, as can other details of the stage to log.
+    """
+    record = {
+        "stage": name,
+        "parent": _running[-1] if _running else None,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+    }
+    tracing = _tracing
+    if tracing:
+        # The traced peak is reset for each stage, so the peak of the stages
+        # it's in is kept here.
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+        _peaks.append(0)
+        tracemalloc.reset_peak()
+
+    _running.append(name)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall, 4)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 4)
+        record["peak_rss_mb"] = peak_rss_mb()
+        if tracing:
+            peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            record["peak_traced_mb"] = round(peak / 2**20, 2)
+        _running.pop()
+        _records.append(record)
+
+
+def instrumented(name=None):
+    """Records each call of the decorated function as a stage.
+
+    The rows in are the rows of the function's first argument, and the rows
+    out are the rows of what it returns, if they are tables (or dicts or
+    lists of tables). Calls outside an action aren't recorded.
+
+    Args:
+        name: The name of the stage. Defaults to the function's name.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _running:
+                return function(*args, **kwargs)
+            rows_in = _count_rows(args[0]) if args else None
+            with stage(name or function.__name__, rows_in=rows_in) as record:
+                result = function(*args, **kwargs)
+                record["rows_out"] = _count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def redact_rows(n):
+    """Suppresses and rounds a row count for release, with None for suppressed counts."""
+    if n is None:
+        return None
+    rounded = round_to_nearest(suppress_small_numbers(n, ROWS_THRESHOLD), ROWS_ROUND_TO)
+    return None if pd.isna(rounded) else int(rounded)
+
+
+def write_run(name, started, logs_dir=None, profiler=None, allocations=None):
+    """Writes the records of this process's stages to <logs_dir>/<name>.json.
+
+    Args:
+        name: The name of the action.
+        started: When the action started, as an ISO 8601 string.
+        logs_dir: Where to write the records. Defaults to `LOGS_DIR`.
+        profiler: The action's `cProfile.Profile`, if any, which is written
+            to <logs_dir>/<name>.prof.
+        allocations: The lines that allocated the most memory, if traced.
+
+    Returns:
+        The run: a dict with the action's `name`, when it `started`, the
+        `environment` it ran in, the profiling `mode`, the `stages`, and the
+        `top_allocations`, if any. The stages' rows are redacted (see
+        `redact_rows`).
+    """
+    logs_dir = LOGS_DIR if logs_dir is None else Path(logs_dir)
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    run = {
+        "action": name,
+        "started": started,
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "mode": profile_mode(),
+        "stages": [
+            {**r, "rows_in": redact_rows(r["rows_in"]), "rows_out": redact_rows(r["rows_out"])}
+            for r in _records
+        ],
+    }
+    if allocations is not None:
+        run["top_allocations"] = allocations
+    with open(logs_dir / f"{name}.json", "w") as f:
+        json.dump(run, f, indent=2)
+    if profiler is not None:
+        profiler.dump_stats(logs_dir / f"{name}.prof")
+    return run
+
+
+@contextmanager
+def action(name, logs_dir=None):
+    """Records an action as a stage, and writes the records of its stages when it ends.
+
+    Can be used as a context manager, or to decorate the action's `main`.
+
+    Args:
+        name: The name of the action, as in project.yaml.
+        logs_dir: Where to write the records. Defaults to `LOGS_DIR`.
+    """
+    global _tracing
+    _records.clear()
+    mode = profile_mode()
+    started = datetime.datetime.now().isoformat(timespec="seconds")
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    tracing = mode == "tracemalloc" and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+        _tracing = True
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with stage(name) as record:
+            yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        allocations = None
+        if tracing:
+            statistics = tracemalloc.take_snapshot().statistics("lineno")
+            tracemalloc.stop()
+            _tracing = False
+            allocations = [str(s) for s in statistics[:TOP_ALLOCATIONS]]
+        write_run(name, started, logs_dir, profiler, allocations)
@@ -0,0 +1,40 @@
+"""Module attributes that are built on first access, and then kept.
+
+The study definitions import their codelists and variables from modules that
+would otherwise build all of them at import: parsing codelist CSVs, and
+building large nested dicts of return expectations. Those modules define a
+builder function for each attribute instead, and a module `__getattr__`
+(PEP 562) from `lazy_attributes`, so that each is built when it is first
+imported (or accessed), and only by the studies that use it.
+
+A study definition still builds everything it uses when it is imported, as
+`StudyDefinition` takes the variables themselves, and cohortextractor reads
+`study` as soon as it imports the definition. So the main study definition,
+which uses the registration and demographic variables, only skips the death
+variables and codelists; the win is mostly the deaths study definition's,
+which skips the demographic variables and the ethnicity codelists.
+"""
+import sys
+
+
+def lazy_attributes(module_name, builders):
+    """Gets a module `__getattr__` that builds attributes on first access.
+
+    Args:
+        module_name: The `__name__` of the module.
+        builders: A dict mapping each attribute name to a function of no
+            arguments that builds it.
+
+    Returns:
+        A function to assign to the module's `__getattr__`. A built attribute
+        is set on the module, so later accesses don't go through it.
+    """
+
+    def __getattr__(name):
+        if name not in builders:
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+        value = builders[name]()
+        setattr(sys.modules[module_name], name, value)
+        return value
+
+    return __getattr__
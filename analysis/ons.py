@@ -0,0 +1,482 @@
+"""ONS reference populations, parsed once into a typed, cached store.
+
+The ONS tables in data/ are converted once from the ONS estimates and the
+nomis workbooks (see `workbook_tables`, which reads the workbooks with the
+standard library, and `main`), and committed as CSVs. They are read at most
+once per process, with a fixed type for every column, and kept in a binary
+cache next to them, so that later processes don't parse them at all. The
+tables derived from them, such as the population of each region, sex and age
+group, are computed when the tables are parsed, and cached with them. Cached
+tables are invalidated when the hash of their CSV changes.
+
+Every TPP table is compared against these denominators, so they are also
+indexed by (region, sex, age group), for looking up many groups at once (see
+`denominators`, and `summary_tables.ons_comparison_table`).
+"""
+import argparse
+import hashlib
+import pickle
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).parents[1]
+DATA_DIR = BASE_DIR / "data"
+CACHE_PATH = DATA_DIR / ".ons.pickle"
+
+# The type of each column of each ONS table, by table name and file.
+ONS_TABLES = {
+    "age_sex": (
+        "age_ons_sex.csv.gz",
+        {
+            "Age": "int64",
+            "Region": "object",
+            "N": "int64",
+            "Total": "int64",
+            "percentage": "float64",
+            "age_group": "object",
+            "sex": "object",
+            "cohort": "object",
+        },
+    ),
+    "imd": (
+        "imd_ons.csv.gz",
+        {"imd": "int64", "N": "int64", "sex": "object", "cohort": "object"},
+    ),
+    "ethnicity": (
+        "ethnicity_ons.csv.gz",
+        {
+            "region": "object",
+            "Ethnic_Group": "object",
+            "N": "int64",
+            "Total": "int64",
+            "percentage": "float64",
+            "group": "object",
+            "cohort": "object",
+        },
+    ),
+    "deaths": (
+        "death_ons.csv.gz",
+        {"Cause_of_Death": "object", "Region": "object", "N": "int64", "Total": "int64"},
+    ),
+}
+
+# The workbook each ONS table is converted from (see `workbook_tables`).
+WORKBOOKS = {
+    "age_sex": "nomis_2021_11_22_110504.xlsx",
+    "imd": "populationbyimdenglandandwales2020.xlsx",
+    "ethnicity": "nomis_2021_11_22_213653.xlsx",
+    "deaths": "nomis_2021_11_22_104904.xlsx",
+}
+
+# The row of the header of each sex's block of the nomis age workbook.
+AGE_HEADER_ROWS = {"Total": 7, "Male": 109, "Female": 211}
+
+# The 2011 census ethnic groups that are renamed to the groups of the cohort,
+# and the groups of the cohort in each of the 5 groups.
+ETHNIC_GROUP_NAMES = {
+    "English/Welsh/Scottish/Northern Irish/British": "White British",
+    "Irish": "White Irish",
+    "Arab": "Any other ethnic group",
+    "Gypsy or Irish Traveller": "Other White",
+}
+# As in ONS_process.R, White Irish is in none of the 5 groups (it's looked up
+# by its name before renaming), so is counted as NA.
+ETHNIC_GROUPS_5 = {
+    "White British": "White",
+    "Other White": "White",
+    "White and Black Caribbean": "Mixed/multiple ethnic groups",
+    "White and Black African": "Mixed/multiple ethnic groups",
+    "White and Asian": "Mixed/multiple ethnic groups",
+    "Other Mixed": "Mixed/multiple ethnic groups",
+    "Indian": "Asian",
+    "Pakistani": "Asian",
+    "Bangladeshi": "Asian",
+    "Other Asian": "Asian",
+    "African": "Black",
+    "Caribbean": "Black",
+    "Other Black": "Black",
+    "Any other ethnic group": "Other",
+    "Chinese": "Other",
+}
+
+# The age group of denominators over all ages.
+ALL_AGES = "Total"
+
+_XLSX_NS = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+}
+
+# Parsed tables, by name, for this process.
+_tables = {}
+
+
+def _sha(filename, data_dir):
+    return hashlib.sha1((data_dir / filename).read_bytes()).hexdigest()
+
+
+def _parse(name, data_dir):
+    """Parses an ONS table, with the types in `ONS_TABLES`."""
+    filename, dtypes = ONS_TABLES[name]
+    table = pd.read_csv(data_dir / filename, dtype=dtypes)
+    if list(table.columns) != list(dtypes):
+        raise ValueError(f"Unexpected columns in {filename}: {list(table.columns)}")
+    return table
+
+
+def age_group_table(age_sex):
+    """Collapses the ONS single-year age estimates to age groups.
+
+    Returns:
+        The population of each `age_group`, `sex` and `region` (including
+        England), with the `Total` of its region and sex.
+    """
+    return (
+        age_sex.groupby(["age_group", "sex", "Region"])
+        .agg(N=("N", "sum"), Total=("Total", "mean"), percentage=("percentage", "sum"))
+        .reset_index()
+        .rename(columns={"Region": "region"})
+        .assign(cohort="ONS")
+    )
+
+
+def denominator_table(age_groups):
+    """Indexes the population of each region, sex and age group.
+
+    Populations over all ages are under the age group `ALL_AGES`.
+
+    Returns:
+        A series of populations, indexed by `region`, `sex` and `age_group`,
+        and sorted.
+    """
+    by_age = age_groups.set_index(["region", "sex", "age_group"])["N"]
+    all_ages = (
+        age_groups.drop_duplicates(["region", "sex"])
+        .assign(age_group=ALL_AGES)
+        .set_index(["region", "sex", "age_group"])["Total"]
+        .rename("N")
+    )
+    return pd.concat([by_age, all_ages]).astype("int64").sort_index()
+
+
+def _derive(tables):
+    """Computes the tables derived from the parsed ONS tables."""
+    age_groups = age_group_table(tables["age_sex"])
+    totals = age_groups[(age_groups["sex"] == "Total") & (age_groups["region"] != "England")]
+    return {
+        "age_group": age_groups,
+        "denominators": denominator_table(age_groups),
+        "regions": (
+            totals[["region", "Total"]]
+            .drop_duplicates("region")
+            .astype({"Total": "int64"})
+            .reset_index(drop=True)
+        ),
+    }
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    # Data frames pickled by another version of pandas may fail to unpickle
+    # with almost any error (e.g. AttributeError, ModuleNotFoundError), and
+    # any failure is a cache miss.
+    except Exception:
+        return {}
+
+
+def _write_cache(cache, cache_path):
+    # As for the codelist cache, data/ may be read-only in the job runner.
+    try:
+        with open(cache_path, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+
+def ons_store(data_dir=None, cache_path=None):
+    """Gets every ONS table, and the tables derived from them.
+
+    Args:
+        data_dir: The directory of the ONS CSVs. Defaults to `DATA_DIR`.
+        cache_path: Where to cache the parsed tables. Defaults to `CACHE_PATH`.
+
+    Returns:
+        A dict of data frames: the tables of `ONS_TABLES`, by name, and
+            age_group: The population by age group (see `age_group_table`).
+            denominators: The population by region, sex and age group (see
+                `denominator_table`).
+            regions: The `Total` population of each region, excluding England.
+    """
+    data_dir = DATA_DIR if data_dir is None else Path(data_dir)
+    cache_path = CACHE_PATH if cache_path is None else cache_path
+    shas = tuple(_sha(filename, data_dir) for filename, _ in ONS_TABLES.values())
+    if shas in _tables:
+        return _tables[shas]
+
+    cache = _read_cache(cache_path)
+    if cache.get("shas") == shas:
+        store = cache["tables"]
+    else:
+        store = {name: _parse(name, data_dir) for name in ONS_TABLES}
+        store.update(_derive(store))
+        _write_cache({"shas": shas, "tables": store}, cache_path)
+
+    _tables[shas] = store
+    return store
+
+
+def ons_table(name):
+    """Gets a copy of a table of `ons_store`, e.g. "imd" or "age_group"."""
+    return ons_store()[name].copy()
+
+
+def denominators(keys, store=None):
+    """Looks up the ONS population of many groups at once.
+
+    Args:
+        keys: A data frame with a `region` column (a region, or England), and
+            optionally `sex` ("Male", "Female" or "Total") and `age_group`
+            columns. Without a `sex` column, both sexes are counted, and
+            without an `age_group` column, all ages.
+        store: The ONS store. Defaults to `ons_store()`.
+
+    Returns:
+        A float array of the population of each row of `keys`, with NaN for
+        groups the ONS doesn't count (e.g. a missing region).
+    """
+    store = ons_store() if store is None else store
+    table = store["denominators"]
+    n = len(keys)
+    index = pd.MultiIndex.from_arrays(
+        [
+            keys["region"].astype(object),
+            keys["sex"].astype(object) if "sex" in keys else np.full(n, "Total", dtype=object),
+            keys["age_group"].astype(object)
+            if "age_group" in keys
+            else np.full(n, ALL_AGES, dtype=object),
+        ],
+        names=table.index.names,
+    )
+    positions = table.index.get_indexer(index)
+    # get_indexer gives -1 for groups that aren't in the table, which picks
+    # the trailing NaN.
+    values = np.append(table.to_numpy(dtype=float), np.nan)
+    return values[positions]
+
+
+def _xlsx_column(ref):
+    """Gets the (0-based) column of a cell reference, e.g. 2 for "C7"."""
+    column = 0
+    for letter in re.match(r"[A-Z]+", ref).group():
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return column - 1
+
+
+def xlsx_rows(path, sheet=None):
+    """Reads the cells of a worksheet of an xlsx workbook.
+
+    Workbooks are zipped XML, so they are read with the standard library,
+    without a spreadsheet package.
+
+    Args:
+        path: The path to the workbook.
+        sheet: The name of the worksheet. Defaults to the first.
+
+    Returns:
+        A list with a list for each row of the sheet, from row 1, of the
+        values of its cells: floats for numbers, strings for text, and None
+        for empty cells.
+    """
+    with zipfile.ZipFile(path) as workbook:
+        names = workbook.namelist()
+        book = ET.fromstring(workbook.read("xl/workbook.xml"))
+        sheets = {
+            s.get("name"): s.get(f"{{{_XLSX_NS['r']}}}id")
+            for s in book.find("m:sheets", _XLSX_NS)
+        }
+        relationships = ET.fromstring(workbook.read("xl/_rels/workbook.xml.rels"))
+        targets = {r.get("Id"): r.get("Target") for r in relationships}
+        target = targets[sheets[next(iter(sheets)) if sheet is None else sheet]]
+        target = target.lstrip("/")
+        target = target if target.startswith("xl/") else f"xl/{target}"
+
+        strings = []
+        if "xl/sharedStrings.xml" in names:
+            for item in ET.fromstring(workbook.read("xl/sharedStrings.xml")):
+                strings.append("".join(t.text or "" for t in item.iter(f"{{{_XLSX_NS['m']}}}t")))
+        worksheet = ET.fromstring(workbook.read(target))
+
+    rows = []
+    for row in worksheet.iter(f"{{{_XLSX_NS['m']}}}row"):
+        rows.extend([] for _ in range(int(row.get("r")) - 1 - len(rows)))
+        values = []
+        for cell in row.findall("m:c", _XLSX_NS):
+            values.extend([None] * (_xlsx_column(cell.get("r")) - len(values)))
+            value = cell.find("m:v", _XLSX_NS)
+            kind = cell.get("t")
+            if kind == "inlineStr":
+                values.append("".join(t.text or "" for t in cell.iter(f"{{{_XLSX_NS['m']}}}t")))
+            elif value is None:
+                values.append(None)
+            elif kind == "s":
+                values.append(strings[int(value.text)])
+            elif kind in {"str", "e"}:
+                values.append(value.text)
+            else:
+                values.append(float(value.text))
+        rows.append(values)
+    return rows
+
+
+def _block(rows, header):
+    """Gets the table under a header row (from 1), up to the next empty row."""
+    columns = rows[header - 1]
+    body = []
+    for row in rows[header:]:
+        if not any(v is not None for v in row):
+            break
+        body.append(row + [None] * (len(columns) - len(row)))
+    return pd.DataFrame([row[: len(columns)] for row in body], columns=columns)
+
+
+def _melt(frame, key, var_name, value_name):
+    """Melts the columns of `frame` other than `key` a row at a time, as R's
+    `pivot_longer`, rather than a column at a time, as `pd.melt`."""
+    values = frame.drop(columns=key)
+    return pd.DataFrame(
+        {
+            key: np.repeat(frame[key].to_numpy(), values.shape[1]),
+            var_name: np.tile(values.columns.to_numpy(dtype=object), len(frame)),
+            value_name: values.to_numpy(dtype=float).ravel(),
+        }
+    )
+
+
+def _age_group(ages):
+    groups = np.minimum(ages // 5, 18)
+    return [f"{5 * g}-{5 * g + 4}" if g < 18 else "90+" for g in groups]
+
+
+def _age_sex_from_workbook(rows):
+    tables = []
+    for sex, header in AGE_HEADER_ROWS.items():
+        block = _block(rows, header)
+        block["England"] = block.drop(columns="Age").sum(axis=1)
+        all_ages = block["Age"] == "All Ages"
+        totals = block[all_ages].drop(columns="Age").iloc[0]
+
+        table = _melt(block[~all_ages], "Age", "Region", "N")
+        table["Total"] = table["Region"].map(totals)
+        table["percentage"] = table["N"] / table["Total"] * 100
+        table["Age"] = table["Age"].str.extract(r"(\d+)", expand=False).astype("int64")
+        table["age_group"] = _age_group(table["Age"].to_numpy())
+        table["sex"] = sex
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True).assign(cohort="ONS")
+
+
+def _imd_from_workbook(rows):
+    # Rows of the deciles of each sex, under the header row of ages.
+    body = [row for row in rows[4:] if len(row) > 1 and isinstance(row[1], float)]
+    sexes = pd.Series([row[0] for row in body]).ffill()
+    deciles = np.array([row[1] for row in body])
+    by_sex = pd.DataFrame(
+        {
+            "sex": sexes,
+            "imd": ((deciles + 1) // 2).astype("int64"),
+            "N": [sum(v for v in row[2:] if v is not None) for row in body],
+        }
+    )
+    by_sex = by_sex.groupby(["sex", "imd"], as_index=False)["N"].sum()
+    total = by_sex.groupby("imd", as_index=False)["N"].sum().assign(sex="Total")
+    return pd.concat([total, by_sex], ignore_index=True).assign(cohort="ONS")
+
+
+def _ethnicity_from_workbook(rows):
+    block = _block(rows, 9)
+    names = block.pop("Ethnic Group").str.split(": ", n=1).str[1]
+    known = names.notna()
+    groups_16 = names[known].replace(ETHNIC_GROUP_NAMES)
+    groups = {"5_2001": groups_16.map(ETHNIC_GROUPS_5), "16_2001": groups_16}
+
+    tables = []
+    for group, labels in groups.items():
+        table = _melt(block[known].assign(Ethnic_Group=labels), "Ethnic_Group", "region", "N")
+        table = (
+            table.groupby(["region", "Ethnic_Group"], dropna=False, as_index=False)["N"]
+            .sum()
+            # R sorted these in its locale's order, which ignores case
+            .sort_values(["region", "Ethnic_Group"], key=lambda s: s.str.lower())
+            .reset_index(drop=True)
+        )
+        table["Total"] = table.groupby("region")["N"].transform("sum")
+        table["percentage"] = table["N"] / table["Total"] * 100
+        table["group"] = group
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True).assign(cohort="ONS")
+
+
+def _deaths_from_workbook(rows):
+    block = _block(rows, 9).rename(columns={"cause of death": "cause"})
+    counts = block.drop(columns="cause")
+    regions = [c for c in counts.columns if not c.startswith("Wales")]
+    totals = counts.iloc[0][regions]
+    totals["England"] = totals.sum()
+
+    # As in ONS_process.R, England's deaths from each cause include Wales's,
+    # but its total deaths don't.
+    causes = block[block["cause"].str.startswith("L")]
+    deaths = causes[regions].assign(England=counts.loc[causes.index].sum(axis=1))
+    deaths.insert(0, "Cause_of_Death", causes["cause"].str.split(" ", n=1).str[1])
+    table = _melt(deaths, "Cause_of_Death", "Region", "N")
+    table["Total"] = table["Region"].map(totals)
+    return table
+
+
+def workbook_tables(data_dir=None):
+    """Converts the ONS estimates and nomis workbooks into the ONS tables.
+
+    This is the conversion of analysis/ONS_process.R, which the committed
+    CSVs were written by, reproduced (quirks and all) without R.
+
+    Args:
+        data_dir: The directory of the workbooks. Defaults to `DATA_DIR`.
+
+    Returns:
+        A dict of data frames, by the names of `ONS_TABLES`, with their types.
+    """
+    data_dir = DATA_DIR if data_dir is None else Path(data_dir)
+    converters = {
+        "age_sex": (_age_sex_from_workbook, None),
+        "imd": (_imd_from_workbook, "Table 1 - England"),
+        "ethnicity": (_ethnicity_from_workbook, None),
+        "deaths": (_deaths_from_workbook, None),
+    }
+    tables = {}
+    for name, (convert, sheet) in converters.items():
+        table = convert(xlsx_rows(data_dir / WORKBOOKS[name], sheet))
+        dtypes = ONS_TABLES[name][1]
+        tables[name] = table[list(dtypes)].astype(dtypes)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts the ONS workbooks in data/ into the ONS tables."
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = parser.parse_args()
+
+    for name, table in workbook_tables(args.data_dir).items():
+        table.to_csv(args.data_dir / ONS_TABLES[name][0], index=False, na_rep="NA")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Per-practice counts of the cohort, in arrays indexed by practice code.
+
+There are a few thousand TPP practices, but tens of millions of patients, so
+questions about practices (how many have patients in the cohort, which have
+any events, what their patients look like) are answered from per-practice
+arrays, rather than from the patients. Practice IDs are pseudonymised, so
+needn't be small; they are re-indexed densely, as codes from 0 in order of
+first appearance (see `practice_codes`), and every array has a row per code.
+
+Per-practice counts are an int64 array whose rows are the joint counts of a
+practice's patients by the demographic variables in `PRACTICE_VARIABLES` (as
+in `crosstab`). They are updated a chunk of the cohort at a time, with one
+`np.bincount`, and grow as new practices are seen. Sets of practices are
+boolean masks indexed by practice code.
+"""
+import numpy as np
+import pandas as pd
+
+import cohort_schema
+import crosstab
+
+# The variables each practice's patients are counted by.
+PRACTICE_VARIABLES = ["sex", "age_group"]
+
+# The most practices an array can have a row for, which bounds its size.
+MAX_PRACTICES = 1 << 24
+
+
+def _practice_ids(values):
+    """Gets practice IDs as int64, with -1 for missing (or invalid) IDs."""
+    ids = pd.to_numeric(pd.Series(values, copy=False), errors="coerce")
+    ids = ids.fillna(-1).to_numpy(dtype="int64")
+    ids[ids < 0] = -1
+    return ids
+
+
+def _grow(array, n):
+    """Pads an array with zero rows to at least `n` rows."""
+    if len(array) >= n:
+        return array
+    padding = np.zeros((n - len(array), *array.shape[1:]), dtype=array.dtype)
+    return np.concatenate([array, padding])
+
+
+def practice_codes(ids, index=None):
+    """Re-indexes practice IDs as dense codes.
+
+    Args:
+        ids: An array-like of practice IDs. Missing IDs are ignored.
+        index: The practice IDs already seen, in order of their codes, e.g.
+            from an earlier chunk. Defaults to none.
+
+    Returns:
+        A tuple of an int64 array of the code of each of `ids` (with -1 for
+        missing IDs), and the index of practice IDs, with any unseen IDs
+        appended.
+    """
+    ids = _practice_ids(ids)
+    index = pd.Index([], dtype="int64") if index is None else index
+    codes = index.get_indexer(ids)
+    unseen = (codes < 0) & (ids >= 0)
+    if unseen.any():
+        index = index.append(pd.Index(pd.unique(ids[unseen])))
+        codes[unseen] = index.get_indexer(ids[unseen])
+    return codes, index
+
+
+def empty_practice_counts(variables=None):
+    """Gets per-practice counts of no patients."""
+    variables = PRACTICE_VARIABLES if variables is None else variables
+    return np.zeros((0, *crosstab.joint_shape(variables)), dtype="int64")
+
+
+def add_practice_counts(counts, index, chunk, variables=None):
+    """Adds a chunk of the cohort to per-practice counts.
+
+    Args:
+        counts: Per-practice counts, e.g. from `empty_practice_counts`. They
+            are updated in place, unless they need to grow.
+        index: The practice IDs of the rows of `counts` (see
+            `practice_codes`), or None for no practices.
+        chunk: A data frame with a `practice_id` column, and a column for each
+            variable. Patients without a practice aren't counted.
+        variables: The variables the counts are by. Defaults to
+            `PRACTICE_VARIABLES`.
+
+    Returns:
+        A tuple of the updated counts, with a row for each practice seen so
+        far and an axis for each variable (see `crosstab.joint_shape`), and
+        the practice IDs of their rows.
+    """
+    variables = PRACTICE_VARIABLES if variables is None else variables
+    shape = crosstab.joint_shape(variables)
+    cells = int(np.prod(shape))
+    codes, index = practice_codes(chunk["practice_id"], index)
+    has_practice = codes >= 0
+
+    values = [cohort_schema.encode(chunk[v], v)[has_practice] for v in variables]
+    cell = codes[has_practice] * cells + crosstab.joint_index(values, shape)
+    chunk_counts = np.bincount(cell, minlength=len(index) * cells)
+
+    counts = _grow(counts, len(index))
+    counts += chunk_counts.reshape(len(index), *shape)
+    return counts, index
+
+
+def count_practices(chunks, variables=None):
+    """Counts the cohort by practice and `variables`, a chunk at a time.
+
+    Args:
+        chunks: An iterable of data frames, e.g. from
+            `utilities.iter_cohort_chunks(columns=["practice_id", *variables])`.
+        variables: The variables to count by. Defaults to `PRACTICE_VARIABLES`.
+
+    Returns:
+        Per-practice counts, and the practice IDs of their rows, as for
+        `add_practice_counts`.
+    """
+    counts, index = empty_practice_counts(variables), None
+    for chunk in chunks:
+        counts, index = add_practice_counts(counts, index, chunk, variables)
+    index = pd.Index([], dtype="int64") if index is None else index
+    return counts, index
+
+
+def registered(counts):
+    """Gets the number of patients registered with each practice."""
+    return counts.reshape(len(counts), -1).sum(axis=1)
+
+
+def practice_marginal(counts, variables, by):
+    """Sums per-practice counts over every variable not in `by`.
+
+    Returns:
+        An array with a row per practice and an axis for each variable of
+        `by`, in that order.
+    """
+    return crosstab.marginal(counts, ["practice_id", *variables], ["practice_id", *by])
+
+
+def practice_mask(codes, mask=None):
+    """Marks practices in a boolean array indexed by practice code.
+
+    Args:
+        codes: An array-like of practice codes (see `practice_codes`).
+            Missing codes (-1) are ignored.
+        mask: A mask to add the practices to, in place unless it needs to
+            grow.
+
+    Returns:
+        A boolean array with a row for each practice code up to the largest
+        seen, which is set for each of `codes`.
+
+    Raises:
+        ValueError: If any code is `MAX_PRACTICES` or more, as raw practice
+            IDs might be.
+    """
+    codes = _practice_ids(codes)
+    codes = codes[codes >= 0]
+    if codes.max(initial=-1) >= MAX_PRACTICES:
+        raise ValueError(
+            f"Practice codes must be less than {MAX_PRACTICES}; "
+            "re-index practice IDs with practice_codes first"
+        )
+    mask = np.zeros(0, dtype=bool) if mask is None else mask
+    mask = _grow(mask, int(codes.max(initial=-1)) + 1)
+    mask[codes] = True
+    return mask
+
+
+def relevant_practices(codes, values):
+    """Finds the practices with any non-zero values.
+
+    Args:
+        codes: An array-like of practice codes (see `practice_codes`), with
+            a value for each. Missing codes are ignored.
+        values: An array-like of values. Missing values count as zero.
+
+    Returns:
+        A boolean array indexed by practice code.
+    """
+    values = np.asarray(values)
+    nonzero = values != 0
+    if values.dtype.kind == "f":
+        nonzero &= ~np.isnan(values)
+    # Only the (few) rows with events are looked at.
+    return practice_mask(np.asarray(codes)[nonzero])
+
+
+def in_practices(codes, mask):
+    """Checks which practice codes are set in a mask indexed by practice code.
+
+    Args:
+        codes: An array-like of practice codes.
+        mask: A boolean array indexed by practice code, e.g. from
+            `practice_mask`.
+
+    Returns:
+        A boolean array with a value for each of `codes`, which is False for
+        missing codes, and codes past the end of the mask.
+    """
+    codes = _practice_ids(codes)
+    # Codes past the end of the mask, and -1 (missing), pick the trailing False.
+    codes[codes >= len(mask)] = -1
+    return np.append(mask, False)[codes]
+
+
+def practice_coverage(included, total):
+    """Gets the percentage of practices that are included, to 2 decimal places.
+
+    Args:
+        included: A boolean array indexed by practice code, of the practices
+            included (e.g. those in a measure table).
+        total: A boolean array indexed by practice code, of all practices
+            (e.g. those with registered patients).
+    """
+    return np.round(np.count_nonzero(included) / np.count_nonzero(total) * 100, 2)
@@ -0,0 +1,218 @@
+"""Sparse cross-tabulations of the cohort by MSOA.
+
+England has about 6,800 MSOAs, so a table of MSOA by age group, sex and
+ethnicity has tens of millions of cells, most of them empty. Such tables are
+kept in coordinate (COO) form instead: a row per MSOA, a column per cell of
+the joint tensor of the categorical variables (see `crosstab`), and only the
+cells with any patients stored. Counting, totalling and redaction all work
+on the stored cells, so nothing the size of the dense table is ever
+allocated.
+
+No action publishes MSOA-level tables yet; this is the counting and
+redaction they would need.
+
+A sparse table is a dict:
+    areas: A `pd.Index` of the area (e.g. MSOA) of each row.
+    variables: The categorical variables of the columns.
+    rows, cols: The row and column of each stored cell, sorted by row, then
+        column.
+    data: The count in each stored cell.
+"""
+import numpy as np
+import pandas as pd
+
+import cohort_schema
+import crosstab
+import disclosure
+
+
+def _shape(table):
+    return len(table["areas"]), int(np.prod(crosstab.joint_shape(table["variables"])))
+
+
+def empty_table(variables):
+    """Gets a sparse table of no patients."""
+    return {
+        "areas": pd.Index([], dtype=object),
+        "variables": list(variables),
+        "rows": np.zeros(0, dtype="int64"),
+        "cols": np.zeros(0, dtype="int64"),
+        "data": np.zeros(0, dtype="int64"),
+    }
+
+
+def _from_keys(areas, variables, keys, data, n_cols):
+    """Builds a sparse table from (unsorted, repeated) flat keys, summing repeats."""
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return {
+        "areas": areas,
+        "variables": list(variables),
+        "rows": keys // n_cols,
+        "cols": keys % n_cols,
+        "data": np.bincount(inverse, weights=data, minlength=len(keys)).astype(data.dtype),
+    }
+
+
+def add_chunk(table, chunk, area="msoa"):
+    """Adds a chunk of the cohort to a sparse table.
+
+    Args:
+        table: A sparse table, e.g. from `empty_table`.
+        chunk: A data frame with a column for the area, and for each of the
+            table's variables. Patients without an area aren't counted.
+        area: The column of areas.
+
+    Returns:
+        A new sparse table.
+    """
+    variables = table["variables"]
+    shape = crosstab.joint_shape(variables)
+    n_cols = int(np.prod(shape))
+
+    codes, uniques = pd.factorize(chunk[area])
+    has_area = codes >= 0
+    uniques = pd.Index(np.asarray(uniques, dtype=object))
+    new = uniques.difference(table["areas"]).to_numpy(dtype=object)
+    areas = pd.Index(np.concatenate([table["areas"].to_numpy(dtype=object), new]))
+    rows = areas.get_indexer(uniques)[codes[has_area]]
+    cols = crosstab.joint_index(
+        [cohort_schema.encode(chunk[v], v)[has_area] for v in variables], shape
+    )
+
+    # The chunk's cells are counted, and then added to the stored cells.
+    chunk_keys, chunk_data = np.unique(rows * n_cols + cols, return_counts=True)
+    keys = np.concatenate([table["rows"] * n_cols + table["cols"], chunk_keys])
+    data = np.concatenate([table["data"], chunk_data.astype("int64")])
+    return _from_keys(areas, variables, keys, data, n_cols)
+
+
+def sort_areas(table):
+    """Reorders the rows of a sparse table by area."""
+    order = np.argsort(table["areas"].to_numpy(dtype=str), kind="stable")
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    n_cols = _shape(table)[1]
+    keys = position[table["rows"]] * n_cols + table["cols"]
+    return _from_keys(table["areas"][order], table["variables"], keys, table["data"], n_cols)
+
+
+def count_sparse(chunks, variables, area="msoa"):
+    """Counts the cohort by area and `variables`, keeping only non-empty cells.
+
+    Args:
+        chunks: An iterable of data frames, e.g. from
+            `utilities.iter_cohort_chunks(columns=[area, *variables])`.
+        variables: The categorical variables to count by.
+        area: The column of areas.
+
+    Returns:
+        A sparse table, with its rows sorted by area.
+    """
+    table = empty_table(variables)
+    for chunk in chunks:
+        table = add_chunk(table, chunk, area)
+    return sort_areas(table)
+
+
+def marginal(table, by):
+    """Sums a sparse table over every variable not in `by`.
+
+    Returns:
+        A sparse table with a column per cell of the joint tensor of `by`.
+    """
+    shape = crosstab.joint_shape(table["variables"])
+    unravelled = np.unravel_index(table["cols"], shape)
+    keep = [table["variables"].index(v) for v in by]
+    by_shape = crosstab.joint_shape(by)
+    cols = np.ravel_multi_index([unravelled[i] for i in keep], by_shape)
+    n_cols = int(np.prod(by_shape))
+    return _from_keys(
+        table["areas"], by, table["rows"] * n_cols + cols, table["data"], n_cols
+    )
+
+
+def indptr(table):
+    """Gets where each row's cells start in the stored cells (as in CSR form)."""
+    return np.searchsorted(table["rows"], np.arange(len(table["areas"]) + 1))
+
+
+def row_totals(table):
+    """Sums the stored cells of each row."""
+    return np.bincount(table["rows"], weights=table["data"], minlength=len(table["areas"]))
+
+
+def to_dense(table):
+    """Converts a sparse table to a dense (areas, cells) array, e.g. for testing."""
+    dense = np.zeros(_shape(table), dtype=table["data"].dtype)
+    dense[table["rows"], table["cols"]] = table["data"]
+    return dense
+
+
+def to_frame(table, value="N"):
+    """Converts a sparse table to a count table of its stored cells.
+
+    Returns:
+        A data frame with a column for the areas, a categorical column for
+        each variable (with missing values as NaN), and the counts in
+        `value`.
+    """
+    shape = crosstab.joint_shape(table["variables"])
+    cells = np.unravel_index(table["cols"], shape)
+    frame = {"area": table["areas"][table["rows"]]}
+    for cell, size, variable in zip(cells, shape, table["variables"]):
+        # The last cell of each axis (missing) is code -1.
+        frame[variable] = cohort_schema.decode(np.where(cell == size - 1, -1, cell), variable)
+    frame[value] = table["data"]
+    return pd.DataFrame(frame)
+
+
+def redact(table, threshold=5, k=5):
+    """Redacts, rounds and totals a sparse table, row by row.
+
+    This is `disclosure.redact_table` along each row (area), but on the
+    stored cells only. Empty cells are counts of zero, which are suppressed
+    along with the other small counts of a row, so a row's empty cells are
+    redacted wherever it has any small counts.
+
+    Args:
+        table: A sparse table.
+        threshold: The largest count to suppress.
+        k: The multiple to round to.
+
+    Returns:
+        A tuple of:
+            A sparse table of the redacted counts, rounded, with NaN for
+                redacted cells, and `zeros_redacted`: a boolean for each row
+                of whether its empty cells are redacted too.
+            The redacted totals of each row.
+            The percentage of its row's total in each stored cell.
+    """
+    rows, values = table["rows"], table["data"].astype(float)
+    n_rows = len(table["areas"])
+
+    # Every stored count is non-zero, so small counts are all suppressed, and
+    # so are the empty cells of their rows.
+    small = values <= threshold
+    suppressed = np.bincount(rows, weights=np.where(small, values, 0), minlength=n_rows)
+    zeros_redacted = suppressed > 0
+    needs_more = (suppressed > 0) & (suppressed <= threshold)
+
+    # The smallest unsuppressed cells of those rows are suppressed too, while
+    # the running suppressed total is still <= threshold.
+    candidates = np.flatnonzero(~small & needs_more[rows])
+    order = candidates[np.lexsort((table["cols"][candidates], values[candidates], rows[candidates]))]
+    ordered = values[order]
+    cumulative = np.cumsum(ordered)
+    starts = np.searchsorted(rows[order], rows[order], side="left")
+    before = cumulative - ordered - np.where(starts > 0, cumulative[starts - 1], 0)
+    running = suppressed[rows[order]] + before
+    mask = small.copy()
+    mask[order[running <= threshold]] = True
+
+    cells = disclosure.round_to_nearest(np.where(mask, np.nan, values), k)
+    totals = disclosure.round_to_nearest(
+        disclosure.suppress_small_numbers(row_totals(table), threshold), k
+    )
+    redacted = {**table, "data": cells, "zeros_redacted": zeros_redacted}
+    return redacted, totals, disclosure.percentages(cells, totals[rows])
+
@@ -0,0 +1,98 @@
+"""Splits the combined extract into the main and deaths cohorts.
+
+study_definition_combined.py extracts both cohorts in one pass over the
+registrations. This reads that extract once, in chunks, and writes each
+cohort as if it had been extracted on its own:
+
+    output/4_2023/cohorts/input.csv.gz         (as study_definition.py)
+    output/4_2023/cohorts/input_deaths.csv.gz  (as study_definition_deaths.py)
+"""
+import gzip
+from contextlib import ExitStack
+
+import pandas as pd
+
+import definitions
+from deaths import DEATHS_FILE
+from instrumentation import action, stage
+from utilities import CHUNKSIZE, COHORT_DIR, COHORT_FILE
+
+COMBINED_FILE = COHORT_DIR / "input_combined.csv.gz"
+
+# Columns of the combined extract that are renamed in a cohort.
+RENAMES = {"study_definition_deaths": {"region_at_death": "region"}}
+
+
+def cohort_columns(module):
+    """Gets the columns of a cohort extracted with a study definition."""
+    return ["patient_id", *definitions.variable_expectations(module)]
+
+
+def split_chunk(chunk):
+    """Splits a chunk of the combined extract into the rows of each cohort.
+
+    Args:
+        chunk: A data frame of the combined extract, read as text.
+
+    Returns:
+        A dict mapping each study definition to its rows and columns.
+    """
+    in_cohort = {
+        "study_definition": chunk["registered"] == "1",
+        "study_definition_deaths": (chunk["registered_at_death"] == "1")
+        & (chunk["died_date"] != ""),
+    }
+    cohorts = {}
+    for module, rows in in_cohort.items():
+        renames = RENAMES.get(module, {})
+        columns = cohort_columns(module)
+        source = [{v: k for k, v in renames.items()}.get(c, c) for c in columns]
+        cohorts[module] = chunk.loc[rows, source].set_axis(columns, axis=1)
+    return cohorts
+
+
+def split_cohort(path=None, outputs=None, chunksize=CHUNKSIZE):
+    """Splits the combined extract into the main and deaths cohort files.
+
+    Values are copied as text, exactly as they were extracted.
+
+    Args:
+        path: The combined extract. Defaults to `COMBINED_FILE`.
+        outputs: A dict mapping each study definition to the file to write its
+            cohort to. Defaults to `COHORT_FILE` and `DEATHS_FILE`.
+        chunksize: The maximum number of rows per chunk.
+
+    Returns:
+        A dict mapping each study definition to the number of rows written.
+    """
+    path = COMBINED_FILE if path is None else path
+    if outputs is None:
+        outputs = {"study_definition": COHORT_FILE, "study_definition_deaths": DEATHS_FILE}
+
+    n_rows = dict.fromkeys(outputs, 0)
+    with ExitStack() as stack:
+        files = {
+            module: stack.enter_context(
+                gzip.open(output, "wt", newline="")
+                if str(output).endswith(".gz")
+                else open(output, "w", newline="")
+            )
+            for module, output in outputs.items()
+        }
+        chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+        for i, chunk in enumerate(chunks):
+            for module, cohort in split_chunk(chunk).items():
+                cohort.to_csv(files[module], header=i == 0, index=False)
+                n_rows[module] += len(cohort)
+    return n_rows
+
+
+@action("split_cohort")
+def main():
+    with stage("split_cohort") as record:
+        n_rows = split_cohort()
+        record["rows_out"] = sum(n_rows.values())
+
+
+if __name__ == "__main__":
+    main()
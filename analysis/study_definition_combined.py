@@ -0,0 +1,59 @@
+# LIBRARIES
+
+# cohort extractor
+from cohortextractor import StudyDefinition, patients
+from common_variables import death_variables, demographic_variables, registration_variables
+from config import index_date
+
+# Extracts the main cohort (study_definition.py) and the deaths cohort
+# (study_definition_deaths.py) together, so the registrations are only
+# evaluated once. analysis/split_cohort.py splits the extract into the two
+# cohorts: patients `registered` at the index date, and patients who died in
+# the deaths study period while registered.
+
+study = StudyDefinition(
+    index_date=index_date,
+    default_expectations={
+        "date": {
+            "earliest": index_date,
+            "latest": "today",
+        },  # date range for simulated dates
+        "rate": "uniform",
+        "incidence": 1,
+    },
+    # This line defines the study population
+    population=patients.satisfying("registered OR registered_at_death"),
+
+    registered=patients.registered_as_of(
+        index_date,
+        return_expectations={"incidence": 0.95},
+    ),
+    **registration_variables,
+    **demographic_variables,
+
+    **death_variables,
+    registered_at_death=patients.registered_as_of(
+        "died_date",
+        return_expectations={"incidence": 0.05},
+    ),
+    region_at_death=patients.registered_practice_as_of(
+        "died_date",
+        returning="nuts1_region_name",
+        return_expectations={
+            "rate": "universal",
+            "category": {
+                "ratios": {
+                    "North East": 0.1,
+                    "North West": 0.1,
+                    "Yorkshire and The Humber": 0.1,
+                    "East Midlands": 0.1,
+                    "West Midlands": 0.1,
+                    "East": 0.1,
+                    "London": 0.2,
+                    "South East": 0.1,
+                    "South West": 0.1,
+                },
+            },
+        },
+    ),
+)
@@ -2,8 +2,8 @@
 
 # cohort extractor
 from cohortextractor import StudyDefinition, patients
-from codelists import *
-from config import *
+from common_variables import death_variables
+from config import index_date, index_date_death
 # set the index date
 # STUDY POPULATION
 
@@ -21,29 +21,7 @@ study = StudyDefinition(
     # This line defines the study population
     population = patients.registered_as_of("died_date"),
 
-    died_date=patients.died_from_any_cause(
-        between=[index_date_death,end_date],
-        returning="date_of_death",
-        date_format="YYYY-MM-DD",
-        return_expectations={
-            "date": {"earliest" : end_date},
-        },
-    ),
-
-    died_any=patients.died_from_any_cause(
-        between=[index_date_death,end_date],
-        returning="binary_flag",
-        return_expectations={
-            "rate" : "exponential_increase",
-            "incidence": 0.4,
-        },
-    ),
-
-    died_cause_ons=patients.died_from_any_cause(
-        between=[index_date_death,end_date],
-        returning="underlying_cause_of_death",
-        return_expectations={"category": {"ratios": {"U071":0.2, "C33":0.2, "I60":0.1, "F01":0.1 , "F02":0.05 , "I22":0.05 ,"C34":0.05, "I23":0.25}},},
-    ),
+    **death_variables,
 
     region=patients.registered_practice_as_of(
         "died_date",
@@ -0,0 +1,505 @@
+"""Writes every summary table of the cohort from a single read of input.csv.gz.
+
+The cohort is streamed once and reduced to a handful of small count tables
+(see `SUMMARY_GROUPINGS`), which are cached for later snapshots to compare
+against when run locally (see `utilities.cached_count_cohort`; the job runner
+doesn't keep an action's outputs between runs). Every published table is then
+built from those counts and the ONS reference data (see `ons.ons_store`):
+
+    output/tables/imd_count.csv
+    output/tables/imd_count_NA.csv
+    output/tables/age_sex_count.csv
+    output/tables/age_count.csv
+    output/tables/ethnic_group.csv
+    output/tables/ethnic_group_NA.csv
+    output/tables/ethnicity_completeness.csv
+    output/tables/tpp_pop_all.csv
+    output/tables/ons_comparison.csv
+    output/tables/tpp_pop_stp.csv
+    output/tables/immortal.csv
+    output/tables/immort_rounded.csv
+"""
+import numpy as np
+import pandas as pd
+
+import cohort_schema
+import crosstab
+from disclosure import round_to_nearest, suppress_small_numbers
+from ethnicity import SOURCE_LABELS
+from imd import imd_categorical
+from instrumentation import action, instrumented, stage
+from ons import denominators, ons_store, ons_table
+from utilities import (
+    AGE_GROUPS,
+    ETHNICITY_16_LABELS,
+    ETHNICITY_LABELS,
+    NUTS1_CODES,
+    SEX_LABELS,
+    TABLES_DIR,
+    cached_count_cohort,
+    percentage_intervals,
+)
+
+# Every table below is a marginal of one of these. The groupings of age group,
+# sex, region, IMD and ethnicity are all marginals of their joint counts, which
+# are counted together (see `utilities.joint_groupings`); single years of age
+# are only needed for the immortal check.
+SUMMARY_GROUPINGS = {
+    "imd_sex": ["imd", "sex"],
+    "age_group_region_sex": ["age_group", "region", "sex"],
+    "age": ["age"],
+    "ethnicity_region": ["ethnicity", "region"],
+    "ethnicity_16_region": ["ethnicity_16", "region"],
+    "ethnicity_sources_region": ["ethnicity_source", "ethnicity_16_source", "region"],
+    "msoa_stp_region": ["msoa", "stp", "region"],
+}
+
+# The axes of the comparison with the ONS population (see
+# `ons_comparison_table`), and the sexes the ONS counts.
+COMPARISON_VARIABLES = ["region", "sex", "age_group"]
+COMPARISON_SEXES = ["M", "F"]
+
+# The decimal places of the published bounds of percentages' intervals.
+INTERVAL_DECIMALS = 1
+
+
+def _group_total(df, by, column="N"):
+    """Sums `column` within each group of `by`, keeping missing groups."""
+    return df.groupby(by, dropna=False)[column].transform("sum")
+
+
+def _round_counts(values, k=5):
+    """Rounds counts to the nearest `k`, keeping them as (nullable) integers."""
+    return round_to_nearest(values, k).astype("Int64")
+
+
+def _round_and_percent(df, k=5):
+    """Rounds `N` and `Total` to the nearest `k` and recomputes `percentage`."""
+    df["N"] = _round_counts(df["N"], k)
+    df["Total"] = _round_counts(df["Total"], k)
+    df["percentage"] = df["N"] / df["Total"] * 100
+    return df
+
+
+def _intervals(df, by, within):
+    """Gets the bounds of the confidence interval of each TPP percentage.
+
+    The intervals are calculated from the published counts and totals, so
+    must be taken after they are rounded (see `_round_and_percent`): bounds
+    calculated from the unrounded counts would disclose them. ONS counts are
+    of the whole population, so theirs are left missing.
+
+    Args:
+        df: A rounded count table, with `N`, `Total` and the columns of `by`
+            and `within`, and optionally `cohort`.
+        by: The columns of the categories the percentages are of.
+        within: The columns of the groups the percentages are within.
+
+    Returns:
+        A data frame of `lower` and `upper`, with the index of `df`.
+    """
+    tpp = df["cohort"].eq("TPP") if "cohort" in df else slice(None)
+    intervals = percentage_intervals(df.loc[tpp], by, within, total="Total")
+    return (
+        intervals[["lower", "upper"]]
+        .round(INTERVAL_DECIMALS)
+        .reindex(df.index)
+    )
+
+
+@instrumented()
+def imd_table(imd_sex, imd_ons, drop_unknown=False):
+    """Counts by IMD quintile for each sex and in total, alongside ONS.
+
+    Args:
+        imd_sex: Cohort counts by `imd` and `sex`.
+        imd_ons: ONS counts by `imd` and `sex`.
+        drop_unknown: Whether to drop patients with unknown IMD before
+            calculating totals.
+    """
+    by_sex = imd_sex.assign(
+        sex=imd_sex["sex"].map(SEX_LABELS).replace({"Female": "Females", "Male": "Males"})
+    )
+    total = by_sex.groupby("imd", as_index=False)["N"].sum().assign(sex="Total")
+
+    imd = pd.concat(
+        [
+            pd.concat([total, by_sex]).assign(cohort="TPP"),
+            imd_ons,
+        ],
+        ignore_index=True,
+    )[["imd", "N", "sex", "cohort"]]
+
+    if drop_unknown:
+        imd = imd[imd["imd"] != 0].copy()
+
+    imd["Total"] = _group_total(imd, ["sex", "cohort"])
+    imd = _round_and_percent(imd)
+    imd["percentage"] = imd["percentage"].round(4)
+    imd = imd.join(_intervals(imd, ["imd"], ["sex", "cohort"]))
+
+    imd = imd.sort_values(["cohort", "sex", "imd"], ignore_index=True)
+    imd["imd"] = imd_categorical(imd["imd"], unknown="Unknown")
+    return imd
+
+
+@instrumented()
+def age_sex_tpp_table(age_group_region_sex):
+    """Counts by age group, region and sex, with England totals by sex.
+
+    Patients of unknown age (in the "missing" age group) are left out.
+    """
+    age_group = age_group_region_sex["age_group"]
+    tpp = age_group_region_sex[age_group.isin(AGE_GROUPS)].copy()
+    tpp["sex"] = tpp["sex"].map(SEX_LABELS)
+    tpp["age_group"] = pd.Categorical(tpp["age_group"], categories=AGE_GROUPS, ordered=True)
+    tpp["Total"] = _group_total(tpp, ["region", "sex"])
+    tpp = (
+        tpp.groupby(["age_group", "region", "sex"], dropna=False, observed=True)
+        .agg(N=("N", "sum"), Total=("Total", "first"))
+        .reset_index()
+    )
+
+    england = (
+        tpp.groupby(["sex", "age_group"], dropna=False, observed=True)["N"]
+        .sum()
+        .reset_index()
+    )
+    england["Total"] = _group_total(england, "sex")
+    england["region"] = "England"
+
+    tpp = pd.concat([england, tpp], ignore_index=True).assign(cohort="TPP")
+    tpp["age_group"] = tpp["age_group"].astype(str)
+    return tpp[["sex", "age_group", "N", "Total", "region", "cohort"]]
+
+
+@instrumented()
+def age_sex_table(age_sex_tpp, age_ons):
+    """Counts by age group and sex for males and females, alongside ONS."""
+    age_sex = pd.concat([age_sex_tpp, age_ons], ignore_index=True)
+    age_sex = age_sex[age_sex["sex"].isin(["Male", "Female"])].reset_index(drop=True)
+    age_sex = _round_and_percent(age_sex)
+    return age_sex.join(_intervals(age_sex, ["age_group"], ["region", "sex", "cohort"]))
+
+
+@instrumented()
+def age_table(age_sex_tpp, age_ons):
+    """Counts by age group for all sexes, alongside ONS, with cumulative %."""
+    tpp = (
+        age_sex_tpp.groupby(["region", "age_group"], dropna=False)["N"]
+        .sum()
+        .reset_index()
+    )
+    tpp["Total"] = _group_total(tpp, "region")
+    tpp["cohort"] = "TPP"
+
+    age = pd.concat([tpp, age_ons[age_ons["sex"] == "Total"]], ignore_index=True)
+    age["age_group"] = pd.Categorical(age["age_group"], categories=AGE_GROUPS, ordered=True)
+    age = age.sort_values(["age_group"], kind="stable", ignore_index=True)
+
+    cumulative = age.groupby(["region", "cohort"], dropna=False)["N"].cumsum()
+    age["cumPerc"] = (cumulative / age["Total"] * 100).round(1)
+    age["sex"] = "Total"
+    age = _round_and_percent(age)
+    age = age.join(_intervals(age, ["age_group"], ["region", "cohort"]))
+    age["age_group"] = age["age_group"].astype(str)
+    return age[
+        [
+            "region",
+            "age_group",
+            "N",
+            "Total",
+            "cohort",
+            "sex",
+            "percentage",
+            "cumPerc",
+            "lower",
+            "upper",
+        ]
+    ]
+
+
+def _ethnicity_tpp(counts, column, labels, group):
+    eth = counts.assign(Ethnic_Group=counts[column].map(labels))
+    eth = (
+        eth.groupby(["region", "Ethnic_Group"], dropna=False)["N"]
+        .sum()
+        .reset_index()
+    )
+    eth["Total"] = _group_total(eth, "region")
+    eth["cohort"] = "TPP"
+    eth["group"] = group
+    return eth
+
+
+@instrumented()
+def ethnicity_unrounded_table(ethnicity_region, ethnicity_16_region, ethnicity_ons):
+    """Counts by 5 and 16 ethnic groups for each region and England, with ONS."""
+    ethnicity = pd.concat(
+        [
+            _ethnicity_tpp(ethnicity_16_region, "ethnicity_16", ETHNICITY_16_LABELS, "16_2001"),
+            _ethnicity_tpp(ethnicity_region, "ethnicity", ETHNICITY_LABELS, "5_2001"),
+            ethnicity_ons,
+        ],
+        ignore_index=True,
+    )
+
+    england = (
+        ethnicity.groupby(["group", "Ethnic_Group", "cohort"], dropna=False)["N"]
+        .sum()
+        .reset_index()
+    )
+    england["Total"] = _group_total(england, ["group", "cohort"])
+    england["region"] = "England"
+
+    ethnicity = pd.concat([england, ethnicity], ignore_index=True)
+    return ethnicity[["group", "Ethnic_Group", "cohort", "N", "Total", "region"]]
+
+
+@instrumented()
+def ethnicity_table(ethnicity_unrounded, drop_unknown=False):
+    """Rounds the ethnicity counts, optionally excluding unknown ethnicity.
+
+    When `drop_unknown` is set, totals are recalculated over known ethnicities.
+    """
+    ethnicity = ethnicity_unrounded.copy()
+    if drop_unknown:
+        ethnicity = ethnicity.dropna(subset=["Ethnic_Group"])
+        ethnicity["Total"] = _group_total(ethnicity, ["group", "cohort", "region"])
+    ethnicity = ethnicity.reset_index(drop=True)
+    ethnicity = _round_and_percent(ethnicity)
+    return ethnicity.join(
+        _intervals(ethnicity, ["Ethnic_Group"], ["group", "cohort", "region"])
+    )
+
+
+@instrumented()
+def ethnicity_completeness_table(ethnicity_sources_region):
+    """Counts where ethnicity was recorded (primary care, SUS or neither), for
+    5 and 16 groups, in each region and England."""
+    completeness = pd.concat(
+        [
+            ethnicity_sources_region.groupby(["region", column], dropna=False)["N"]
+            .sum()
+            .reset_index()
+            .rename(columns={column: "source"})
+            .assign(group=group)
+            for column, group in [("ethnicity_source", "5_2001"), ("ethnicity_16_source", "16_2001")]
+        ],
+        ignore_index=True,
+    )
+
+    england = completeness.groupby(["group", "source"])["N"].sum().reset_index()
+    england["region"] = "England"
+
+    completeness = pd.concat([england, completeness], ignore_index=True)
+    completeness["Total"] = _group_total(completeness, ["group", "region"])
+    completeness["source"] = completeness["source"].map(SOURCE_LABELS)
+    completeness = _round_and_percent(completeness)
+    completeness = completeness.join(_intervals(completeness, ["source"], ["group", "region"]))
+    return completeness[
+        ["group", "region", "source", "N", "Total", "percentage", "lower", "upper"]
+    ]
+
+
+@instrumented()
+def tpp_coverage_table(counts, nuts1_pop):
+    """TPP population as a percentage of the ONS population per NUTS1 region.
+
+    Args:
+        counts: Cohort counts by `region` (and any other columns).
+        nuts1_pop: The ONS population of each region.
+    """
+    tpp = (
+        counts.dropna(subset=["region"])
+        .groupby("region")["N"]
+        .sum()
+        .rename("tpp_pop_all")
+        .reset_index()
+    )
+    tpp_cov = tpp.merge(nuts1_pop, on="region", how="right")
+    tpp_cov["nuts118cd"] = tpp_cov["region"].map(NUTS1_CODES)
+    tpp_cov["tpp_pop_all"] = _round_counts(tpp_cov["tpp_pop_all"])
+    tpp_cov["Total"] = _round_counts(tpp_cov["Total"])
+    tpp_cov["tpp_cov_all"] = tpp_cov["tpp_pop_all"] * 100 / tpp_cov["Total"]
+    return tpp_cov
+
+
+@instrumented()
+def ons_comparison_table(age_group_region_sex, store=None):
+    """Compares the cohort with the ONS population by region, sex and age group.
+
+    The counts are converted to a tensor of region by sex by age group (see
+    `crosstab.table_tensor`), of the groups the ONS counts (known regions,
+    males and females, and known ages), with England as a further region.
+    Every percentage is then calculated from the tensor's marginals at once
+    (see `crosstab.shares`), as is every ONS population (see
+    `ons.denominators`).
+
+    Args:
+        age_group_region_sex: Cohort counts by `age_group`, `region` and `sex`.
+        store: The ONS store. Defaults to `ons.ons_store()`.
+
+    Returns:
+        A data frame with a row per region (and England), sex and age group,
+        with:
+            N: The cohort count, with counts of 5 or fewer suppressed and the
+                rest rounded to the nearest 5.
+            Total: The cohort count of the region and sex, likewise.
+            percentage: `N` as a percentage of `Total`.
+            lower, upper: The bounds of the confidence interval of
+                `percentage`, calculated from the published `N` and `Total`
+                (see `utilities.percentage_intervals`).
+            N_ons, Total_ons, percentage_ons: Likewise, for the ONS population.
+            difference: `percentage` minus `percentage_ons`, in percentage
+                points.
+            coverage: `N` as a percentage of `N_ons`.
+    """
+    store = ons_store() if store is None else store
+    levels = cohort_schema.cohort_dtypes()
+    regions = list(levels["region"].categories)
+    ages = list(levels["age_group"].categories.get_indexer(AGE_GROUPS))
+    sexes = list(levels["sex"].categories.get_indexer(COMPARISON_SEXES))
+
+    tensor = crosstab.table_tensor(age_group_region_sex, COMPARISON_VARIABLES)
+    tensor = tensor[np.ix_(range(len(regions)), sexes, ages)]
+    tensor = np.concatenate([tensor.sum(axis=0, keepdims=True), tensor])
+
+    keys = pd.MultiIndex.from_product(
+        [["England", *regions], [SEX_LABELS[s] for s in COMPARISON_SEXES], AGE_GROUPS],
+        names=COMPARISON_VARIABLES,
+    ).to_frame(index=False)
+    shape = tensor.shape
+    n_ons = denominators(keys, store).reshape(shape)
+    total_ons = denominators(keys.drop(columns="age_group"), store).reshape(shape)
+
+    n = round_to_nearest(suppress_small_numbers(tensor, 5), 5)
+    total = round_to_nearest(
+        suppress_small_numbers(tensor.sum(axis=2, keepdims=True), 5), 5
+    )
+    comparison = keys.assign(N=n.ravel(), Total=np.broadcast_to(total, shape).ravel())
+    intervals = percentage_intervals(
+        comparison, ["age_group"], ["region", "sex"], total="Total"
+    )
+    comparison = comparison.assign(
+        percentage=crosstab.shares(n, within=(0, 1), totals=total).ravel(),
+        lower=intervals["lower"].round(INTERVAL_DECIMALS),
+        upper=intervals["upper"].round(INTERVAL_DECIMALS),
+        N_ons=n_ons.ravel(),
+        Total_ons=total_ons.ravel(),
+        percentage_ons=crosstab.shares(n_ons, within=(0, 1), totals=total_ons).ravel(),
+    )
+    comparison["difference"] = comparison["percentage"] - comparison["percentage_ons"]
+    comparison["coverage"] = comparison["N"] / comparison["N_ons"] * 100
+    for column in ["N", "Total", "N_ons", "Total_ons"]:
+        comparison[column] = comparison[column].astype("Int64")
+    return comparison
+
+
+@instrumented()
+def tpp_stp_table(msoa_stp_region):
+    """Registered patients per STP, with counts of 5 or fewer suppressed and
+    the rest rounded to the nearest 5."""
+    stp = (
+        msoa_stp_region.dropna(subset=["stp"])
+        .groupby("stp")["N"]
+        .sum()
+        .rename("registered")
+        .reset_index()
+    )
+    stp["registered"] = suppress_small_numbers(stp["registered"], 5)
+    stp["registered"] = _round_counts(stp["registered"])
+    return stp
+
+
+@instrumented()
+def immortal_table(age_counts):
+    """Counts patients whose recorded age is implausibly high.
+
+    Args:
+        age_counts: Cohort counts by single year of `age` (and any other
+            columns).
+    """
+    age = age_counts["age"]
+    agerange = pd.Series("Under110", index=age.index)
+    agerange[age > 110] = "Over110"
+    agerange[age == 120] = "is120"
+    agerange[age > 120] = "Over120"
+    return (
+        age_counts.groupby(agerange.rename("agerange"))["N"]
+        .sum()
+        .rename("n")
+        .reset_index()
+    )
+
+
+@instrumented()
+def immortal_rounded_table(immortal):
+    """Suppresses counts of 5 or fewer and rounds the rest to the nearest 7."""
+    rounded = immortal.copy()
+    rounded["n"] = suppress_small_numbers(rounded["n"], 5)
+    rounded["n"] = _round_counts(rounded["n"], 7)
+    return rounded
+
+
+@action("counts")
+def main():
+    TABLES_DIR.mkdir(parents=True, exist_ok=True)
+
+    with stage("count_cohort") as record:
+        counts = cached_count_cohort(groupings=SUMMARY_GROUPINGS, max_workers=None)
+        record["rows_in"] = int(counts["age"]["N"].sum())
+        record["rows_out"] = sum(len(table) for table in counts.values())
+
+    imd_ons = ons_table("imd")
+    imd_table(counts["imd_sex"], imd_ons).to_csv(
+        TABLES_DIR / "imd_count.csv", index=False
+    )
+    imd_table(counts["imd_sex"], imd_ons, drop_unknown=True).to_csv(
+        TABLES_DIR / "imd_count_NA.csv", index=False
+    )
+
+    age_ons = ons_table("age_group")
+    age_sex_tpp = age_sex_tpp_table(counts["age_group_region_sex"])
+    age_table(age_sex_tpp, age_ons).to_csv(TABLES_DIR / "age_count.csv", index=False)
+    age_sex_table(age_sex_tpp, age_ons).to_csv(
+        TABLES_DIR / "age_sex_count.csv", index=False
+    )
+
+    ethnicity_unrounded = ethnicity_unrounded_table(
+        counts["ethnicity_region"],
+        counts["ethnicity_16_region"],
+        ons_table("ethnicity"),
+    )
+    ethnicity_table(ethnicity_unrounded).to_csv(
+        TABLES_DIR / "ethnic_group.csv", index=False
+    )
+    ethnicity_table(ethnicity_unrounded, drop_unknown=True).to_csv(
+        TABLES_DIR / "ethnic_group_NA.csv", index=False
+    )
+
+    ethnicity_completeness_table(counts["ethnicity_sources_region"]).to_csv(
+        TABLES_DIR / "ethnicity_completeness.csv", index=False
+    )
+
+    tpp_coverage_table(counts["age_group_region_sex"], ons_table("regions")).to_csv(
+        TABLES_DIR / "tpp_pop_all.csv", index=False
+    )
+
+    ons_comparison_table(counts["age_group_region_sex"]).to_csv(
+        TABLES_DIR / "ons_comparison.csv", index=False
+    )
+
+    tpp_stp_table(counts["msoa_stp_region"]).to_csv(
+        TABLES_DIR / "tpp_pop_stp.csv", index=False
+    )
+
+    immortal = immortal_table(counts["age"])
+    immortal.to_csv(TABLES_DIR / "immortal.csv", index=False)
+    immortal_rounded_table(immortal).to_csv(
+        TABLES_DIR / "immort_rounded.csv", index=False
+    )
+
+
+if __name__ == "__main__":
+    main()
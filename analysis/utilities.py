@@ -0,0 +1,1187 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import statistics
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import codelist_registry
+import cohort_schema
+import config
+import crosstab
+import definitions
+import disclosure
+import ethnicity
+import practices
+from imd import imd_categorical, imd_labels
+
+BASE_DIR = Path(__file__).parents[1]
+ANALYSIS_DIR = BASE_DIR / "analysis"
+OUTPUT_DIR = BASE_DIR / "output"
+DATA_DIR = BASE_DIR / "data"
+TABLES_DIR = OUTPUT_DIR / "tables"
+COHORT_DIR = OUTPUT_DIR / "4_2023" / "cohorts"
+COHORT_FILE = COHORT_DIR / "input.csv.gz"
+COHORT_STORE = COHORT_DIR / "input_columnar"
+CACHE_DIR = OUTPUT_DIR / "cache"
+# The study definition the cohort is extracted with, and the scripts that
+# split the cohort from its extract (see project.yaml).
+COHORT_MODULE = "study_definition_combined"
+COHORT_SCRIPTS = ["split_cohort.py"]
+
+# Number of cohort rows parsed at a time by the streaming readers. Peak memory
+# is bounded by one chunk plus the (small) partial tables, not the cohort size.
+CHUNKSIZE = 1_000_000
+# Number of tasks each worker of `parallel_count_cohort` is given, so that
+# workers that finish early can take on more.
+TASKS_PER_WORKER = 4
+
+# Dtypes for the columns written by study_definition.py. Fixing these up front
+# means every chunk is parsed identically, whatever values it happens to hold.
+# Categorical variables (see `cohort_schema`) are read as categoricals of
+# their fixed levels instead; these are the dtypes of their values in count
+# tables.
+COHORT_DTYPES = {
+    "patient_id": "int64",
+    "age": "int64",
+    "age_group": "object",
+    "sex": "object",
+    "region": "object",
+    "imd": "int64",
+    "eth": "float64",
+    "ethnicity_sus": "float64",
+    "eth16": "float64",
+    "ethnicity_sus16": "float64",
+    "ethnicity": "int64",
+    "ethnicity_16": "int64",
+    "ethnicity_source": "int64",
+    "ethnicity_16_source": "int64",
+    "stp": "object",
+    "msoa": "object",
+    "practice_id": "int64",
+}
+
+# Storage types for the typed, columnar copy of the cohort (see
+# `convert_cohort`). Categorical variables are stored as their int8 codes (see
+# `cohort_schema`). Other "category" columns are stored as int16 codes into the
+# categories found in the cohort. Both use -1 for missing values.
+COLUMNAR_DTYPES = {
+    "patient_id": "int64",
+    "age": "int16",
+    "age_group": cohort_schema.CODE_DTYPE,
+    "sex": cohort_schema.CODE_DTYPE,
+    "region": cohort_schema.CODE_DTYPE,
+    "imd": cohort_schema.CODE_DTYPE,
+    "ethnicity": cohort_schema.CODE_DTYPE,
+    "ethnicity_16": cohort_schema.CODE_DTYPE,
+    "ethnicity_source": "uint8",
+    "ethnicity_16_source": "uint8",
+    "stp": "category",
+    "msoa": "category",
+    "practice_id": "int32",
+}
+CATEGORY_CODE_DTYPE = "int16"
+
+# Labels used in the published tables, keyed by the values in the cohort.
+AGE_GROUPS = [
+    "0-4", "5-9", "10-14", "15-19", "20-24", "25-29", "30-34", "35-39", "40-44",
+    "45-49", "50-54", "55-59", "60-64", "65-69", "70-74", "75-79", "80-84",
+    "85-89", "90+",
+]
+SEX_LABELS = {"F": "Female", "M": "Male", "I": "I", "U": "Unknown"}
+IMD_LABELS = {0: "Unknown", **dict(enumerate(imd_labels(5), start=1))}
+ETHNICITY_LABELS = {
+    1: "White",
+    2: "Mixed/multiple ethnic groups",
+    3: "Asian",
+    4: "Black",
+    5: "Other",
+}
+ETHNICITY_16_LABELS = {
+    1: "White British",
+    2: "White Irish",
+    3: "Other White",
+    4: "White and Black Caribbean",
+    5: "White and Black African",
+    6: "White and Asian",
+    7: "Other Mixed",
+    8: "Indian",
+    9: "Pakistani",
+    10: "Bangladeshi",
+    11: "Other Asian",
+    12: "Caribbean",
+    13: "African",
+    14: "Other Black",
+    15: "Chinese",
+    16: "Any other ethnic group",
+}
+NUTS1_CODES = {
+    "East": "UKH",
+    "North West": "UKD",
+    "North East": "UKC",
+    "Yorkshire and The Humber": "UKE",
+    "East Midlands": "UKF",
+    "West Midlands": "UKG",
+    "London": "UKI",
+    "South East": "UKJ",
+    "South West": "UKK",
+}
+
+# The confidence level of intervals for percentages, and the number of
+# bootstrap replicates (see `percentage_intervals`).
+CI_LEVEL = 0.95
+BOOTSTRAP_REPLICATES = 2000
+# The most replicated counts held in memory at once while bootstrapping.
+BOOTSTRAP_CELLS = 1 << 24
+
+# Group-by counts accumulated by default when streaming the cohort.
+COUNT_GROUPINGS = {
+    "imd_sex": ["imd", "sex"],
+    "age_group_sex": ["age_group", "sex"],
+    "ethnicity_region": ["ethnicity", "region"],
+    "stp": ["stp"],
+    "msoa": ["msoa"],
+}
+
+
+def match_input_files(file: str) -> bool:
+    """Checks if file name has format outputted by cohort extractor"""
+    pattern = r"^input_practice_count_20\d\d-(0[1-9]|1[012])-(0[1-9]|[12][0-9]|3[01])\.csv"
+    return True if re.match(pattern, file) else False
+
+
+def calculate_imd_group(df, disease_column, rate_column):
+    """Converts IMD quintiles to labelled, ordered groups.
+
+    Args:
+        df: A measure table with an `imd` column of quintiles 1-5, as numbers
+            or as a categorical of the cohort's levels.
+        disease_column: The name of the numerator column.
+        rate_column: The name of the rate column.
+
+    Returns:
+        A measure table with `imd` as an ordered categorical.
+    """
+    # The code of each quintile is the quintile itself (code 0 is unknown).
+    codes = cohort_schema.encode(df["imd"], "imd")
+    df["imd"] = imd_categorical(
+        codes,
+        labels=["Most deprived", "2", "3", "4", "Least deprived"],
+    )
+
+    return df[["imd", disease_column, "population", rate_column, "date"]]
+
+
+def redact_small_numbers(df, n, numerator, denominator, rate_column):
+    """Takes counts df as input and suppresses low numbers.
+
+    Sequentially redacts low numbers from numerator and denominator until
+    count of redacted values >=n. Rates corresponding to redacted values are
+    also redacted. See `disclosure.redact_small_numbers`.
+
+    Args:
+        df: input df
+        n: threshold for low number suppression
+        numerator: numerator column to be checked for low numbers
+        denominator: denominator column to be checked for low numbers
+        rate_column: rate column
+
+    Returns:
+        The input df with low numbers replaced by NaN.
+    """
+    for column in [numerator, denominator]:
+        redacted = disclosure.redact_small_numbers(df[column].to_numpy(), n)
+        # Columns with nothing to redact keep their original dtype.
+        if np.isnan(redacted).any():
+            df[column] = redacted
+
+    df.loc[(df[numerator].isna()) | (df[denominator].isna()), rate_column] = np.nan
+
+    return df
+
+
+def drop_irrelevant_practices(df, practice_col):
+    """Drops irrelevant practices from the given measure table.
+
+    An irrelevant practice has zero events during the study period.
+
+    Args:
+        df: A measure table.
+        practice_col: column name of practice column
+
+    Returns:
+        A copy of the given measure table with irrelevant practices dropped.
+    """
+    # Practices are identified by their codes, so pseudonymised IDs of any
+    # size (or type) only need a mask as long as the number of practices.
+    ids, _ = pd.factorize(df[practice_col])
+    relevant = practices.relevant_practices(ids, df["value"])
+    return df[practices.in_practices(ids, relevant)]
+
+
+def _descriptions(codes, code_df, code_column, term_column):
+    """Looks up the description of each code, with NaN for codes not found."""
+    if isinstance(code_df, (str, Path)):
+        # The codes in a codelist CSV are strings, looked up in its cached
+        # code index.
+        descriptions = codelist_registry.map_codes(
+            code_df, [str(c) for c in codes], code_column, term_column
+        )
+    else:
+        code_df = code_df.drop_duplicates(code_column)
+        lookup = pd.Index(code_df[code_column])
+        # get_indexer returns -1 for codes not in the codelist, which picks the
+        # trailing None.
+        terms = np.append(code_df[term_column].to_numpy(dtype=object), None)
+        descriptions = terms[lookup.get_indexer(pd.Index(codes))]
+    descriptions[pd.isna(descriptions)] = np.nan
+    return descriptions
+
+
+def create_child_table(df, code_df, code_column, term_column, nrows=5):
+    """Gets the top `nrows` codes by number of events.
+
+    The codes are factorized once, their events summed with one bincount, and
+    only the top `nrows` sorted, so this is fast for measure tables of
+    millions of rows and many codes.
+
+    Args:
+        df: A measure table.
+        code_df: A codelist table, or the path to a codelist CSV (relative to
+            the repository root), e.g. "codelists/opensafely-ethnicity.csv".
+        code_column: The name of the code column in the codelist table.
+        term_column: The name of the term column in the codelist table.
+        nrows: The number of rows to return.
+
+    Returns:
+        A table of the top `nrows` codes.
+    """
+    # Categorical event codes are counted by their codes, over observed codes
+    # only, and missing codes aren't counted.
+    codes, uniques = pd.factorize(df["event_code"])
+    # The position of each code in sorted order, for breaking ties.
+    order = np.empty(len(uniques), dtype=np.intp)
+    order[uniques.argsort()] = np.arange(len(uniques))
+    uniques = np.asarray(uniques, dtype=object)
+    # We can't count rows because the measure column contains zeros.
+    events = df["event"]
+    events = (events.fillna(0) if events.hasnans else events).to_numpy()
+    # Missing codes (-1) are summed into a first bin, which is dropped.
+    totals = np.bincount(codes + 1, weights=events, minlength=len(uniques) + 1)[1:]
+    totals = totals.astype(events.dtype)
+
+    # Only the top `nrows` codes are sorted. Ties are broken by code, as when
+    # the events are grouped by code and then sorted, including ties for the
+    # last of the top codes.
+    top = np.arange(len(uniques))
+    if 0 < nrows < len(uniques):
+        smallest = totals[np.argpartition(-totals, nrows - 1)[nrows - 1]]
+        above = np.flatnonzero(totals > smallest)
+        tied = np.flatnonzero(totals == smallest)
+        tied = tied[np.argsort(order[tied])][: nrows - len(above)]
+        top = np.concatenate([above, tied])
+    top = top[np.lexsort((order[top], -totals[top]))][:nrows]
+
+    event_counts = pd.DataFrame(
+        {
+            code_column: uniques[top],
+            "Events": totals[top],
+            "Events (thousands)": totals[top] / 1000,
+            # Gets the human-friendly description of the code for the given
+            # row e.g. "Systolic blood pressure".
+            "Description": _descriptions(uniques[top], code_df, code_column, term_column),
+        }
+    )
+
+    # Cast the code column from str to int, where the codes are numeric (as
+    # SNOMED CT codes are, but CTV3 codes aren't).
+    numeric = pd.to_numeric(event_counts[code_column], errors="coerce")
+    if numeric.notna().all():
+        event_counts[code_column] = numeric.astype(int)
+    return event_counts
+
+
+def get_number_practices(df):
+    """Gets the number of practices in the given measure table.
+
+    Args:
+        df: A measure table.
+    """
+    return len(df.practice.unique())
+
+
+def get_percentage_practices(measure_table):
+    """Gets the percentage of practices in the given measure table.
+
+    Args:
+        measure_table: A measure table.
+    """
+
+    # Marks the practices of all input_practice_count files in one array,
+    # indexed by practice codes shared by every file and the measure table.
+    total, index = practices.practice_mask([]), None
+    for file in OUTPUT_DIR.iterdir():
+        if match_input_files(file.name):
+            df = pd.read_csv(os.path.join(OUTPUT_DIR, file.name), usecols=["practice"])
+            codes, index = practices.practice_codes(df["practice"], index)
+            total = practices.practice_mask(codes, total)
+
+    codes, _ = practices.practice_codes(measure_table["practice"], index)
+    in_study = practices.practice_mask(codes)
+    return practices.practice_coverage(in_study, total)
+
+
+def wilson_intervals(n, total, level=CI_LEVEL):
+    """Gets Wilson score intervals for percentages.
+
+    Args:
+        n: An array of counts.
+        total: An array of the totals the counts are out of.
+        level: The confidence level.
+
+    Returns:
+        A tuple of arrays of the lower and upper bounds, as percentages, with
+        NaN where the total is zero.
+    """
+    n = np.asarray(n, dtype=float)
+    total = np.asarray(total, dtype=float)
+    z = statistics.NormalDist().inv_cdf(0.5 + level / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = n / total
+        centre = (p + z**2 / (2 * total)) / (1 + z**2 / total)
+        half_width = z / (1 + z**2 / total) * np.sqrt(p * (1 - p) / total + z**2 / (4 * total**2))
+    lower = np.where(total > 0, (centre - half_width) * 100, np.nan)
+    upper = np.where(total > 0, (centre + half_width) * 100, np.nan)
+    return lower, upper
+
+
+def bootstrap_intervals(counts, level=CI_LEVEL, replicates=BOOTSTRAP_REPLICATES, seed=0):
+    """Gets bootstrap intervals for the percentages of each row of a table of counts.
+
+    Rather than resampling patients, each row is resampled as a whole, from
+    the multinomial distribution of its counts, so every replicate of every
+    row is drawn at once. Rows are resampled a block at a time, to bound
+    memory.
+
+    Args:
+        counts: A (rows, categories) array of counts, e.g. of age groups
+            (columns) in each region (rows).
+        level: The confidence level.
+        replicates: The number of bootstrap replicates.
+        seed: The seed of the random number generator.
+
+    Returns:
+        A tuple of (rows, categories) arrays of the lower and upper bounds of
+        each category's percentage of its row, with NaN for empty rows.
+    """
+    counts = np.asarray(counts, dtype="int64")
+    totals = counts.sum(axis=1)
+    p = counts / np.maximum(totals, 1)[:, None]
+    quantiles = [0.5 - level / 2, 0.5 + level / 2]
+    rng = np.random.default_rng(seed)
+
+    bounds = np.full((2, *counts.shape), np.nan)
+    block = max(1, BOOTSTRAP_CELLS // max(1, replicates * counts.shape[1]))
+    for start in range(0, len(counts), block):
+        rows = slice(start, start + block)
+        samples = rng.multinomial(
+            totals[rows], p[rows], size=(replicates, len(totals[rows]))
+        )
+        bounds[:, rows] = np.quantile(samples, quantiles, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bounds = np.where(totals[:, None] > 0, bounds / totals[:, None] * 100, np.nan)
+    return bounds[0], bounds[1]
+
+
+def percentage_intervals(
+    table,
+    by,
+    within,
+    method="bootstrap",
+    level=CI_LEVEL,
+    threshold=5,
+    total=None,
+    **kwargs,
+):
+    """Adds confidence intervals to the percentages of a count table.
+
+    Intervals are as disclosive as the counts they're calculated from, so
+    those of published tables must be calculated from the published (rounded
+    and suppressed) counts and totals, with `total` naming the totals. The
+    bounds are suppressed wherever the count or its total is `threshold` or
+    fewer, or missing (as for a suppressed count).
+
+    Args:
+        table: A count table, with the columns of `by` and `N`.
+        by: The columns of the categories the percentages are of, e.g.
+            `["age_group"]`.
+        within: The columns of the groups the percentages are within, e.g.
+            `["region"]`.
+        method: "bootstrap" (see `bootstrap_intervals`) or "wilson" (see
+            `wilson_intervals`).
+        level: The confidence level.
+        threshold: The largest count, or total, whose bounds are suppressed.
+        total: The column of the totals the percentages are of, which is the
+            same for every row of a group. Defaults to the sum of `N` within
+            each group. When bootstrapping, any of the total not in `N` (e.g.
+            suppressed counts) is resampled as a further category.
+        **kwargs: Passed to `bootstrap_intervals`.
+
+    Returns:
+        A copy of `table` with each row's `percentage` of its group, and the
+        `lower` and `upper` bounds of its confidence interval.
+    """
+    table = table.copy()
+    n = table["N"].to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(n)
+    n = np.where(missing, 0, n)
+    groups = table.groupby(list(within), dropna=False, observed=True, sort=False).ngroup().to_numpy()
+    if total is None:
+        totals = np.bincount(groups, weights=n)[groups]
+    else:
+        totals = table[total].to_numpy(dtype=float, na_value=np.nan)
+        missing |= np.isnan(totals)
+        totals = np.where(np.isnan(totals), 0, totals)
+    table["percentage"] = disclosure.percentages(n, totals)
+
+    if method == "wilson":
+        lower, upper = wilson_intervals(n, totals, level)
+    elif method == "bootstrap":
+        categories = table.groupby(list(by), dropna=False, observed=True, sort=False).ngroup().to_numpy()
+        n_groups = groups.max(initial=-1) + 1
+        counts = np.zeros((n_groups, categories.max(initial=-1) + 1), dtype="int64")
+        np.add.at(counts, (groups, categories), n.astype("int64"))
+        if total is not None:
+            group_totals = np.zeros(n_groups, dtype="int64")
+            group_totals[groups] = totals
+            rest = np.maximum(group_totals - counts.sum(axis=1), 0)
+            counts = np.column_stack([counts, rest])
+        lower, upper = bootstrap_intervals(counts, level, **kwargs)
+        lower, upper = lower[groups, categories], upper[groups, categories]
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    suppressed = missing | (n <= threshold) | (totals <= threshold)
+    table["lower"] = np.where(suppressed, np.nan, lower)
+    table["upper"] = np.where(suppressed, np.nan, upper)
+    return table
+
+
+def iter_cohort_chunks(path=None, columns=None, chunksize=CHUNKSIZE):
+    """Reads the cohort in chunks of at most `chunksize` rows.
+
+    Args:
+        path: Path to the cohort file, or to a columnar store written by
+            `convert_cohort`. Defaults to `COHORT_STORE` if it exists, and
+            `COHORT_FILE` otherwise.
+        columns: The columns to read. Defaults to all columns.
+        chunksize: The maximum number of rows per chunk.
+
+    Yields:
+        A data frame for each chunk of the cohort. Categorical variables are
+        categoricals of their fixed levels (see `cohort_schema`).
+    """
+    if path is None:
+        path = COHORT_STORE if COHORT_STORE.exists() else COHORT_FILE
+
+    if Path(path).is_dir():
+        yield from iter_columnar_chunks(path, columns=columns, chunksize=chunksize)
+        return
+
+    # Columns derived after extraction (see `ethnicity.add_ethnicity`) are
+    # read as the columns they're derived from.
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = columns
+    if columns is not None:
+        usecols = sorted(
+            {
+                source
+                for c in columns
+                for source in (
+                    ethnicity.DERIVED_COLUMNS[c]
+                    if c not in header and c in ethnicity.DERIVED_COLUMNS
+                    else [c]
+                )
+            }
+        )
+    categorical = cohort_schema.cohort_dtypes()
+    dtypes = {
+        c: "category" if c in categorical else t
+        for c, t in COHORT_DTYPES.items()
+        if c in header
+    }
+
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        chunk = cohort_schema.categorize(ethnicity.add_ethnicity(chunk))
+        yield chunk if columns is None else chunk[columns]
+
+
+def convert_cohort(path=None, store=None, chunksize=CHUNKSIZE):
+    """Writes a typed, columnar copy of the cohort.
+
+    Each column is written to its own raw binary file in `store`, with the
+    types in `COLUMNAR_DTYPES`, so that it can later be memory-mapped on its
+    own. Column types, row count, categories and a fingerprint of the
+    contents (see `cohort_fingerprint`) are recorded in `schema.json`. The
+    cohort is converted chunk by chunk.
+
+    Args:
+        path: Path to the cohort file. Defaults to `COHORT_FILE`.
+        store: Directory to write to. Defaults to `COHORT_STORE`.
+        chunksize: The maximum number of rows per chunk.
+
+    Returns:
+        The schema of the store.
+    """
+    path = COHORT_FILE if path is None else path
+    chunks = iter_cohort_chunks(path, chunksize=chunksize)
+    return write_columnar(chunks, store, chunksize=chunksize)
+
+
+def write_columnar(chunks, store=None, chunksize=CHUNKSIZE):
+    """Writes a stream of cohort chunks to a columnar store.
+
+    See `convert_cohort`. Only the columns in `COLUMNAR_DTYPES` are written.
+
+    Args:
+        chunks: An iterable of data frames with the cohort's columns.
+        store: Directory to write to. Defaults to `COHORT_STORE`.
+        chunksize: The number of rows to remap at a time when sorting
+            categories.
+
+    Returns:
+        The schema of the store.
+    """
+    store = Path(COHORT_STORE if store is None else store)
+    store.mkdir(parents=True, exist_ok=True)
+
+    fixed = cohort_schema.cohort_dtypes()
+    n_rows = 0
+    columns = None
+    categories = {}
+    files = {}
+    # Each column is hashed as it is written, with the codes of categories in
+    # the order they were first seen, so the hashes don't depend on the chunk
+    # size.
+    digests = {}
+    try:
+        for chunk in chunks:
+            chunk = ethnicity.add_ethnicity(chunk)
+            if columns is None:
+                columns = [c for c in chunk.columns if c in COLUMNAR_DTYPES]
+                for column in columns:
+                    files[column] = open(store / f"{column}.bin", "wb")
+                    digests[column] = hashlib.sha256()
+                    if COLUMNAR_DTYPES[column] == "category":
+                        categories[column] = []
+
+            for column in columns:
+                if column in fixed:
+                    values = cohort_schema.encode(chunk[column], column)
+                elif column in categories:
+                    known = categories[column]
+                    seen = set(known)
+                    new = pd.unique(chunk[column].dropna())
+                    known.extend(v for v in new if v not in seen)
+                    values = pd.Categorical(chunk[column], categories=known).codes
+                    values = values.astype(CATEGORY_CODE_DTYPE)
+                else:
+                    values = chunk[column].to_numpy(dtype=COLUMNAR_DTYPES[column])
+                values = np.ascontiguousarray(values)
+                digests[column].update(values)
+                files[column].write(values)
+
+            n_rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    digest = hashlib.sha256(json.dumps(categories, default=str).encode())
+    for column, column_digest in digests.items():
+        digest.update(column.encode())
+        digest.update(column_digest.digest())
+
+    # Categories were appended in the order they were first seen; sort them,
+    # and remap the stored codes to match, so the store is deterministic.
+    for column, known in categories.items():
+        order = np.argsort(np.array(known, dtype=object), kind="stable")
+        remap = np.empty(len(known) + 1, dtype=CATEGORY_CODE_DTYPE)
+        remap[order] = np.arange(len(known))
+        remap[-1] = -1
+        if n_rows:
+            codes = np.memmap(
+                store / f"{column}.bin", dtype=CATEGORY_CODE_DTYPE, mode="r+"
+            )
+            for start in range(0, n_rows, chunksize):
+                codes[start : start + chunksize] = remap[codes[start : start + chunksize]]
+            codes.flush()
+            del codes
+        categories[column] = [known[i] for i in order]
+
+    schema = {
+        "n_rows": n_rows,
+        "fingerprint": digest.hexdigest(),
+        "columns": {
+            column: {
+                "dtype": COLUMNAR_DTYPES[column],
+                **({"categories": categories[column]} if column in categories else {}),
+                **(
+                    {
+                        "categories": fixed[column].categories.tolist(),
+                        "ordered": fixed[column].ordered,
+                    }
+                    if column in fixed
+                    else {}
+                ),
+            }
+            for column in columns or []
+        },
+    }
+    with open(store / "schema.json", "w") as f:
+        json.dump(schema, f, indent=2)
+    return schema
+
+
+def read_columnar_schema(store=None):
+    """Reads the schema of a columnar store written by `convert_cohort`."""
+    store = Path(COHORT_STORE if store is None else store)
+    with open(store / "schema.json") as f:
+        return json.load(f)
+
+
+def load_columns(store=None, columns=None):
+    """Memory-maps columns of a columnar store written by `convert_cohort`.
+
+    Only the requested columns are opened, and nothing is read from disk until
+    the returned arrays are used.
+
+    Args:
+        store: Directory of the store. Defaults to `COHORT_STORE`.
+        columns: The columns to load. Defaults to all columns.
+
+    Returns:
+        A dict mapping each column name to a read-only array. Columns with
+        categories are returned as `pd.Categorical` over memory-mapped codes.
+    """
+    store = Path(COHORT_STORE if store is None else store)
+    schema = read_columnar_schema(store)
+    columns = list(schema["columns"]) if columns is None else columns
+
+    arrays = {}
+    for column in columns:
+        spec = schema["columns"][column]
+        dtype = CATEGORY_CODE_DTYPE if spec["dtype"] == "category" else spec["dtype"]
+        if schema["n_rows"]:
+            values = np.memmap(store / f"{column}.bin", dtype=dtype, mode="r")
+        else:
+            values = np.empty(0, dtype=dtype)
+        if "categories" in spec:
+            values = pd.Categorical.from_codes(
+                values, categories=spec["categories"], ordered=spec.get("ordered", False)
+            )
+        arrays[column] = values
+    return arrays
+
+
+def read_columnar(store=None, columns=None):
+    """Reads columns of a columnar store written by `convert_cohort`.
+
+    Args:
+        store: Directory of the store. Defaults to `COHORT_STORE`.
+        columns: The columns to read. Defaults to all columns.
+
+    Returns:
+        A data frame with one column per requested column.
+    """
+    return pd.DataFrame(load_columns(store, columns))
+
+
+def iter_columnar_chunks(store=None, columns=None, chunksize=CHUNKSIZE):
+    """Reads a columnar store written by `convert_cohort` in chunks.
+
+    Args:
+        store: Directory of the store. Defaults to `COHORT_STORE`.
+        columns: The columns to read. Defaults to all columns.
+        chunksize: The maximum number of rows per chunk.
+
+    Yields:
+        A data frame for each chunk of the cohort.
+    """
+    arrays = load_columns(store, columns)
+    n_rows = read_columnar_schema(store)["n_rows"]
+    for start in range(0, n_rows, chunksize):
+        yield pd.DataFrame(
+            {column: values[start : start + chunksize] for column, values in arrays.items()},
+            index=pd.RangeIndex(start, min(start + chunksize, n_rows)),
+        )
+
+
+def count_chunk(chunk, by):
+    """Counts the rows of a single chunk in each group.
+
+    Missing values are kept as their own group, as with R's `group_by`.
+    Categorical variables are grouped as categoricals of their fixed levels
+    (see `cohort_schema`), i.e. by their codes, whatever the chunk holds.
+
+    Args:
+        chunk: A data frame.
+        by: The columns to group by.
+
+    Returns:
+        A series of counts indexed by the groups present in the chunk.
+    """
+    keys = cohort_schema.categorize(chunk[list(by)])
+    return keys.groupby(list(by), dropna=False, observed=True, sort=False).size()
+
+
+def add_counts(total, partial):
+    """Adds a partial count series to a running total, which may be None."""
+    if total is None:
+        return partial
+    combined = pd.concat([total, partial])
+    return combined.groupby(
+        level=list(range(combined.index.nlevels)), dropna=False, observed=True
+    ).sum()
+
+
+def merge_counts(partials, by):
+    """Merges partial counts into a single count table.
+
+    Args:
+        partials: An iterable of series returned by `count_chunk`.
+        by: The columns the partials were grouped by.
+
+    Returns:
+        A data frame with one row per group, sorted by group, and the number
+        of rows in that group in column `N`.
+    """
+    total = None
+    for partial in partials:
+        total = add_counts(total, partial)
+
+    if total is None:
+        return pd.DataFrame(columns=[*by, "N"])
+    table = total.astype("int64").rename("N").reset_index()
+
+    # Give the groups the same types whether the chunks came from the CSV or
+    # from the columnar store.
+    for column in by:
+        if column in COHORT_DTYPES:
+            table[column] = table[column].astype(COHORT_DTYPES[column])
+    return table.sort_values(list(by), ignore_index=True)
+
+
+def joint_groupings(groupings):
+    """Finds the groupings that can be counted as marginals of joint tensors.
+
+    These are the groupings of categorical variables only (see
+    `cohort_schema`). Each is added to the first tensor whose variables, with
+    its own, span no more than `crosstab.MAX_CELLS` cells, or else starts a
+    new tensor; so, for example, the groupings by 6 and 16 ethnic groups are
+    counted into separate tensors.
+
+    Returns:
+        A list of tensors, each a tuple of the names of its groupings, and the
+        variables of its axes.
+    """
+    categorical = cohort_schema.cohort_dtypes()
+    tensors = []
+    for name, by in groupings.items():
+        if not set(by) <= set(categorical):
+            continue
+        for names, variables in tensors:
+            union = [v for v in categorical if v in variables or v in by]
+            if np.prod(crosstab.joint_shape(union)) <= crosstab.MAX_CELLS:
+                names.append(name)
+                variables[:] = union
+                break
+        else:
+            variables = [v for v in categorical if v in by]
+            if np.prod(crosstab.joint_shape(variables)) <= crosstab.MAX_CELLS:
+                tensors.append(([name], variables))
+    return tensors
+
+
+def _stream_totals(chunks, groupings):
+    tensors = joint_groupings(groupings)
+    joint = {name for names, _ in tensors for name in names}
+    totals = dict.fromkeys(groupings)
+    counted = [None] * len(tensors)
+    for chunk in chunks:
+        for i, (_, variables) in enumerate(tensors):
+            counts = crosstab.count_joint(chunk, variables)
+            counted[i] = counts if counted[i] is None else counted[i] + counts
+        for name, by in groupings.items():
+            if name not in joint:
+                totals[name] = add_counts(totals[name], count_chunk(chunk, by))
+
+    for (names, variables), tensor in zip(tensors, counted):
+        if tensor is None:
+            continue
+        for name in names:
+            by = groupings[name]
+            totals[name] = crosstab.tensor_counts(crosstab.marginal(tensor, variables, by), by)
+    return totals
+
+
+def stream_counts(chunks, groupings=None):
+    """Accumulates group-by counts over a stream of cohort chunks.
+
+    Only one chunk is held in memory at a time; each is reduced to a small
+    partial count table per grouping before the next is read. Groupings of
+    categorical variables only are all counted at once, into one joint
+    tensor (see `crosstab`), and taken as its marginals at the end.
+
+    Args:
+        chunks: An iterable of data frames, e.g. from `iter_cohort_chunks`.
+        groupings: A dict mapping a table name to the columns to group by.
+            Defaults to `COUNT_GROUPINGS`.
+
+    Returns:
+        A dict mapping each table name to a count table (see `merge_counts`).
+    """
+    groupings = COUNT_GROUPINGS if groupings is None else groupings
+    totals = _stream_totals(chunks, groupings)
+    return {
+        name: merge_counts([] if totals[name] is None else [totals[name]], by)
+        for name, by in groupings.items()
+    }
+
+
+def partition_order(store, partition_by):
+    """Gets the rows of a columnar store, stably sorted by a column.
+
+    Categorical columns are sorted by their codes, with missing values first.
+    """
+    values = load_columns(store, [partition_by])[partition_by]
+    if isinstance(values, pd.Categorical):
+        values = values.codes
+    return np.argsort(values, kind="stable")
+
+
+def partition_ranges(n_rows, n_tasks):
+    """Splits `n_rows` rows into at most `n_tasks` contiguous ranges of (nearly) equal size.
+
+    Returns:
+        A list of (start, stop) tuples, without empty ranges.
+    """
+    bounds = np.linspace(0, n_rows, max(n_tasks, 1) + 1).astype("int64")
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _iter_range_chunks(store, columns, rows, chunksize, order=None):
+    arrays = load_columns(store, columns)
+    if order is not None:
+        order = np.load(order, mmap_mode="r")
+    start, stop = rows
+    for chunk_start in range(start, stop, chunksize):
+        chunk_stop = min(chunk_start + chunksize, stop)
+        if order is None:
+            selected = slice(chunk_start, chunk_stop)
+            index = pd.RangeIndex(chunk_start, chunk_stop)
+        else:
+            # Sorted, so the memory-mapped columns are read in order.
+            selected = index = np.sort(order[chunk_start:chunk_stop])
+        yield pd.DataFrame(
+            {column: arrays[column][selected] for column in columns}, index=index
+        )
+
+
+def _count_range(rows, store, groupings, chunksize, order):
+    columns = sorted({c for by in groupings.values() for c in by})
+    chunks = _iter_range_chunks(store, columns, rows, chunksize, order)
+    return _stream_totals(chunks, groupings)
+
+
+def parallel_count_cohort(
+    store=None, groupings=None, partition_by=None, max_workers=None, chunksize=CHUNKSIZE
+):
+    """Counts a columnar store by each grouping, in parallel processes.
+
+    The rows of the store are split into `TASKS_PER_WORKER` tasks per worker,
+    of equal size, and each task is counted by a worker, which memory-maps
+    the store itself, and reads only its own rows. Because counts add up
+    exactly, the merged tables are identical to those from `count_cohort`,
+    whatever the partitioning or the number of workers.
+
+    Args:
+        store: Directory of the store. Defaults to `COHORT_STORE`.
+        groupings: A dict mapping a table name to the columns to group by.
+            Defaults to `COUNT_GROUPINGS`.
+        partition_by: A column (e.g. region, stp or msoa) to sort the rows by
+            before they are split, so that each task sees few of its values,
+            and its partial tables of groupings by that column stay small. The
+            rows are sorted once, here. Defaults to splitting the rows in the
+            order they are stored.
+        max_workers: The number of processes. Defaults to the number of CPUs.
+        chunksize: The maximum number of rows per chunk within a task.
+
+    Returns:
+        A dict mapping each table name to a count table (see `merge_counts`).
+    """
+    store = COHORT_STORE if store is None else store
+    groupings = COUNT_GROUPINGS if groupings is None else groupings
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    n_rows = read_columnar_schema(store)["n_rows"]
+    ranges = partition_ranges(n_rows, max_workers * TASKS_PER_WORKER)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        order = None
+        if partition_by is not None:
+            # Workers memory-map the order, rather than each being sent a copy.
+            order = Path(tmp) / "order.npy"
+            np.save(order, partition_order(store, partition_by))
+        count = functools.partial(
+            _count_range,
+            store=store,
+            groupings=groupings,
+            chunksize=chunksize,
+            order=order,
+        )
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map() returns results in task order, so merging is deterministic.
+            partitions = list(executor.map(count, ranges))
+
+    return {
+        name: merge_counts(
+            [totals[name] for totals in partitions if totals[name] is not None], by
+        )
+        for name, by in groupings.items()
+    }
+
+
+def count_cohort(path=None, groupings=None, chunksize=CHUNKSIZE, max_workers=1):
+    """Counts the cohort by each grouping without loading it all into memory.
+
+    Args:
+        path: Path to the cohort file, or to a columnar store. Defaults as for
+            `iter_cohort_chunks`.
+        groupings: A dict mapping a table name to the columns to group by.
+            Defaults to `COUNT_GROUPINGS`.
+        chunksize: The maximum number of rows per chunk.
+        max_workers: The number of processes to count a columnar store with
+            (see `parallel_count_cohort`); None for one per CPU. Cohort files
+            are always counted in this process.
+
+    Returns:
+        A dict mapping each table name to a count table (see `merge_counts`).
+    """
+    groupings = COUNT_GROUPINGS if groupings is None else groupings
+    if path is None:
+        path = COHORT_STORE if COHORT_STORE.exists() else COHORT_FILE
+
+    if Path(path).is_dir() and max_workers != 1:
+        return parallel_count_cohort(
+            path, groupings, max_workers=max_workers, chunksize=chunksize
+        )
+
+    columns = sorted({c for by in groupings.values() for c in by})
+    chunks = iter_cohort_chunks(path, columns=columns, chunksize=chunksize)
+    return stream_counts(chunks, groupings)
+
+
+def cohort_fingerprint(path=None):
+    """Gets a hash of the contents of a cohort file or columnar store.
+
+    A columnar store's contents are hashed as it is written (see
+    `write_columnar`), and the hash recorded in its schema, so only the schema
+    is read. The hash doesn't depend on where the store is, or when it was
+    written, so it is the same in every action that's given the store. For a
+    store without a recorded hash, every file is hashed, as is a cohort file.
+
+    Args:
+        path: Path to the cohort file, or to a columnar store. Defaults as for
+            `iter_cohort_chunks`.
+
+    Returns:
+        A hex digest.
+    """
+    if path is None:
+        path = COHORT_STORE if COHORT_STORE.exists() else COHORT_FILE
+    path = Path(path)
+    if path.is_dir():
+        fingerprint = read_columnar_schema(path).get("fingerprint")
+        if fingerprint is not None:
+            return fingerprint
+    files = sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(file.name.encode())
+        with open(file, "rb") as f:
+            for block in iter(functools.partial(f.read, 1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def aggregate_key(by, index_date=None, module=COHORT_MODULE, cohort=None):
+    """Gets the content address of a count table.
+
+    The address covers everything the table is defined by: the index date,
+    the cohort it was counted from, the definitions of the grouping variables
+    (and of any variables they are derived from, and of the population), the
+    hashes of the codelists those definitions use, and the code that splits
+    the cohort from the combined extract and derives columns from it. It
+    changes if, and only if, one of these does.
+
+    Args:
+        by: The columns the table is grouped by.
+        index_date: The index date of the cohort. Defaults to
+            `config.index_date`.
+        module: The study definition the cohort was extracted with.
+        cohort: The `cohort_fingerprint` of the cohort, if known.
+
+    Returns:
+        A hex digest.
+    """
+    index_date = config.index_date if index_date is None else index_date
+    variables = definitions.variable_nodes(module)
+
+    # Columns derived after extraction are defined by the variables they're
+    # derived from, and by the code that derives them.
+    derived = sorted(c for c in by if c in ethnicity.DERIVED_COLUMNS and c not in variables)
+    derived_from = {s for c in derived for s in ethnicity.DERIVED_COLUMNS[c]}
+    names = {"population", *(c for c in [*by, *derived_from] if c in variables)}
+    codelists = set()
+    for name in list(names):
+        used_variables, used_codelists = definitions.dependencies(variables, name)
+        names.update(used_variables)
+        codelists.update(used_codelists)
+
+    files = definitions.codelist_files()
+    sources = definitions.variable_sources(module)
+    payload = {
+        "index_date": index_date,
+        "cohort": cohort,
+        "scripts": {
+            name: hashlib.sha1((ANALYSIS_DIR / name).read_bytes()).hexdigest()
+            for name in COHORT_SCRIPTS
+        },
+        "by": list(by),
+        "variables": {name: sources[name] for name in sorted(names)},
+        "derived": {
+            name: hashlib.sha1(Path(ethnicity.__file__).read_bytes()).hexdigest()
+            for name in derived
+        },
+        "codelists": {
+            name: definitions.codelist_hash(files[name]) for name in sorted(codelists)
+        },
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _read_cached_counts(path, by):
+    dtypes = {c: COHORT_DTYPES[c] for c in by if c in COHORT_DTYPES}
+    return pd.read_csv(path, dtype={**dtypes, "N": "int64"})
+
+
+def cached_count_cohort(
+    path=None,
+    groupings=None,
+    index_date=None,
+    cache_dir=None,
+    chunksize=CHUNKSIZE,
+    max_workers=1,
+):
+    """Counts the cohort by each grouping, reusing counts cached by earlier runs.
+
+    Each count table is cached under its `aggregate_key`. Tables whose key is
+    already cached are read from the cache; the rest are counted together, in
+    a single pass over the cohort, and added to the cache. The keys used for
+    each index date are recorded in the cache's index.json, so that the
+    tables of earlier snapshots can be found by `load_snapshot_counts`.
+
+    The keys cover the cohort's contents (see `cohort_fingerprint`), so a
+    re-extracted cohort is counted again, even for the same index date.
+
+    The cache is an output of the `counts` action (output/cache/*), so on the
+    backend it is shared with the actions that need `counts`: e.g.
+    calculate_tpp_coverage reads its table from the cache rather than
+    counting the cohort again. The job runner doesn't give an action its own
+    earlier outputs, though, so `counts` itself counts every table afresh on
+    the backend. Earlier snapshots are only reused where the scripts are run
+    repeatedly against the same output/ directory, e.g. when developing
+    locally, or benchmarking.
+
+    Args:
+        path: Path to the cohort file or columnar store.
+        groupings: A dict mapping a table name to the columns to group by.
+            Defaults to `COUNT_GROUPINGS`.
+        index_date: The index date of the cohort. Defaults to
+            `config.index_date`.
+        cache_dir: The cache directory. Defaults to `CACHE_DIR`.
+        chunksize: The maximum number of rows per chunk.
+        max_workers: The number of processes to count with (see
+            `count_cohort`).
+
+    Returns:
+        A dict mapping each table name to a count table (see `merge_counts`).
+    """
+    groupings = COUNT_GROUPINGS if groupings is None else groupings
+    index_date = config.index_date if index_date is None else index_date
+    cache_dir = Path(CACHE_DIR if cache_dir is None else cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if path is None:
+        path = COHORT_STORE if COHORT_STORE.exists() else COHORT_FILE
+
+    cohort = cohort_fingerprint(path)
+    keys = {
+        name: aggregate_key(by, index_date, cohort=cohort) for name, by in groupings.items()
+    }
+    missing = {
+        name: by
+        for name, by in groupings.items()
+        if not (cache_dir / f"{keys[name]}.csv").exists()
+    }
+
+    counts = {}
+    if missing:
+        counts = count_cohort(
+            path, missing, chunksize=chunksize, max_workers=max_workers
+        )
+    for name, table in counts.items():
+        table.to_csv(cache_dir / f"{keys[name]}.csv", index=False)
+
+    index_path = cache_dir / "index.json"
+    index = json.loads(index_path.read_text()) if index_path.exists() else {}
+    index.setdefault(index_date, {}).update(keys)
+    index_path.write_text(json.dumps(index, indent=2, sort_keys=True))
+
+    return {
+        name: counts[name]
+        if name in counts
+        else _read_cached_counts(cache_dir / f"{keys[name]}.csv", by)
+        for name, by in groupings.items()
+    }
+
+
+def load_snapshot_counts(name, groupings=None, cache_dir=None):
+    """Loads a count table for every snapshot in the cache.
+
+    Args:
+        name: The name of the table, as passed to `cached_count_cohort`.
+        groupings: A dict mapping a table name to the columns to group by.
+            Defaults to `COUNT_GROUPINGS`.
+        cache_dir: The cache directory. Defaults to `CACHE_DIR`.
+
+    Returns:
+        The count tables of every cached snapshot, one after another, with the
+        snapshot's index date in column `index_date`.
+    """
+    groupings = COUNT_GROUPINGS if groupings is None else groupings
+    cache_dir = Path(CACHE_DIR if cache_dir is None else cache_dir)
+    index = json.loads((cache_dir / "index.json").read_text())
+
+    tables = [
+        _read_cached_counts(cache_dir / f"{keys[name]}.csv", groupings[name]).assign(
+            index_date=index_date
+        )
+        for index_date, keys in sorted(index.items())
+        if name in keys
+    ]
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Scripts in analysis/ are run directly by the job runner and import each other
+# as top-level modules (e.g. `from utilities import ...`).
+sys.path.insert(0, str(Path(__file__).parents[1] / "analysis"))
@@ -0,0 +1,69 @@
+import pytest
+from analysis import benchmark
+from analysis.dummy_data import write_dummy_cohort
+
+STAGES = [
+    "load",
+    "count",
+    "imd_grouping",
+    "age_sex",
+    "ethnicity",
+    "redaction",
+    "ons_comparison",
+    "region_coverage",
+    "immortal_check",
+]
+
+
+def test_run_stages_measures_every_stage(tmp_path):
+    store = tmp_path / "cohort"
+    write_dummy_cohort(store, 1000, seed=0)
+
+    results = benchmark.run_stages(store)
+
+    assert list(results) == STAGES
+    assert all(r["seconds"] >= 0 and r["peak_mb"] >= 0 for r in results.values())
+
+
+def test_compare_finds_regressions():
+    baseline = {
+        "1000": {
+            "count": {"seconds": 1.0, "peak_mb": 100},
+            "load": {"seconds": 0.01, "peak_mb": 0.1},
+        }
+    }
+    results = {
+        "environment": {},
+        "1000": {
+            "count": {"seconds": 1.5, "peak_mb": 110},
+            # Ten times slower, but too fast to measure reliably.
+            "load": {"seconds": 0.001, "peak_mb": 0.5},
+            "new_stage": {"seconds": 9.0, "peak_mb": 9.0},
+        },
+        "2000": {"count": {"seconds": 9.0, "peak_mb": 9.0}},
+    }
+
+    assert benchmark.compare(results, baseline, tolerance=0.25) == [
+        ("1000", "count", "seconds", 1.0, 1.5)
+    ]
+
+
+def test_measure_imports_of_study_definitions():
+    results = benchmark.measure_imports(repeats=1)
+
+    assert list(results) == benchmark.IMPORT_MODULES
+    for measured in results.values():
+        assert measured["seconds"] >= 0
+        assert measured["peak_mb"] >= 0
+
+
+def test_measure_imports_fails_for_modules_that_cant_be_imported():
+    with pytest.raises(RuntimeError, match="no_such_module"):
+        benchmark.measure_imports(["no_such_module"], repeats=1)
+
+
+def test_compare_skips_imports_measured_differently():
+    baseline = {"imports": {"study_definition": {"seconds": 1.0, "peak_mb": 1, "stubbed": False}}}
+    results = {"imports": {"study_definition": {"seconds": 9.0, "peak_mb": 9, "stubbed": True}}}
+
+    assert benchmark.compare(results, baseline) == []
@@ -0,0 +1,85 @@
+import csv
+
+import numpy as np
+import pytest
+from analysis import codelist_registry
+from unittest.mock import patch
+
+ETHNICITY = "codelists/opensafely-ethnicity.csv"
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(tmp_path):
+    """Gives each test an empty registry, caching to a temporary file."""
+    with patch.object(codelist_registry, "CACHE_PATH", tmp_path / "codelists.pickle"), \
+            patch.object(codelist_registry, "_tables", {}), \
+            patch.object(codelist_registry, "_indexes", {}):
+        yield
+
+
+def test_codelist_rows_match_csv():
+    with open(codelist_registry.BASE_DIR / ETHNICITY) as f:
+        exp = [(row["Code"].strip(), row["Grouping_16"].strip()) for row in csv.DictReader(f)]
+
+    assert codelist_registry.codelist_rows(ETHNICITY, "Code", "Grouping_16") == exp
+
+
+def test_codelist_is_parsed_once():
+    with patch.object(codelist_registry, "_parse", wraps=codelist_registry._parse) as parse:
+        codelist_registry.codelist_rows(ETHNICITY, "Code", "Grouping_6")
+        codelist_registry.codelist_rows(ETHNICITY, "Code", "Grouping_16")
+
+        # A new process reads the binary cache instead of the CSV.
+        codelist_registry._tables.clear()
+        codelist_registry.codelist_rows(ETHNICITY, "Code")
+
+    assert parse.call_count == 1
+
+
+def test_cache_is_invalidated_by_hash():
+    codelist_registry.codelist_table(ETHNICITY)
+
+    with patch.object(codelist_registry, "_parse", wraps=codelist_registry._parse) as parse, \
+            patch.object(codelist_registry, "codelist_hash", return_value="updated"):
+        table = codelist_registry.codelist_table(ETHNICITY)
+
+    assert parse.call_count == 1
+    assert table["sha"] == "updated"
+
+
+def test_code_index():
+    index = codelist_registry.code_index(ETHNICITY, "Code")
+
+    assert index["Y9930"]["Grouping_6"] == "1"
+    assert index["Y9930"]["Description"] == "Race - British"
+
+
+def test_map_codes():
+    obs = codelist_registry.map_codes(
+        ETHNICITY, np.array(["Y9930", "not a code", "9S1.."]), "Code", "Grouping_16"
+    )
+
+    assert obs.tolist() == ["1", None, "1"]
+
+
+def test_codelist_files_reads_lazy_codelists():
+    # Codelists are built by `_<name>` functions on first access, so importing
+    # codelists.py parses no CSVs; their files are still found.
+    from analysis import definitions
+
+    assert definitions.codelist_files() == {
+        "ethnicity_codes": "opensafely-ethnicity.csv",
+        "cancer_death_codelist": "user-anna-schultze-cancer.csv",
+        "ethnicity_codes_16": "opensafely-ethnicity.csv",
+    }
+
+
+def test_unreadable_cache_is_a_miss():
+    # A pickle of a class that doesn't exist, as from another version.
+    codelist_registry.CACHE_PATH.write_bytes(
+        b"\x80\x04\x95\x0e\x00\x00\x00\x00\x00\x00\x00"
+        b"\x8c\x04nope\x94\x8c\x01X\x94\x93\x94."
+    )
+
+    assert codelist_registry._read_cache() == {}
+    assert codelist_registry.codelist_rows(ETHNICITY, "Code")
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas
+import pytest
+from analysis import cohort_schema, utilities
+
+
+def test_cohort_dtypes_follow_study_definition():
+    dtypes = cohort_schema.cohort_dtypes()
+
+    assert list(dtypes["age_group"].categories) == [*utilities.AGE_GROUPS, "missing"]
+    assert dtypes["age_group"].ordered
+    assert list(dtypes["imd"].categories) == [0, 1, 2, 3, 4, 5]
+    assert sorted(dtypes["sex"].categories) == sorted(utilities.SEX_LABELS)
+    assert sorted(dtypes["region"].categories) == sorted(utilities.NUTS1_CODES)
+    assert list(dtypes["ethnicity"].categories) == [0, *utilities.ETHNICITY_LABELS]
+    assert list(dtypes["ethnicity_16"].categories) == [0, *utilities.ETHNICITY_16_LABELS]
+    # Extracted, not resolved, ethnicity is numeric; STP and MSOA are open.
+    assert not {"eth", "ethnicity_sus", "stp", "msoa"} & set(dtypes)
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["F", None, "M", "F"],
+        pandas.Series(["F", None, "M", "F"], dtype="category"),
+        pandas.Categorical(["F", None, "M", "F"], categories=["M", "F", "U", "I"]),
+    ],
+)
+def test_encode_sex(values):
+    obs = cohort_schema.encode(values, "sex")
+
+    assert obs.dtype == np.int8
+    assert obs.tolist() == [1, -1, 0, 1]
+
+
+def test_encode_numbers_read_as_text():
+    obs = cohort_schema.encode(pandas.Series(["5", "0", "2"], dtype="category"), "imd")
+
+    assert obs.tolist() == [5, 0, 2]
+
+
+def test_encode_rejects_unknown_values():
+    with pytest.raises(ValueError, match="Narnia"):
+        cohort_schema.encode(["London", "Narnia"], "region")
+
+
+def test_decode_round_trip():
+    values = ["90+", "0-4", "missing", None]
+
+    obs = cohort_schema.decode(cohort_schema.encode(values, "age_group"), "age_group")
+
+    assert obs.dtype == cohort_schema.cohort_dtypes()["age_group"]
+    assert list(obs) == ["90+", "0-4", "missing", np.nan]
+
+
+def test_categorize_recodes_inferred_categories():
+    chunk = pandas.DataFrame(
+        {
+            "sex": pandas.Series(["U", "F"], dtype="category"),
+            "age": [30, 40],
+        }
+    )
+
+    obs = cohort_schema.categorize(chunk)
+
+    assert obs.sex.dtype == cohort_schema.cohort_dtypes()["sex"]
+    assert obs.sex.cat.codes.tolist() == [2, 1]
+    assert obs.age.tolist() == [30, 40]
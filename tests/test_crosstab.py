@@ -0,0 +1,107 @@
+import numpy as np
+import pandas
+from analysis import crosstab, utilities
+from pandas import testing
+
+
+def _chunk():
+    return pandas.DataFrame(
+        {
+            "sex": ["M", "F", "F", "M", "F", "U", "M", "F"],
+            "region": ["London", "East", "East", None, "East", "London", "London", "East"],
+            "imd": [0, 1, 2, 3, 1, 5, 1, 1],
+        }
+    )
+
+
+def test_joint_shape_has_a_cell_for_missing_values():
+    assert crosstab.joint_shape(["sex", "imd"]) == (5, 7)
+
+
+def test_joint_index_is_mixed_radix():
+    codes = [np.array([0, 1, -1], dtype="int8"), np.array([2, -1, 0], dtype="int8")]
+
+    obs = crosstab.joint_index(codes, (3, 4))
+
+    assert obs.tolist() == [0 * 4 + 2, 1 * 4 + 3, 2 * 4 + 0]
+
+
+def test_count_joint_matches_groupby():
+    chunk = _chunk()
+    variables = ["sex", "region", "imd"]
+
+    tensor = crosstab.count_joint(chunk, variables)
+
+    assert tensor.shape == crosstab.joint_shape(variables)
+    assert tensor.sum() == len(chunk)
+    # Female, East, IMD 1 is the first level of sex, the sixth of region, and
+    # the second of imd.
+    assert tensor[1, 5, 1] == 3
+    # Missing region is counted in the last cell of its axis.
+    assert tensor[0, -1, 3] == 1
+
+
+def test_marginal_follows_order_of_by():
+    variables = ["sex", "region", "imd"]
+    tensor = crosstab.count_joint(_chunk(), variables)
+
+    obs = crosstab.marginal(tensor, variables, ["imd", "sex"])
+
+    assert obs.shape == (7, 5)
+    np.testing.assert_array_equal(obs, tensor.sum(axis=1).T)
+
+
+def test_tensor_counts_matches_count_chunk():
+    chunk = _chunk()
+    by = ["region", "sex"]
+    tensor = crosstab.count_joint(chunk, by)
+
+    obs = utilities.merge_counts([crosstab.tensor_counts(tensor, by)], by)
+    exp = utilities.merge_counts([utilities.count_chunk(chunk, by)], by)
+    testing.assert_frame_equal(obs, exp)
+
+
+def test_joint_groupings_only_takes_categorical_variables():
+    groupings = {
+        "imd_sex": ["imd", "sex"],
+        "sex_region": ["region", "sex"],
+        "stp": ["stp"],
+        "age_sex": ["age", "sex"],
+    }
+
+    tensors = utilities.joint_groupings(groupings)
+
+    assert tensors == [(["imd_sex", "sex_region"], ["sex", "region", "imd"])]
+
+
+def test_joint_groupings_split_the_ethnicity_groupings():
+    groupings = {
+        "age_group_region_sex": ["age_group", "region", "sex"],
+        "ethnicity_region": ["ethnicity", "region"],
+        "ethnicity_16_region": ["ethnicity_16", "region"],
+    }
+
+    tensors = utilities.joint_groupings(groupings)
+
+    assert tensors == [
+        (["age_group_region_sex", "ethnicity_region"], ["age_group", "sex", "region", "ethnicity"]),
+        (["ethnicity_16_region"], ["region", "ethnicity_16"]),
+    ]
+    for _, variables in tensors:
+        assert np.prod(crosstab.joint_shape(variables)) <= crosstab.MAX_CELLS
+
+
+def test_table_tensor_inverts_tensor_counts():
+    by = ["region", "sex"]
+    tensor = crosstab.count_joint(_chunk(), by)
+    table = utilities.merge_counts([crosstab.tensor_counts(tensor, by)], by)
+
+    np.testing.assert_array_equal(crosstab.table_tensor(table, by), tensor)
+
+
+def test_shares():
+    tensor = np.array([[1, 3], [0, 0]])
+
+    obs = crosstab.shares(tensor, within=(0,))
+
+    np.testing.assert_array_equal(obs, [[25, 75], [np.nan, np.nan]])
@@ -0,0 +1,109 @@
+import pandas
+from analysis import deaths
+
+
+def test_expand_icd10():
+    assert deaths.expand_icd10("C00-C03") == ["C00", "C01", "C02", "C03"]
+    assert deaths.expand_icd10("C341") == ["C341"]
+
+
+def test_match_prefixes():
+    index = deaths.prefix_index(["C00-C02", "C341", "D01"])
+
+    obs = deaths.match_prefixes(["C01", "C019", "C34", "C341", "C3419", "D01", "C03", None], index)
+
+    assert obs.tolist() == [True, True, False, True, True, True, False, False]
+
+
+def test_match_prefixes_cancer_codelist():
+    index = deaths.prefix_index(deaths.codelist_rows(deaths.CANCER_CODELIST, "code"))
+
+    obs = deaths.match_prefixes(["C33", "C349", "C97", "I23", "U071"], index)
+
+    assert obs.tolist() == [True, True, True, False, False]
+
+
+def test_cause_of_death_matches_death_counts_ranges():
+    # The ranges the cause of death groups were defined by, compared as
+    # strings on the first three characters of the code.
+    def exp(code):
+        cause = code[:3]
+        if "C33" <= cause <= "C34":
+            return "Malignant neoplasm of trachea, bronchus and lung"
+        if "I20" <= cause <= "I25":
+            return "Ischaemic heart diseases"
+        if "I60" <= cause <= "I69":
+            return "Cerebrovascular diseases"
+        if cause == "U07":
+            return "COVID-19"
+        if "F01" <= cause <= "F03" or cause == "G30":
+            return "Dementia and Alzheimer disease"
+        return None
+
+    codes = ["C32", "C33", "C349", "C35", "F00", "F01", "F039", "G30", "G31",
+             "I19", "I20", "I259", "I26", "I60", "I699", "U071", "U072", "U10"]
+
+    assert deaths.cause_of_death(codes).tolist() == [exp(c) for c in codes]
+
+
+def test_classify_deaths():
+    chunk = pandas.DataFrame(
+        {
+            "died_date": ["2020-03-01", "2020-04-01", None],
+            "died_cause_ons": ["C341", "U071", None],
+            "region": ["East", "London", "East"],
+        }
+    )
+
+    obs = deaths.classify_deaths(chunk)
+
+    assert obs.died_any.tolist() == [1, 1, 0]
+    assert obs.Cause_of_Death.tolist() == [
+        "Malignant neoplasm of trachea, bronchus and lung", "COVID-19", None
+    ]
+    assert obs.died_cancer.tolist() == [1, 0, 0]
+
+
+def test_death_tables():
+    counts = pandas.DataFrame(
+        {
+            "region": ["East", "East", "East", "London"],
+            "Cause_of_Death": ["COVID-19", None, "Ischaemic heart diseases", "COVID-19"],
+            "died_cancer": [0, 1, 0, 0],
+            "died_any": [1, 1, 1, 1],
+            "N": [20, 30, 50, 40],
+        }
+    )
+    death_ons = pandas.DataFrame(
+        {"Cause_of_Death": ["COVID-19"], "Region": ["England"], "N": [1000], "Total": [4000]}
+    )
+
+    obs = deaths.death_count_table(counts, death_ons)
+
+    covid = obs[obs.Cause_of_Death == "COVID-19"].set_index(["region", "cohort"])
+    assert covid.N.to_dict() == {("England", "TPP"): 60, ("East", "TPP"): 20, ("London", "TPP"): 40, ("England", "ONS"): 1000}
+    assert covid.Total.to_dict() == {("England", "TPP"): 140, ("East", "TPP"): 100, ("London", "TPP"): 40, ("England", "ONS"): 4000}
+    assert obs.Cause_of_Death.notna().all()
+
+    cancer = deaths.death_cancer_table(counts).set_index("region")
+    assert cancer.N.tolist() == [30, 30, 0]
+    assert cancer.Total.tolist() == [140, 100, 40]
+
+
+def test_death_cancer_table_is_redacted():
+    counts = pandas.DataFrame(
+        {
+            "region": ["East", "East", "London", "London"],
+            "Cause_of_Death": [None, None, None, None],
+            "died_cancer": [1, 0, 1, 0],
+            "died_any": [1, 1, 1, 1],
+            "N": [3, 50, 20, 80],
+        }
+    )
+
+    obs = deaths.death_cancer_table(counts).set_index("region")
+
+    # East's 3 cancer deaths, and so its 50 others, are redacted, but not its total.
+    assert obs.N.isna().tolist() == [False, True, False]
+    assert obs.Total.tolist() == [155, 55, 100]
+    assert obs.percentage.isna().tolist() == [False, True, False]
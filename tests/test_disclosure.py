@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from analysis import disclosure
+from numpy import testing
+
+
+def test_round_to_nearest_rounds_halves_to_even():
+    obs = disclosure.round_to_nearest(np.array([2, 2.5, 7.5, 12.5, 13]), 5)
+    testing.assert_array_equal(obs, [0, 0, 10, 10, 15])
+
+
+def test_suppress_small_numbers():
+    obs = disclosure.suppress_small_numbers(np.array([0, 5, 6, 120]), 5)
+    testing.assert_array_equal(obs, [np.nan, np.nan, 6, 120])
+
+
+def test_redact_small_numbers_suppresses_next_smallest():
+    obs = disclosure.redact_small_numbers(np.array([0, 6, 3, 7]), 5)
+    testing.assert_array_equal(obs, [np.nan, np.nan, np.nan, 7])
+
+
+def test_redact_small_numbers_leaves_all_zero_small_counts():
+    obs = disclosure.redact_small_numbers(np.array([0, 6, 0, 7]), 5)
+    testing.assert_array_equal(obs, [0, 6, 0, 7])
+
+
+def test_redact_small_numbers_stops_once_protected():
+    obs = disclosure.redact_small_numbers(np.array([2, 4, 9, 30, 40]), 5)
+    testing.assert_array_equal(obs, [np.nan, np.nan, 9, 30, 40])
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+def test_redact_small_numbers_is_applied_per_line(axis):
+    table = np.array(
+        [
+            [0, 10, 4],
+            [6, 20, 30],
+            [3, 30, 50],
+            [7, 40, 60],
+        ]
+    )
+    if axis == 1:
+        table = table.T
+
+    obs = disclosure.redact_small_numbers(table, 5, axis=axis)
+
+    for i in range(table.shape[1 - axis]):
+        line = np.take(table, i, axis=1 - axis)
+        exp = disclosure.redact_small_numbers(line, 5)
+        testing.assert_array_equal(np.take(obs, i, axis=1 - axis), exp)
+
+
+def test_redact_table():
+    counts = np.array(
+        [
+            [1, 100],
+            [12, 200],
+            [22, 300],
+        ]
+    )
+
+    cells, totals, percentages = disclosure.redact_table(counts, threshold=5, k=5)
+
+    testing.assert_array_equal(cells, [[np.nan, 100], [np.nan, 200], [20, 300]])
+    testing.assert_array_equal(totals, [[35, 600]])
+    testing.assert_allclose(percentages, [[np.nan, 100 / 6], [np.nan, 100 / 3], [20 / 35 * 100, 50]])
+
+
+def test_redact_table_suppresses_small_totals():
+    _, totals, percentages = disclosure.redact_table(np.array([[1, 10], [2, 10]]))
+
+    testing.assert_array_equal(totals, [[np.nan, 20]])
+    assert np.isnan(percentages[:, 0]).all()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from analysis import definitions, dummy_data
+from analysis.utilities import iter_cohort_chunks, read_columnar
+from unittest.mock import patch
+
+
+def test_dummy_cohort_has_study_definition_columns():
+    chunk = next(dummy_data.generate_chunks(1000, seed=1))
+
+    expectations = definitions.variable_expectations()
+    assert list(chunk.columns) == ["patient_id", *expectations]
+    assert chunk["patient_id"].is_unique
+
+
+def test_dummy_values_follow_expectations():
+    chunk = next(dummy_data.generate_chunks(10_000, seed=1))
+    expectations = definitions.variable_expectations()
+
+    # Categorised variables take their categories, and the DEFAULT category
+    # when no rule matches.
+    for name in ["sex", "age_group", "region"]:
+        ratios = expectations[name]["return_expectations"]["category"]["ratios"]
+        assert set(chunk[name].dropna()) <= set(ratios) | {expectations[name].get("default")}
+    assert set(chunk["eth16"].dropna()) <= {str(k) for k in range(1, 17)}
+    assert chunk["imd"].dtype == "int64"
+    assert chunk["age"].between(0, 104).all()
+
+
+def test_dummy_cohort_is_reproducible_across_chunks():
+    # Blocks of 100 rows, so chunks both split and span blocks.
+    with patch.object(dummy_data, "BLOCK_ROWS", 100):
+        whole = pd.concat(dummy_data.generate_chunks(1000, chunksize=1000, seed=3))
+        again = pd.concat(dummy_data.generate_chunks(1000, chunksize=1000, seed=3))
+        chunks = list(dummy_data.generate_chunks(1000, chunksize=300, seed=3))
+        other = pd.concat(dummy_data.generate_chunks(1000, chunksize=1000, seed=4))
+
+    pd.testing.assert_frame_equal(whole, again)
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    pd.testing.assert_frame_equal(pd.concat(chunks), whole)
+    assert not whole["age"].equals(other["age"])
+
+
+def test_write_dummy_cohort(tmp_path):
+    csv = tmp_path / "input.csv.gz"
+    store = tmp_path / "input_columnar"
+    dummy_data.write_dummy_cohort(csv, 500, chunksize=200, seed=2)
+    dummy_data.write_dummy_cohort(store, 500, chunksize=200, seed=2)
+
+    from_csv = pd.concat(iter_cohort_chunks(csv))
+    from_store = read_columnar(store)
+    assert len(from_csv) == 500
+    for column in ["imd", "sex", "region", "ethnicity_16"]:
+        assert from_csv[column].tolist() == from_store[column].astype(from_csv[column].dtype).tolist()
+
+
+def test_dummy_dates_up_to_today_are_fixed():
+    spec = {
+        "returning": "date_of_death",
+        "return_expectations": {
+            "date": {"earliest": "2020-06-30", "latest": "today"},
+            "incidence": 1,
+        }
+    }
+
+    obs = dummy_data.generate_column(spec, 10_000, np.random.default_rng(1))
+
+    assert obs.max() <= dummy_data.TODAY
+    assert obs.min() >= "2020-06-30"
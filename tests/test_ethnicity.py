@@ -0,0 +1,59 @@
+import numpy as np
+import pandas
+from analysis import ethnicity
+from pandas import testing
+
+
+def _study_definition_ethnicity(eth, ethnicity_sus, n_groups):
+    """Resolves one patient's ethnicity with the rules the study definition used.
+
+    Each group k was `eth='k' OR (NOT eth AND ethnicity_sus='k')`, with
+    "0" as the DEFAULT.
+    """
+    for k in range(1, n_groups + 1):
+        if eth == str(k) or (not eth and ethnicity_sus == str(k)):
+            return k
+    return 0
+
+
+def test_resolve_ethnicity_matches_study_definition_rules():
+    values = ["", "1", "3", "5"]
+    pairs = [(eth, sus) for eth in values for sus in values]
+    chunk = pandas.DataFrame(
+        {
+            "eth": [eth for eth, _ in pairs],
+            "ethnicity_sus": [sus for _, sus in pairs],
+            "eth16": [sus for _, sus in pairs],
+            "ethnicity_sus16": [eth for eth, _ in pairs],
+        }
+    ).replace("", None)
+
+    obs = ethnicity.add_ethnicity(chunk)
+
+    assert obs["ethnicity"].tolist() == [_study_definition_ethnicity(e, s, 5) for e, s in pairs]
+    assert obs["ethnicity_16"].tolist() == [_study_definition_ethnicity(s, e, 16) for e, s in pairs]
+    assert "eth" not in obs and "ethnicity_sus16" not in obs
+
+
+def test_resolve_ethnicity_records_source():
+    groups, source = ethnicity.resolve_ethnicity(
+        [[1, np.nan], [np.nan, np.nan], [np.nan, 12]],
+        [[2, 3], [np.nan, np.nan], [np.nan, 4]],
+    )
+
+    np.testing.assert_array_equal(groups, [[1, 3], [0, 0], [0, 12]])
+    np.testing.assert_array_equal(
+        source,
+        [
+            [ethnicity.PRIMARY_CARE, ethnicity.SUS],
+            [ethnicity.MISSING, ethnicity.MISSING],
+            [ethnicity.MISSING, ethnicity.PRIMARY_CARE],
+        ],
+    )
+    assert groups.dtype == source.dtype == np.uint8
+
+
+def test_add_ethnicity_leaves_resolved_chunks():
+    chunk = pandas.DataFrame({"ethnicity": [1, 2], "ethnicity_16": [3, 4]})
+
+    testing.assert_frame_equal(ethnicity.add_ethnicity(chunk), chunk)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas
+from analysis import geometry
+from unittest.mock import patch
+
+
+def test_simplify_ring_drops_collinear_points():
+    square = np.array([[0, 0], [0.5, 0], [1, 0], [1, 1], [0.5, 1.0001], [0, 1], [0, 0]], dtype=float)
+
+    obs = geometry.simplify_ring(square, tolerance=0.01)
+
+    np.testing.assert_array_equal(obs, [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]])
+
+
+def test_stp_geometry_is_parsed_once(tmp_path):
+    cache_path = tmp_path / "geometry.npz"
+    with patch.object(geometry, "_geometries", {}), \
+            patch.object(geometry, "_parse", wraps=geometry._parse) as parse:
+        first = geometry.stp_geometry(cache_path=cache_path)
+        # A new process reads the binary cache instead of the GeoJSON.
+        geometry._geometries.clear()
+        second = geometry.stp_geometry(cache_path=cache_path)
+
+    assert parse.call_count == 1
+    assert len(first["codes"]) == 42
+    assert first["ring_offsets"][-1] == len(first["coords"])
+    for key in first:
+        np.testing.assert_array_equal(first[key], second[key])
+
+
+def test_area_index():
+    counts = pandas.DataFrame(
+        {
+            "msoa": ["M1", "M1", "M2", "M3", None],
+            "stp": ["S1", "S2", "S2", "S3", "S1"],
+            "region": ["East", "East", "London", "East", "East"],
+            "N": [10, 3, 5, 8, 100],
+        }
+    )
+
+    obs = geometry.area_index(counts, ["S2", "S1", "S9"], ["London", "East"])
+
+    assert list(obs["msoa"]) == ["M1", "M2", "M3"]
+    np.testing.assert_array_equal(obs["msoa_stp"], [1, 0, -1])
+    # S2 has 5 patients in London and 3 in the East.
+    np.testing.assert_array_equal(obs["stp_region"], [0, 1, -1])
+
+
+def test_totals_by():
+    obs = geometry.totals_by(["b", "a", "b", "z"], [1, 2, 3, 4], ["a", "b", "c"])
+
+    np.testing.assert_array_equal(obs, [2, 4, 0])
+
+
+def test_render_svg(tmp_path):
+    stps = geometry.stp_geometry()
+    values = np.arange(len(stps["codes"]), dtype=float)
+    values[0] = np.nan
+
+    geometry.render_svg(stps, values, tmp_path / "map.svg", "Title", labels=[(0, 52, "label")])
+
+    svg = (tmp_path / "map.svg").read_text()
+    assert svg.count("<path") == len(stps["codes"])
+    assert 'fill="#ffffff"' in svg
+    assert ">label</text>" in svg
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+from analysis import definitions, imd
+
+
+def test_imd_categorical_of_groups_is_ordered():
+    obs = imd.imd_categorical([1, 5, 0, 2])
+
+    assert obs.ordered
+    assert list(obs.categories) == ["1: Most deprived", "2", "3", "4", "5: Least deprived"]
+    assert obs.tolist()[:2] == ["1: Most deprived", "5: Least deprived"]
+    assert pd.isna(obs[2])
+    assert obs[0] < obs[3] < obs[1]
+
+
+def test_imd_categorical_labels_ons_quintiles():
+    imd_ons = pd.read_csv(definitions.ANALYSIS_DIR.parent / "data" / "imd_ons.csv.gz")
+
+    obs = imd.imd_categorical(imd_ons["imd"], unknown="Unknown")
+
+    assert list(obs.categories)[0] == "Unknown"
+    assert not obs.isna().any()
+    assert (obs.codes == imd_ons["imd"].to_numpy()).all()
@@ -0,0 +1,85 @@
+import json
+
+import pandas
+import pytest
+from analysis import instrumentation
+
+
+@instrumentation.instrumented()
+def _double(df):
+    return pandas.concat([df, df])
+
+
+def test_action_writes_stages(tmp_path, monkeypatch):
+    monkeypatch.delenv("PROFILE", raising=False)
+    df = pandas.DataFrame({"a": range(3)})
+
+    with instrumentation.action("test", logs_dir=tmp_path):
+        with instrumentation.stage("load", rows_in=12) as record:
+            record["rows_out"] = 3
+        _double(df)
+
+    with open(tmp_path / "test.json") as f:
+        run = json.load(f)
+    assert run["action"] == "test"
+    assert run["mode"] is None
+    stages = {s["stage"]: s for s in run["stages"]}
+    assert list(stages) == ["load", "_double", "test"]
+    # Rows are suppressed and rounded, as they may be counts of patients.
+    assert stages["load"]["rows_in"] == 10
+    assert stages["load"]["rows_out"] is None
+    assert stages["_double"]["rows_in"] is None
+    assert stages["_double"]["rows_out"] == 5
+    assert stages["_double"]["parent"] == "test"
+    assert stages["test"]["parent"] is None
+    for s in run["stages"]:
+        assert s["wall_seconds"] >= 0
+        assert s["cpu_seconds"] >= 0
+
+
+def test_instrumented_outside_an_action_is_not_recorded(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_records", [])
+
+    _double(pandas.DataFrame({"a": [1]}))
+
+    assert instrumentation._records == []
+
+
+def test_action_tracemalloc(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE", "tracemalloc")
+
+    with instrumentation.action("test", logs_dir=tmp_path):
+        with instrumentation.stage("allocate"):
+            data = bytearray(8 * 2**20)
+        del data
+
+    with open(tmp_path / "test.json") as f:
+        run = json.load(f)
+    stages = {s["stage"]: s for s in run["stages"]}
+    assert stages["allocate"]["peak_traced_mb"] >= 8
+    # The peak of a stage includes the peaks of the stages in it.
+    assert stages["test"]["peak_traced_mb"] >= stages["allocate"]["peak_traced_mb"]
+    assert run["top_allocations"]
+
+
+def test_action_cprofile(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE", "cprofile")
+
+    with instrumentation.action("test", logs_dir=tmp_path):
+        sum(range(1000))
+
+    assert (tmp_path / "test.prof").exists()
+
+
+def test_profile_mode_rejects_unknown_modes(monkeypatch):
+    monkeypatch.setenv("PROFILE", "perf")
+
+    with pytest.raises(ValueError, match="perf"):
+        instrumentation.profile_mode()
+
+
+def test_redact_rows():
+    assert instrumentation.redact_rows(None) is None
+    assert instrumentation.redact_rows(5) is None
+    assert instrumentation.redact_rows(6) == 5
+    assert instrumentation.redact_rows(1_234_568) == 1_234_570
@@ -0,0 +1,33 @@
+import sys
+import types
+
+import pytest
+from analysis import lazy
+
+
+def test_lazy_attributes_are_built_once(monkeypatch):
+    module = types.ModuleType("lazy_example")
+    calls = []
+
+    def _answer():
+        calls.append(1)
+        return 42
+
+    module.__getattr__ = lazy.lazy_attributes("lazy_example", {"answer": _answer})
+    monkeypatch.setitem(sys.modules, "lazy_example", module)
+
+    assert calls == []
+    from lazy_example import answer
+
+    assert answer == 42
+    assert module.answer == 42
+    assert calls == [1]
+
+
+def test_lazy_attributes_raise_attribute_error(monkeypatch):
+    module = types.ModuleType("lazy_example")
+    module.__getattr__ = lazy.lazy_attributes("lazy_example", {})
+    monkeypatch.setitem(sys.modules, "lazy_example", module)
+
+    with pytest.raises(AttributeError, match="missing"):
+        module.missing
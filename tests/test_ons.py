@@ -0,0 +1,88 @@
+import numpy as np
+import pandas
+import pytest
+from analysis import ons
+from pandas import testing
+from unittest.mock import patch
+
+
+@pytest.fixture
+def store():
+    return ons.ons_store()
+
+
+def test_ons_store_is_parsed_once(tmp_path):
+    cache_path = tmp_path / "ons.pickle"
+    with patch.object(ons, "_tables", {}), \
+            patch.object(ons, "_parse", wraps=ons._parse) as parse:
+        first = ons.ons_store(cache_path=cache_path)
+        # A new process reads the binary cache instead of the CSVs.
+        ons._tables.clear()
+        second = ons.ons_store(cache_path=cache_path)
+
+    assert parse.call_count == len(ons.ONS_TABLES)
+    for name in first:
+        if isinstance(first[name], pandas.Series):
+            testing.assert_series_equal(first[name], second[name])
+        else:
+            testing.assert_frame_equal(first[name], second[name])
+
+
+@pytest.mark.parametrize("name", list(ons.ONS_TABLES))
+def test_ons_tables_match_their_csv(store, name):
+    filename, dtypes = ons.ONS_TABLES[name]
+
+    exp = pandas.read_csv(ons.DATA_DIR / filename)
+
+    testing.assert_frame_equal(store[name], exp)
+    assert store[name].dtypes.astype(str).to_dict() == dtypes
+
+
+def test_region_totals(store):
+    regions = store["regions"]
+
+    assert len(regions) == 9
+    assert "England" not in set(regions.region)
+    england = store["denominators"]["England", "Total", ons.ALL_AGES]
+    assert regions.Total.sum() == england
+
+
+def test_denominators(store):
+    age_groups = store["age_group"]
+    london = age_groups[(age_groups.region == "London") & (age_groups.sex == "Female")]
+    keys = pandas.DataFrame(
+        {
+            "region": ["London", "London", "London", None],
+            "sex": ["Female", "Female", "Total", "Female"],
+            "age_group": ["0-4", ons.ALL_AGES, ons.ALL_AGES, "0-4"],
+        }
+    )
+
+    obs = ons.denominators(keys, store)
+
+    assert obs[0] == london.loc[london.age_group == "0-4", "N"].item()
+    assert obs[1] == london.N.sum()
+    assert obs[2] == ons.denominators(pandas.DataFrame({"region": ["London"]}), store)[0]
+    assert np.isnan(obs[3])
+
+
+def test_unreadable_cache_is_a_miss(tmp_path):
+    cache_path = tmp_path / "ons.pickle"
+    # A pickle of a class that doesn't exist, as from another pandas version.
+    cache_path.write_bytes(
+        b"\x80\x04\x95\x0e\x00\x00\x00\x00\x00\x00\x00"
+        b"\x8c\x04nope\x94\x8c\x01X\x94\x93\x94."
+    )
+
+    assert ons._read_cache(cache_path) == {}
+    with patch.object(ons, "_tables", {}):
+        store = ons.ons_store(cache_path=cache_path)
+    assert set(ons.ONS_TABLES) <= set(store)
+
+
+@pytest.mark.parametrize("name", list(ons.ONS_TABLES))
+def test_workbook_tables_match_their_csv(name):
+    # The committed CSVs were converted from the workbooks by ONS_process.R.
+    obs = ons.workbook_tables()[name]
+
+    testing.assert_frame_equal(obs, ons._parse(name, ons.DATA_DIR))
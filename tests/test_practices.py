@@ -0,0 +1,88 @@
+import numpy as np
+import pandas
+import pytest
+from analysis import crosstab, practices
+
+
+def _chunks():
+    return [
+        pandas.DataFrame(
+            {
+                "practice_id": [2**40 + 3, 1, 2**40 + 3, None],
+                "sex": ["M", "F", "F", "M"],
+                "age_group": ["0-4", "90+", "0-4", "5-9"],
+            }
+        ),
+        pandas.DataFrame(
+            {
+                "practice_id": [5, 2**40 + 3],
+                "sex": ["U", None],
+                "age_group": ["20-24", "missing"],
+            }
+        ),
+    ]
+
+
+def test_practice_codes_are_dense():
+    codes, index = practices.practice_codes([2**40, 7, None, 2**40])
+    codes, index = practices.practice_codes([7, 3], index)
+
+    assert codes.tolist() == [1, 2]
+    assert index.tolist() == [2**40, 7, 3]
+
+
+def test_count_practices_grows_with_practices():
+    counts, index = practices.count_practices(_chunks())
+
+    assert counts.shape == (3, *crosstab.joint_shape(practices.PRACTICE_VARIABLES))
+    assert index.tolist() == [2**40 + 3, 1, 5]
+    # Patients without a practice aren't counted.
+    np.testing.assert_array_equal(practices.registered(counts), [3, 1, 1])
+
+
+def test_count_practices_matches_groupby():
+    chunks = _chunks()
+    counts, index = practices.count_practices(chunks)
+    cohort = pandas.concat(chunks, ignore_index=True).dropna(subset=["practice_id"])
+
+    by_sex = practices.practice_marginal(counts, practices.PRACTICE_VARIABLES, ["sex"])
+
+    exp = cohort.groupby(["practice_id", "sex"]).size()
+    for (practice_id, sex), n in exp.items():
+        code = practices.cohort_schema.encode([sex], "sex")[0]
+        assert by_sex[index.get_loc(int(practice_id)), code] == n
+    # The first practice has a patient with no sex, in the last cell.
+    assert by_sex[0, -1] == 1
+
+
+def test_practice_mask():
+    mask = practices.practice_mask([2, 4, None])
+    mask = practices.practice_mask(pandas.Series([6, 2]), mask)
+
+    assert np.flatnonzero(mask).tolist() == [2, 4, 6]
+
+
+def test_practice_mask_rejects_raw_ids():
+    with pytest.raises(ValueError):
+        practices.practice_mask([1, practices.MAX_PRACTICES])
+
+
+def test_relevant_practices():
+    obs = practices.relevant_practices([0, 0, 1, 2, 2, -1], [0, np.nan, 1, 0, 3, 5])
+
+    assert obs.tolist() == [False, True, True]
+
+
+def test_practice_coverage():
+    total = practices.practice_mask([1, 2, 3, 4, 5])
+    included = practices.practice_mask([2, 3, 4, 5])
+
+    assert practices.practice_coverage(included, total) == 80
+
+
+def test_in_practices():
+    mask = practices.practice_mask([1, 3])
+
+    obs = practices.in_practices([3, 0, None, 9, 1], mask)
+
+    assert obs.tolist() == [True, False, False, False, True]
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas
+from analysis import crosstab, disclosure, sparse_crosstab
+from pandas import testing
+
+VARIABLES = ["sex", "age_group"]
+
+
+def _chunks(n=2000, n_msoas=40, seed=0):
+    rng = np.random.default_rng(seed)
+    msoas = np.array([f"E02{i:06d}" for i in range(n_msoas)] + [None], dtype=object)
+    cohort = pandas.DataFrame(
+        {
+            "msoa": rng.choice(msoas, n),
+            "sex": rng.choice(["M", "F", "U", None], n, p=[0.48, 0.48, 0.02, 0.02]),
+            "age_group": rng.choice(["0-4", "20-24", "45-49", "90+", "missing"], n),
+        }
+    )
+    return [cohort.iloc[i : i + 700] for i in range(0, n, 700)]
+
+
+def test_count_sparse_matches_groupby():
+    chunks = _chunks()
+
+    table = sparse_crosstab.count_sparse(chunks, VARIABLES)
+
+    assert table["areas"].is_monotonic_increasing
+    obs = sparse_crosstab.to_frame(table)
+    obs = obs.assign(sex=obs.sex.astype(object), age_group=obs.age_group.astype(object))
+    cohort = pandas.concat(chunks).dropna(subset=["msoa"])
+    exp = (
+        cohort.groupby(["msoa", "sex", "age_group"], dropna=False)
+        .size()
+        .rename("N")
+        .reset_index()
+        .rename(columns={"msoa": "area"})
+    )
+    key = ["area", "sex", "age_group"]
+    testing.assert_frame_equal(
+        obs.sort_values(key).reset_index(drop=True).fillna("?"),
+        exp.sort_values(key).reset_index(drop=True).fillna("?"),
+    )
+
+
+def test_sparse_table_is_canonical():
+    table = sparse_crosstab.count_sparse(_chunks(), VARIABLES)
+
+    keys = table["rows"] * 100_000 + table["cols"]
+    assert (np.diff(keys) > 0).all()
+    assert (table["data"] > 0).all()
+    indptr = sparse_crosstab.indptr(table)
+    assert indptr[-1] == len(table["data"])
+    np.testing.assert_array_equal(np.diff(indptr), np.bincount(table["rows"]))
+
+
+def test_marginal_matches_dense():
+    table = sparse_crosstab.count_sparse(_chunks(), VARIABLES)
+    dense = sparse_crosstab.to_dense(table).reshape(-1, *crosstab.joint_shape(VARIABLES))
+
+    obs = sparse_crosstab.marginal(table, ["sex"])
+
+    np.testing.assert_array_equal(sparse_crosstab.to_dense(obs), dense.sum(axis=2))
+
+
+def test_redact_matches_dense():
+    table = sparse_crosstab.count_sparse(_chunks(n=600), VARIABLES)
+    dense = sparse_crosstab.to_dense(table)
+
+    redacted, totals, percentages = sparse_crosstab.redact(table, threshold=5, k=5)
+
+    exp_cells, exp_totals, exp_percentages = disclosure.redact_table(dense, 5, 5, axis=1)
+    obs_cells = np.where(redacted["zeros_redacted"][:, None], np.nan, np.zeros(dense.shape))
+    obs_cells[redacted["rows"], redacted["cols"]] = redacted["data"]
+    np.testing.assert_array_equal(obs_cells, exp_cells)
+    np.testing.assert_array_equal(totals, exp_totals[:, 0])
+    np.testing.assert_array_equal(
+        percentages, exp_percentages[redacted["rows"], redacted["cols"]]
+    )
+
+
+def test_redact_suppresses_secondary_cells():
+    cohort = pandas.DataFrame(
+        {
+            "msoa": ["A"] * 2 + ["B"] * 20 + ["A"] * 14,
+            "sex": ["M"] * 2 + ["F"] * 20 + ["F"] * 6 + ["U"] * 8,
+            "age_group": ["0-4"] * 36,
+        }
+    )
+    table = sparse_crosstab.count_sparse([cohort], ["sex"])
+
+    redacted, totals, _ = sparse_crosstab.redact(table, threshold=5, k=5)
+
+    # In A, the 2 males are suppressed, and so are the 6 females, the next
+    # smallest; B's 20 females are kept, and so are its empty cells.
+    np.testing.assert_array_equal(redacted["data"], [np.nan, np.nan, 10, 20])
+    assert redacted["zeros_redacted"].tolist() == [True, False]
+    assert totals.tolist() == [15, 20]
@@ -0,0 +1,42 @@
+import pandas
+from analysis import definitions, split_cohort
+from analysis.dummy_data import write_dummy_cohort
+
+
+def test_combined_study_definition_has_both_cohorts_variables():
+    combined = definitions.variable_expectations("study_definition_combined")
+    main = definitions.variable_expectations("study_definition")
+    deaths = definitions.variable_expectations("study_definition_deaths")
+
+    for name, spec in main.items():
+        assert combined[name] == spec
+    for name, spec in deaths.items():
+        name = {"region": "region_at_death"}.get(name, name)
+        assert combined[name]["function"] == spec["function"]
+        assert combined[name]["returning"] == spec["returning"]
+
+
+def test_split_cohort(tmp_path):
+    combined = tmp_path / "input_combined.csv.gz"
+    write_dummy_cohort(combined, 2000, module="study_definition_combined", chunksize=700, seed=1)
+    outputs = {
+        "study_definition": tmp_path / "input.csv.gz",
+        "study_definition_deaths": tmp_path / "input_deaths.csv",
+    }
+
+    n_rows = split_cohort.split_cohort(combined, outputs, chunksize=300)
+
+    extract = pandas.read_csv(combined, dtype=str, keep_default_na=False)
+    main = pandas.read_csv(outputs["study_definition"], dtype=str, keep_default_na=False)
+    deaths = pandas.read_csv(outputs["study_definition_deaths"], dtype=str, keep_default_na=False)
+    assert list(main.columns) == split_cohort.cohort_columns("study_definition")
+    assert list(deaths.columns) == ["patient_id", "died_date", "died_cause_ons", "region"]
+    assert n_rows == {"study_definition": len(main), "study_definition_deaths": len(deaths)}
+
+    registered = extract[extract.registered == "1"]
+    pandas.testing.assert_frame_equal(
+        main, registered[main.columns].reset_index(drop=True)
+    )
+    died = extract[(extract.registered_at_death == "1") & (extract.died_date != "")]
+    assert deaths.patient_id.tolist() == died.patient_id.tolist()
+    assert deaths.region.tolist() == died.region_at_death.tolist()
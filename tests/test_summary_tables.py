@@ -0,0 +1,172 @@
+import pandas
+import pytest
+from analysis import summary_tables
+from pandas import testing
+
+
+@pytest.fixture
+def age_region_sex():
+    """Returns cohort counts by single year of age, region and sex."""
+    return pandas.DataFrame(
+        {
+            "age": pandas.Series([3, 3, 47, 92, 111, 120, 121]),
+            "region": pandas.Series(["East", "London", "East", None, "East", "London", "East"]),
+            "sex": pandas.Series(["F", "M", "F", "M", "F", "M", "U"]),
+            "N": pandas.Series([10, 20, 30, 40, 2, 1, 9]),
+        }
+    )
+
+
+def test_immortal_table(age_region_sex):
+    obs = summary_tables.immortal_table(age_region_sex)
+
+    exp = pandas.DataFrame(
+        {
+            "agerange": pandas.Series(["Over110", "Over120", "Under110", "is120"]),
+            "n": pandas.Series([2, 9, 100, 1]),
+        }
+    )
+    testing.assert_frame_equal(obs, exp)
+
+
+def test_immortal_rounded_table(age_region_sex):
+    obs = summary_tables.immortal_rounded_table(
+        summary_tables.immortal_table(age_region_sex)
+    )
+
+    exp = pandas.Series([pandas.NA, 7, 98, pandas.NA], dtype="Int64", name="n")
+    testing.assert_series_equal(obs["n"], exp)
+
+
+def test_tpp_coverage_table(age_region_sex):
+    nuts1_pop = pandas.DataFrame(
+        {
+            "region": pandas.Series(["East", "London", "South West"]),
+            "Total": pandas.Series([98, 200, 300]),
+        }
+    )
+
+    obs = summary_tables.tpp_coverage_table(age_region_sex, nuts1_pop)
+
+    assert list(obs.region) == ["East", "London", "South West"]
+    assert list(obs.nuts118cd) == ["UKH", "UKI", "UKK"]
+    # East has 51 patients with a known region, which rounds to 50.
+    assert obs.tpp_pop_all.tolist()[:2] == [50, 20]
+    assert obs.tpp_pop_all.isna().tolist() == [False, False, True]
+    assert obs.tpp_cov_all[0] == 50
+
+
+@pytest.fixture
+def age_group_region_sex():
+    """Returns cohort counts by age group, region and sex."""
+    return pandas.DataFrame(
+        {
+            "age_group": pandas.Series(["0-4", "0-4", "45-49", "90+", "90+", "90+", "90+", "missing"]),
+            "region": pandas.Series(["East", "London", "East", None, "East", "London", "East", "East"]),
+            "sex": pandas.Series(["F", "M", "F", "M", "F", "M", "U", "F"]),
+            "N": pandas.Series([10, 20, 30, 40, 2, 1, 9, 5]),
+        }
+    )
+
+
+def test_age_sex_tpp_table_adds_england(age_group_region_sex):
+    obs = summary_tables.age_sex_tpp_table(age_group_region_sex)
+
+    england = obs[obs.region == "England"].set_index(["sex", "age_group"])
+    assert england.loc[("Female", "0-4"), "N"] == 10
+    assert england.loc[("Male", "90+"), "N"] == 41
+    assert england.loc[("Female", "90+"), "Total"] == 42
+    # Patients of unknown age are left out.
+    assert obs.N.sum() == 2 * (age_group_region_sex.N.sum() - 5)
+
+
+def test_ons_comparison_table(age_group_region_sex):
+    obs = summary_tables.ons_comparison_table(age_group_region_sex)
+
+    obs = obs.set_index(["region", "sex", "age_group"]).sort_index()
+    assert len(obs) == 10 * 2 * 19
+    # Females in the East: 10 aged 0-4, 30 aged 45-49, and 2 aged 90+, which
+    # are suppressed; unknown ages and sexes are left out.
+    east = obs.loc[("East", "Female")]
+    assert east.Total.unique().tolist() == [40]
+    assert east.loc["0-4", "N"] == 10
+    assert east.loc["0-4", "percentage"] == 25
+    assert pandas.isna(east.loc["90+", "N"])
+    assert obs.loc[("England", "Male", "0-4"), "N"] == 20
+    row = obs.loc[("London", "Male", "0-4")]
+    assert row.percentage_ons == pytest.approx(row.N_ons / row.Total_ons * 100)
+    assert row.difference == pytest.approx(row.percentage - row.percentage_ons)
+    assert row.coverage == pytest.approx(row.N / row.N_ons * 100)
+    # Intervals are suppressed with their counts.
+    assert east.loc["0-4", "lower"] < 25 < east.loc["0-4", "upper"]
+    assert pandas.isna(east.loc["90+", "lower"])
+
+
+def test_imd_table_drop_unknown():
+    imd_sex = pandas.DataFrame(
+        {
+            "imd": pandas.Series([0, 1, 2, 1]),
+            "sex": pandas.Series(["F", "F", "F", "M"]),
+            "N": pandas.Series([100, 200, 300, 400]),
+        }
+    )
+    imd_ons = pandas.DataFrame(columns=["imd", "N", "sex", "cohort"])
+
+    obs = summary_tables.imd_table(imd_sex, imd_ons, drop_unknown=True)
+
+    assert set(obs.imd) == {"1: Most deprived", "2"}
+    females = obs[obs.sex == "Females"]
+    assert females.Total.tolist() == [500, 500]
+    assert females.percentage.tolist() == [40.0, 60.0]
+    assert (females.lower < females.percentage).all()
+    assert (females.upper > females.percentage).all()
+
+
+def test_imd_table_intervals_only_depend_on_published_counts():
+    imd_ons = pandas.DataFrame({"imd": [1], "N": [1000], "sex": ["Total"], "cohort": ["ONS"]})
+
+    def intervals(n):
+        imd_sex = pandas.DataFrame({"imd": [1, 2], "sex": ["F", "F"], "N": n})
+        obs = summary_tables.imd_table(imd_sex, imd_ons)
+        return obs.loc[obs.cohort == "TPP", ["N", "Total", "lower", "upper"]]
+
+    # Both round to 10 and 50, out of 60.
+    pandas.testing.assert_frame_equal(intervals([9, 51]), intervals([11, 49]))
+
+def test_tpp_stp_table():
+    msoa_stp_region = pandas.DataFrame(
+        {
+            "msoa": pandas.Series(["M1", "M2", "M3", "M4"]),
+            "stp": pandas.Series(["S1", "S1", "S2", None]),
+            "region": pandas.Series(["East", "East", "London", "East"]),
+            "N": pandas.Series([12, 9, 4, 50]),
+        }
+    )
+
+    obs = summary_tables.tpp_stp_table(msoa_stp_region)
+
+    assert obs.stp.tolist() == ["S1", "S2"]
+    testing.assert_series_equal(
+        obs.registered, pandas.Series([20, pandas.NA], dtype="Int64", name="registered")
+    )
+
+
+def test_ethnicity_completeness_table():
+    ethnicity_sources_region = pandas.DataFrame(
+        {
+            "ethnicity_source": pandas.Series([0, 1, 2, 1]),
+            "ethnicity_16_source": pandas.Series([0, 1, 1, 2]),
+            "region": pandas.Series(["East", "East", "East", "London"]),
+            "N": pandas.Series([10, 80, 10, 50]),
+        }
+    )
+
+    obs = summary_tables.ethnicity_completeness_table(ethnicity_sources_region)
+
+    england = obs[(obs.region == "England") & (obs.group == "5_2001")]
+    assert england.source.tolist() == ["Missing", "Primary care", "SUS"]
+    assert england.N.tolist() == [10, 130, 10]
+    assert england.Total.tolist() == [150] * 3
+    east = obs[(obs.region == "East") & (obs.group == "16_2001")]
+    assert east.source.tolist() == ["Missing", "Primary care"]
+    assert east.percentage.tolist() == [10, 90]
@@ -137,6 +137,12 @@ class TestDropIrrelevantPractices:
         obs = utilities.drop_irrelevant_practices(measure_table, 'practice')
         assert id(obs) != id(measure_table)
 
+    def test_large_practice_ids(self, measure_table):
+        # Pseudonymised IDs needn't be small.
+        measure_table["practice"] += 2**40
+        obs = utilities.drop_irrelevant_practices(measure_table, 'practice')
+        assert all(obs.practice.values == [2**40 + 2, 2**40 + 3, 2**40 + 4])
+
 
 def test_create_child_table(measure_table, codelist_table_from_csv):
     obs = utilities.create_child_table(
@@ -167,6 +173,49 @@ def test_create_child_table(measure_table, codelist_table_from_csv):
    
     testing.assert_frame_equal(obs, exp)
 
+def test_create_child_table_top_codes_from_codelist_csv():
+    measure_table = pandas.DataFrame(
+        {
+            "event_code": pandas.Categorical(
+                ["Y9930", "134B.", "XXXXX", "Y9930", None, "134B.", "134B."],
+                categories=["134B.", "Y9930", "XXXXX", "unused"],
+            ),
+            "event": [4, 1, 2, 3, 9, 1, 0],
+        }
+    )
+
+    obs = utilities.create_child_table(
+        measure_table, "codelists/opensafely-ethnicity.csv", "Code", "Description", nrows=2
+    )
+
+    # CTV3 codes aren't numeric, so they're kept as strings.
+    assert obs["Code"].tolist() == ["Y9930", "134B."]
+    assert obs["Events"].tolist() == [7, 2]
+    assert obs["Description"].tolist() == ["Race - British", "Race: Caucasian"]
+
+
+def test_create_child_table_breaks_ties_by_code(codelist_table_from_csv):
+    measure_table = pandas.DataFrame(
+        {"event_code": ["4", "3", "9", "2", "1"], "event": [1, 2, 5, 2, 2]}
+    )
+
+    obs = utilities.create_child_table(
+        measure_table, codelist_table_from_csv, "code", "term", nrows=3
+    )
+
+    # As if grouped by code and then sorted by events, not by first appearance.
+    assert obs["code"].tolist() == [9, 1, 2]
+
+
+def test_create_child_table_missing_description(measure_table, codelist_table_from_csv):
+    obs = utilities.create_child_table(
+        measure_table, codelist_table_from_csv.iloc[:1], "code", "term"
+    )
+
+    assert obs["Description"].iloc[0] == "Code 1"
+    assert pandas.isna(obs["Description"].iloc[1])
+
+
 def test_get_number_practices(measure_table):
     assert utilities.get_number_practices(measure_table) == 4
 
@@ -178,4 +227,295 @@ def test_get_percentage_practices(tmp_path, practice_count_table, measure_table)
 
             obs = utilities.get_percentage_practices(measure_table)
             
-            assert obs == 80
\ No newline at end of file
+            assert obs == 80
+
+def test_get_percentage_practices_of_large_ids(tmp_path, practice_count_table, measure_table):
+    # Pseudonymised IDs needn't be small.
+    practice_count_table["practice"] += 2**30
+    measure_table["practice"] += 2**30
+    with patch.object(utilities, "OUTPUT_DIR", tmp_path):
+        practice_count_table.to_csv(tmp_path / "input_practice_count_2021-01-01.csv")
+
+        assert utilities.get_percentage_practices(measure_table) == 80
+
+@pytest.fixture
+def cohort_file(tmp_path):
+    """Writes a small cohort like the one from study_definition.py to disk."""
+    cohort = pandas.DataFrame(
+        {
+            "patient_id": pandas.Series(range(1, 11)),
+            "stp": pandas.Series(["E54000005", "E54000006"] * 5),
+            "msoa": pandas.Series(["E02000001", "E02000002", "E02000003", None, "E02000001"] * 2),
+            "practice_id": pandas.Series([1, 1, 2, 2, 3, 3, 3, 4, 4, 4]),
+            "age": pandas.Series([0, 4, 17, 35, 42, 67, 90, 93, 111, 121]),
+            "age_group": pandas.Series(["0-4", "0-4", "15-19", "35-39", "40-44", "65-69", "90+", "90+", "90+", "90+"]),
+            "sex": pandas.Series(["M", "F", "F", "M", "F", "U", "M", "F", "I", "F"]),
+            "region": pandas.Series(["London", "London", "East", None, "East", "London", "North East", "East", "London", "East"]),
+            "imd": pandas.Series([0, 1, 2, 3, 4, 5, 1, 1, 2, 5]),
+            "ethnicity": pandas.Series([0, 1, 1, 2, 3, 4, 5, 1, 1, 0]),
+            "ethnicity_16": pandas.Series([0, 1, 2, 4, 8, 12, 16, 1, 3, 0]),
+        }
+    )
+    path = tmp_path / "input.csv.gz"
+    cohort.to_csv(path, index=False)
+    return path
+
+
+def test_count_cohort_matches_in_memory(cohort_file):
+    obs = utilities.count_cohort(cohort_file, chunksize=3)
+
+    cohort = pandas.read_csv(cohort_file, dtype=utilities.COHORT_DTYPES)
+    for name, by in utilities.COUNT_GROUPINGS.items():
+        exp = cohort.groupby(by, dropna=False).size().rename("N").reset_index()
+        testing.assert_frame_equal(obs[name], exp)
+
+
+def test_convert_cohort_round_trip(cohort_file, tmp_path):
+    store = tmp_path / "input_columnar"
+    schema = utilities.convert_cohort(cohort_file, store, chunksize=3)
+
+    assert schema["n_rows"] == 10
+    assert schema["columns"]["msoa"]["categories"] == ["E02000001", "E02000002", "E02000003"]
+
+    obs = utilities.read_columnar(store)
+    exp = pandas.read_csv(cohort_file, dtype=utilities.COHORT_DTYPES)
+    assert obs.age.dtype == np.int16
+    assert obs.practice_id.dtype == np.int32
+    assert isinstance(obs.sex.dtype, pandas.CategoricalDtype)
+    assert obs.sex.cat.codes.dtype == np.int8
+    assert schema["columns"]["imd"]["categories"] == [0, 1, 2, 3, 4, 5]
+    testing.assert_frame_equal(obs.astype(exp.dtypes.to_dict()), exp)
+
+
+def test_load_columns_only_opens_requested_columns(cohort_file, tmp_path):
+    store = tmp_path / "input_columnar"
+    utilities.convert_cohort(cohort_file, store)
+
+    obs = utilities.load_columns(store, ["age"])
+
+    assert list(obs) == ["age"]
+    assert obs["age"].tolist() == [0, 4, 17, 35, 42, 67, 90, 93, 111, 121]
+
+
+def test_count_cohort_from_columnar_store(cohort_file, tmp_path):
+    store = tmp_path / "input_columnar"
+    utilities.convert_cohort(cohort_file, store)
+
+    obs = utilities.count_cohort(store, chunksize=4)
+    exp = utilities.count_cohort(cohort_file, chunksize=4)
+    for name in utilities.COUNT_GROUPINGS:
+        testing.assert_frame_equal(obs[name], exp[name])
+
+
+def test_aggregate_key_depends_on_inputs():
+    key = utilities.aggregate_key(["imd", "sex"], "2020-06-30")
+
+    assert key == utilities.aggregate_key(["imd", "sex"], "2020-06-30")
+    assert key != utilities.aggregate_key(["imd", "sex"], "2023-04-30")
+    assert key != utilities.aggregate_key(["imd", "region"], "2020-06-30")
+
+
+def test_aggregate_key_includes_codelist_hashes():
+    with patch.object(utilities.definitions, "codelist_hash", return_value="changed"):
+        changed = utilities.aggregate_key(["ethnicity"], "2020-06-30")
+        unchanged = utilities.aggregate_key(["sex"], "2020-06-30")
+
+    assert changed != utilities.aggregate_key(["ethnicity"], "2020-06-30")
+    assert unchanged == utilities.aggregate_key(["sex"], "2020-06-30")
+
+
+def test_cached_count_cohort_reuses_cached_counts(cohort_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    groupings = {"imd_sex": ["imd", "sex"]}
+
+    first = utilities.cached_count_cohort(cohort_file, groupings, "2020-06-30", cache_dir)
+    with patch.object(utilities, "count_cohort") as count_cohort:
+        second = utilities.cached_count_cohort(cohort_file, groupings, "2020-06-30", cache_dir)
+
+    count_cohort.assert_not_called()
+    testing.assert_frame_equal(first["imd_sex"], second["imd_sex"])
+
+
+def test_aggregate_key_depends_on_cohort_and_split():
+    key = utilities.aggregate_key(["sex"], "2020-06-30", cohort="a")
+
+    assert key != utilities.aggregate_key(["sex"], "2020-06-30", cohort="b")
+    with patch.object(utilities, "COHORT_SCRIPTS", ["split_cohort.py", "deaths.py"]):
+        assert key != utilities.aggregate_key(["sex"], "2020-06-30", cohort="a")
+
+
+def test_cached_count_cohort_recounts_a_reextracted_cohort(cohort_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    groupings = {"sex": ["sex"]}
+    first = utilities.cached_count_cohort(cohort_file, groupings, "2020-06-30", cache_dir)
+
+    cohort = pandas.read_csv(cohort_file)
+    cohort.assign(sex="M").to_csv(cohort_file, index=False)
+    second = utilities.cached_count_cohort(cohort_file, groupings, "2020-06-30", cache_dir)
+
+    assert first["sex"].N.sum() == second["sex"].N.sum() == 10
+    assert second["sex"].set_index("sex").N["M"] == 10
+
+
+def test_cohort_fingerprint_of_store(cohort_file, tmp_path):
+    store = tmp_path / "input_columnar"
+    utilities.convert_cohort(cohort_file, store)
+    fingerprint = utilities.cohort_fingerprint(store)
+
+    # The same cohort, converted elsewhere and in other chunks, has the same
+    # fingerprint; it is read from the schema, not the columns.
+    copy = tmp_path / "copy"
+    utilities.convert_cohort(cohort_file, copy, chunksize=2)
+    (copy / "sex.bin").write_bytes(b"")
+    assert utilities.cohort_fingerprint(copy) == fingerprint
+
+    cohort = pandas.read_csv(cohort_file)
+    cohort.assign(sex="M").to_csv(cohort_file, index=False)
+    utilities.convert_cohort(cohort_file, store)
+    assert utilities.cohort_fingerprint(store) != fingerprint
+
+
+def test_load_snapshot_counts(cohort_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    groupings = {"stp": ["stp"]}
+    for index_date in ["2020-06-30", "2023-04-30"]:
+        utilities.cached_count_cohort(cohort_file, groupings, index_date, cache_dir)
+
+    obs = utilities.load_snapshot_counts("stp", groupings, cache_dir)
+
+    assert obs.index_date.tolist() == ["2020-06-30"] * 2 + ["2023-04-30"] * 2
+    assert obs.N.tolist() == [5, 5, 5, 5]
+
+
+@pytest.mark.parametrize("partition_by", [None, "region", "stp", "msoa", "imd"])
+def test_parallel_count_cohort_matches_serial(cohort_file, tmp_path, partition_by):
+    store = tmp_path / "input_columnar"
+    utilities.convert_cohort(cohort_file, store)
+
+    obs = utilities.parallel_count_cohort(
+        store, partition_by=partition_by, max_workers=2, chunksize=2
+    )
+    exp = utilities.count_cohort(store)
+    for name in utilities.COUNT_GROUPINGS:
+        testing.assert_frame_equal(obs[name], exp[name])
+
+
+def test_iter_cohort_chunks_resolves_ethnicity(tmp_path):
+    path = tmp_path / "input.csv"
+    pandas.DataFrame(
+        {
+            "patient_id": [1, 2, 3],
+            "region": ["East", "London", "East"],
+            "eth": [1, None, None],
+            "ethnicity_sus": [2, 4, None],
+            "eth16": [None, 7, None],
+            "ethnicity_sus16": [None, 9, 2],
+        }
+    ).to_csv(path, index=False)
+
+    obs = pandas.concat(
+        utilities.iter_cohort_chunks(path, columns=["ethnicity", "ethnicity_16_source"], chunksize=2)
+    )
+
+    assert list(obs.columns) == ["ethnicity", "ethnicity_16_source"]
+    assert obs.ethnicity.tolist() == [1, 4, 0]
+    assert obs.ethnicity_16_source.tolist() == [0, 1, 2]
+
+
+def test_wilson_intervals():
+    lower, upper = utilities.wilson_intervals([0, 50, 10], [10, 100, 0])
+
+    # The interval for 0 out of 10 is [0, 27.75]%.
+    assert lower[0] == pytest.approx(0)
+    assert upper[0] == pytest.approx(27.753, abs=1e-3)
+    assert lower[1] == pytest.approx(100 - upper[1])
+    assert np.isnan(lower[2]) and np.isnan(upper[2])
+
+
+def test_bootstrap_intervals_agree_with_wilson():
+    counts = np.array([[200, 300, 500], [0, 0, 0], [10, 0, 990]])
+
+    lower, upper = utilities.bootstrap_intervals(counts, replicates=4000)
+
+    exp_lower, exp_upper = utilities.wilson_intervals(counts, counts.sum(axis=1)[:, None])
+    np.testing.assert_allclose(lower[0], exp_lower[0], atol=0.5)
+    np.testing.assert_allclose(upper[0], exp_upper[0], atol=0.5)
+    assert np.isnan(lower[1]).all()
+    # A category with no patients has no variability.
+    assert lower[2, 1] == upper[2, 1] == 0
+
+
+def test_bootstrap_intervals_in_blocks():
+    counts = np.random.default_rng(0).integers(1, 100, (7, 4))
+
+    # Blocks of 100 replicated counts are 2 rows at a time.
+    with patch.object(utilities, "BOOTSTRAP_CELLS", 400):
+        lower, upper = utilities.bootstrap_intervals(counts, replicates=50)
+
+    assert lower.shape == upper.shape == counts.shape
+    assert not np.isnan(lower).any()
+    assert (lower <= upper).all()
+
+
+@pytest.mark.parametrize("method", ["bootstrap", "wilson"])
+def test_percentage_intervals(method):
+    table = pandas.DataFrame(
+        {
+            "region": ["East", "East", "London", "London"],
+            "sex": ["F", "M", "F", "M"],
+            "N": [300, 100, 50, 50],
+        }
+    )
+
+    obs = utilities.percentage_intervals(table, ["sex"], ["region"], method=method)
+
+    assert obs.percentage.tolist() == [75, 25, 50, 50]
+    assert (obs.lower < obs.percentage).all()
+    assert (obs.upper > obs.percentage).all()
+    assert obs.upper[2] - obs.lower[2] > obs.upper[0] - obs.lower[0]
+
+
+
+def test_percentage_intervals_are_suppressed_with_their_counts():
+    table = pandas.DataFrame(
+        {
+            "region": ["East", "East", "East", "London", "London"],
+            "sex": ["F", "M", "U", "F", "M"],
+            "N": [300, 100, 5, 2, 3],
+        }
+    )
+    table.loc[2, "N"] = np.nan
+
+    obs = utilities.percentage_intervals(table, ["sex"], ["region"])
+
+    assert obs.percentage[:2].round(2).tolist() == [75, 25]
+    assert obs.lower[:2].notna().all()
+    # A missing count, and a group whose total is too small to publish.
+    assert obs.lower[2:].isna().all()
+    assert obs.upper[2:].isna().all()
+
+
+@pytest.mark.parametrize("method", ["bootstrap", "wilson"])
+def test_percentage_intervals_of_published_totals(method):
+    table = pandas.DataFrame(
+        {
+            "region": ["East", "East", "East"],
+            "sex": ["F", "M", "U"],
+            "N": pandas.array([300, 100, pandas.NA], dtype="Int64"),
+            "Total": pandas.array([405, 405, 405], dtype="Int64"),
+        }
+    )
+
+    obs = utilities.percentage_intervals(
+        table, ["sex"], ["region"], method=method, total="Total"
+    )
+
+    np.testing.assert_allclose(obs.percentage[:2], [300 / 4.05, 100 / 4.05])
+    assert (obs.lower[:2] < obs.percentage[:2]).all()
+    assert (obs.upper[:2] > obs.percentage[:2]).all()
+    assert np.isnan(obs.lower[2])
+
+def test_partition_ranges_are_balanced():
+    assert utilities.partition_ranges(10, 4) == [(0, 2), (2, 5), (5, 7), (7, 10)]
+    assert utilities.partition_ranges(2, 4) == [(0, 1), (1, 2)]
+    assert utilities.partition_ranges(0, 4) == []